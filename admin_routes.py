@@ -285,6 +285,7 @@ def get_whatsapp_thread_messages(thread_id):
 def delete_whatsapp_thread(thread_id):
     """Delete all messages associated with a WhatsApp thread_id"""
     from whatsapp_bot import WhatsAppMessage  # Import local
+    from whatsapp_cache import forget_thread
 
     try:
         if not session.get('is_admin'):
@@ -297,6 +298,7 @@ def delete_whatsapp_thread(thread_id):
         if message_count > 0:
             WhatsAppMessage.query.filter_by(thread_id=thread_id).delete()
             db.session.commit()
+            forget_thread(thread_id)
             logger.info(f"Conversation WhatsApp thread {thread_id} ({message_count} messages) supprimée avec succès.")
             return jsonify({'success': True, 'message': 'WhatsApp conversation deleted successfully'})
         else:
@@ -876,4 +878,27 @@ def admin_platform_stats(platform):
 
     except Exception as e:
         logger.error(f"Error fetching stats for platform {platform}: {e}")
-        return jsonify({"error": "Failed to retrieve statistics"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to retrieve statistics"}), 500
+
+@admin_bp.route('/rate-limits', methods=['GET'])
+def admin_rate_limits():
+    """Métriques de limitation de débit des bots (messages acceptés, refusés, expéditeurs les plus limités)"""
+    from rate_limiter import get_rate_limit_stats
+
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return jsonify(get_rate_limit_stats())
+
+@admin_bp.route('/image-cache', methods=['GET'])
+def admin_image_cache():
+    """Métriques du traitement d'images (cache OCR/uploads, normalisation, disjoncteur Mathpix)"""
+    from image_cache import get_image_cache_stats
+    from image_preprocessing import get_preprocessing_stats
+    from mathpix_utils import get_mathpix_stats
+
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    stats = get_image_cache_stats()
+    stats['preprocessing'] = get_preprocessing_stats()
+    stats['mathpix'] = get_mathpix_stats()
+    return jsonify(stats)
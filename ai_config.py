@@ -2,8 +2,11 @@ import os
 import json
 import logging
 import time
+import threading
+from collections import deque
 from typing import Optional
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from ai_gateway import http_client_options
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
@@ -27,6 +30,238 @@ deepseek_client: Optional[OpenAI] = None
 qwen_client: Optional[OpenAI] = None
 gemini_openai_client: Optional[OpenAI] = None
 
+# ===================================
+# POOL DE CLÉS PAR FOURNISSEUR
+# ===================================
+# Chaque fournisseur accepte une liste de clés (<PREFIX>_API_KEYS="k1,k2,...") en plus de la clé
+# unique historique. Pour OpenAI, les clés doivent appartenir au même projet (threads Assistant partagés).
+
+PROVIDER_SETTINGS = {
+    'openai': {'env': 'OPENAI_API_KEY', 'base_url': None},
+    'deepseek': {'env': 'DEEPSEEK_API_KEY', 'base_url': "https://api.deepseek.com"},
+    'qwen': {'env': 'DASHSCOPE_API_KEY', 'base_url': "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"},
+    'gemini': {'env': 'GEMINI_API_KEY', 'base_url': "https://generativelanguage.googleapis.com/v1beta/openai/"},
+}
+
+KEY_POOL_STRATEGY = os.environ.get('API_KEY_POOL_STRATEGY', 'round_robin')  # 'round_robin' ou 'least_loaded'
+KEY_QUARANTINE_SECONDS = int(os.environ.get('API_KEY_QUARANTINE_SECONDS', '3600'))
+KEY_LOAD_WINDOW_SECONDS = 60  # Fenêtre de calcul de la charge pour 'least_loaded'
+
+
+class PooledKey:
+    """Une clé API, ses clients (sync et async) et son état (backoff 429, quarantaine 401/403, charge récente)"""
+
+    def __init__(self, provider: str, api_key: str, base_url: Optional[str]):
+        self.provider = provider
+        self.api_key = api_key
+        self.base_url = base_url
+        self._async_client = None
+        self.cooldown_until = 0.0
+        self.quarantined_until = 0.0
+        self.consecutive_429 = 0
+        self.recent_requests = deque()
+        self.lock = threading.Lock()
+
+        http_client = DefaultHttpxClient(**http_client_options(), event_hooks={
+            'request': [self._on_request],
+            'response': [self._on_response]
+        })
+        kwargs = {"api_key": api_key, "http_client": http_client}
+        if base_url:
+            kwargs["base_url"] = base_url
+        self.client = OpenAI(**kwargs)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Client asynchrone (créé à la demande, utilisé uniquement sur la boucle de ai_gateway)"""
+        if self._async_client is None:
+            http_client = DefaultAsyncHttpxClient(**http_client_options(), event_hooks={
+                'request': [self._on_async_request],
+                'response': [self._on_async_response]
+            })
+            kwargs = {"api_key": self.api_key, "http_client": http_client}
+            if self.base_url:
+                kwargs["base_url"] = self.base_url
+            self._async_client = AsyncOpenAI(**kwargs)
+        return self._async_client
+
+    @property
+    def label(self) -> str:
+        """Identifiant masqué de la clé pour les logs"""
+        return f"{self.provider}:...{self.api_key[-4:]}"
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.cooldown_until and now >= self.quarantined_until
+
+    def load(self, now: float) -> int:
+        """Nombre de requêtes envoyées sur la fenêtre récente"""
+        with self.lock:
+            while self.recent_requests and self.recent_requests[0] < now - KEY_LOAD_WINDOW_SECONDS:
+                self.recent_requests.popleft()
+            return len(self.recent_requests)
+
+    def _on_request(self, request):
+        with self.lock:
+            self.recent_requests.append(time.time())
+
+    def _on_response(self, response):
+        status = response.status_code
+        with self.lock:
+            if status == 429:
+                self.consecutive_429 += 1
+                retry_after = _parse_retry_after(response.headers)
+                backoff = retry_after if retry_after is not None else min(2 ** self.consecutive_429, 60)
+                self.cooldown_until = time.time() + backoff
+                logger.warning(f"🔑 Clé {self.label} limitée (429), mise en pause {backoff:.1f}s")
+            elif status in (401, 403):
+                self.quarantined_until = time.time() + KEY_QUARANTINE_SECONDS
+                logger.error(f"🔑 Clé {self.label} rejetée ({status}), mise en quarantaine {KEY_QUARANTINE_SECONDS}s")
+            elif status < 400:
+                self.consecutive_429 = 0
+
+    async def _on_async_request(self, request):
+        self._on_request(request)
+
+    async def _on_async_response(self, response):
+        self._on_response(response)
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    """Lit Retry-After / retry-after-ms (secondes)"""
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class ClientKeyPool:
+    """Sélectionne une clé disponible pour chaque appel (round-robin ou moins chargée)"""
+
+    def __init__(self, provider: str, api_keys, base_url: Optional[str] = None, strategy: str = KEY_POOL_STRATEGY):
+        self.provider = provider
+        self.keys = [PooledKey(provider, key, base_url) for key in api_keys]
+        self.strategy = strategy
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> OpenAI:
+        """Retourne le client sync d'une clé disponible"""
+        return self._select_key().client
+
+    def acquire_async(self) -> AsyncOpenAI:
+        """Retourne le client async d'une clé disponible"""
+        return self._select_key().async_client
+
+    def _select_key(self) -> PooledKey:
+        """
+        Choisit une clé disponible.
+        Si toutes les clés sont en pause, retourne celle dont la pause finit le plus tôt
+        (le SDK gère alors ses propres retries) ; une clé en quarantaine n'est jamais choisie
+        tant qu'une autre clé est utilisable.
+        """
+        now = time.time()
+        available = [k for k in self.keys if k.is_available(now)]
+
+        if not available:
+            usable = [k for k in self.keys if now >= k.quarantined_until] or self.keys
+            key = min(usable, key=lambda k: max(k.cooldown_until, k.quarantined_until))
+            logger.warning(f"Aucune clé {self.provider} disponible, utilisation de {key.label}")
+            return key
+
+        if self.strategy == 'least_loaded':
+            return min(available, key=lambda k: k.load(now))
+
+        with self._lock:
+            for _ in range(len(self.keys)):
+                key = self.keys[self._index % len(self.keys)]
+                self._index += 1
+                if key in available:
+                    return key
+        return available[0]
+
+    def stats(self):
+        """État de chaque clé (pour le monitoring)"""
+        now = time.time()
+        return [{
+            'key': k.label,
+            'available': k.is_available(now),
+            'cooldown_remaining': max(0, round(k.cooldown_until - now, 1)),
+            'quarantined': now < k.quarantined_until,
+            'requests_last_minute': k.load(now)
+        } for k in self.keys]
+
+
+_key_pools = {}
+_key_pools_lock = threading.Lock()
+
+
+def _get_provider_keys(provider: str):
+    """Lit <PREFIX>_API_KEYS (liste séparée par des virgules), sinon la clé unique <PREFIX>_API_KEY"""
+    env_name = PROVIDER_SETTINGS[provider]['env']
+    keys = [k.strip() for k in os.getenv(env_name + 'S', '').split(',') if k.strip()]
+    if not keys and os.getenv(env_name):
+        keys = [os.getenv(env_name)]
+    return keys
+
+
+def _get_key_pool(provider: str) -> Optional[ClientKeyPool]:
+    """Retourne (en l'initialisant au besoin) le pool de clés du fournisseur, ou None sans clé"""
+    global openai_client, deepseek_client, qwen_client, gemini_openai_client
+
+    pool = _key_pools.get(provider)
+    if pool is None:
+        with _key_pools_lock:
+            pool = _key_pools.get(provider)
+            if pool is None:
+                keys = _get_provider_keys(provider)
+                if not keys:
+                    return None
+                pool = ClientKeyPool(provider, keys, PROVIDER_SETTINGS[provider]['base_url'])
+                _key_pools[provider] = pool
+                logger.info(f"Pool de clés {provider} initialisé ({len(keys)} clé(s), stratégie {pool.strategy})")
+
+                # Rétrocompatibilité : les globals pointent vers le client de la première clé
+                first_client = pool.keys[0].client
+                if provider == 'openai':
+                    openai_client = first_client
+                elif provider == 'deepseek':
+                    deepseek_client = first_client
+                elif provider == 'qwen':
+                    qwen_client = first_client
+                elif provider == 'gemini':
+                    gemini_openai_client = first_client
+
+    return pool
+
+
+def get_provider_client(provider: str) -> Optional[OpenAI]:
+    """
+    Retourne un client pour le fournisseur en choisissant une clé dans son pool.
+
+    Args:
+        provider: 'openai', 'deepseek', 'qwen' ou 'gemini'
+
+    Returns:
+        OpenAI ou None si aucune clé n'est configurée
+    """
+    pool = _get_key_pool(provider)
+    return pool.acquire() if pool else None
+
+
+def get_async_provider_client(provider: str) -> Optional[AsyncOpenAI]:
+    """Équivalent async de get_provider_client (à n'utiliser que via ai_gateway)"""
+    pool = _get_key_pool(provider)
+    return pool.acquire_async() if pool else None
+
+
+def get_key_pool_stats():
+    """Retourne l'état des pools de clés initialisés"""
+    return {provider: pool.stats() for provider, pool in _key_pools.items()}
+
 ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
 CONTEXT_MESSAGE_LIMIT = int(os.environ.get('CONTEXT_MESSAGE_LIMIT', '30'))
 
@@ -112,64 +347,74 @@ if not CURRENT_MODEL:
 # FONCTIONS DE SÉLECTION
 # ===================================
 
-def get_ai_client():
-    """Retourne le client IA approprié selon le modèle actuel"""
-    global openai_client, deepseek_client, qwen_client, gemini_openai_client
+def _get_model_client(model: Optional[str], client_getter):
+    """Résout le fournisseur du modèle et retourne son client via client_getter (sync ou async)"""
+    model = model or CURRENT_MODEL
 
     # Deepseek models
-    if CURRENT_MODEL in ['deepseek', 'deepseek-reasoner']:
-        if deepseek_client is None:
-            deepseek_client = _create_openai_client(os.getenv('DEEPSEEK_API_KEY'), base_url="https://api.deepseek.com")
-        if deepseek_client is None:
+    if model in ['deepseek', 'deepseek-reasoner']:
+        client = client_getter('deepseek')
+        if client is None:
             raise RuntimeError("Deepseek client not configured. Set DEEPSEEK_API_KEY or change CURRENT_MODEL.")
-        return deepseek_client
+        return client
 
     # Qwen
-    if CURRENT_MODEL == 'qwen':
-        if qwen_client is None:
-            qwen_client = _create_openai_client(os.getenv('DASHSCOPE_API_KEY'), base_url="https://dashscope-intl.aliyuncs.com/compatible-mode/v1")
-        if qwen_client is None:
+    if model == 'qwen':
+        client = client_getter('qwen')
+        if client is None:
             raise RuntimeError("Qwen client not configured. Set DASHSCOPE_API_KEY.")
-        return qwen_client
+        return client
 
     # Gemini
-    if CURRENT_MODEL == 'gemini':
-        if gemini_openai_client is None:
-            gemini_openai_client = _create_openai_client(os.getenv('GEMINI_API_KEY'), base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
-        if gemini_openai_client is None:
+    if model == 'gemini':
+        client = client_getter('gemini')
+        if client is None:
             raise RuntimeError("Gemini client not configured. Set GEMINI_API_KEY.")
-        return gemini_openai_client
+        return client
 
     # Default / openai
-    if openai_client is None:
-        openai_client = _create_openai_client(os.getenv('OPENAI_API_KEY'))
-    if openai_client:
-        return openai_client
+    client = client_getter('openai')
+    if client:
+        return client
 
     # Fallback: if OpenAI not configured, prefer Deepseek if available
-    if os.getenv('DEEPSEEK_API_KEY'):
-        if deepseek_client is None:
-            deepseek_client = _create_openai_client(os.getenv('DEEPSEEK_API_KEY'), base_url="https://api.deepseek.com")
-        if deepseek_client:
-            return deepseek_client
+    client = client_getter('deepseek')
+    if client:
+        return client
+
+    raise RuntimeError("No AI client configured for CURRENT_MODEL='%s'. Set the appropriate API key in environment." % model)
+
 
-    raise RuntimeError("No AI client configured for CURRENT_MODEL='%s'. Set the appropriate API key in environment." % CURRENT_MODEL)
+def get_ai_client(model: Optional[str] = None):
+    """
+    Retourne le client IA approprié (clé choisie dans le pool du fournisseur).
+
+    Args:
+        model: Modèle ciblé (par défaut CURRENT_MODEL), ex: choix du routeur de modèles
+    """
+    return _get_model_client(model, get_provider_client)
 
 
-def get_model_name():
-    """Retourne le nom du modèle approprié selon le modèle actuel"""
-    if CURRENT_MODEL == 'deepseek':
+def get_async_ai_client(model: Optional[str] = None):
+    """Équivalent async de get_ai_client (à n'utiliser que via ai_gateway)"""
+    return _get_model_client(model, get_async_provider_client)
+
+
+def get_model_name(model: Optional[str] = None):
+    """Retourne le nom du modèle approprié selon le modèle actuel (ou le modèle fourni)"""
+    model = model or CURRENT_MODEL
+    if model == 'deepseek':
         return "deepseek-chat"
-    elif CURRENT_MODEL == 'deepseek-reasoner':
+    elif model == 'deepseek-reasoner':
         return "deepseek-reasoner"
-    elif CURRENT_MODEL == 'qwen':
+    elif model == 'qwen':
         return "qwen-max-latest"
-    elif CURRENT_MODEL == 'gemini':
+    elif model == 'gemini':
         return "gemini-2.5-flash-preview-04-17"
     return None
 
 
-def get_system_instructions(context='chat'):
+def get_system_instructions(context='chat', model=None):
     """
     Retourne les instructions système appropriées selon le modèle actuel et le contexte
     
@@ -177,29 +422,31 @@ def get_system_instructions(context='chat'):
         context (str): Le contexte d'utilisation ('chat' ou 'lesson')
                       - 'chat': Ton familier, emojis, conversationnel
                       - 'lesson': Ton factuel, neutre, académique
+        model (str): Modèle ciblé (par défaut CURRENT_MODEL)
     
     Returns:
         str: Les instructions système appropriées
     """
+    model = model or CURRENT_MODEL
     if context == 'lesson':
         # Instructions pour le traitement des cours (ton factuel)
-        if CURRENT_MODEL == 'deepseek':
+        if model == 'deepseek':
             return DEEPSEEK_LESSON_INSTRUCTIONS
-        elif CURRENT_MODEL == 'deepseek-reasoner':
+        elif model == 'deepseek-reasoner':
             return DEEPSEEK_REASONER_LESSON_INSTRUCTIONS
-        elif CURRENT_MODEL == 'qwen':
+        elif model == 'qwen':
             return QWEN_LESSON_INSTRUCTIONS
-        elif CURRENT_MODEL == 'gemini':
+        elif model == 'gemini':
             return GEMINI_LESSON_INSTRUCTIONS
     else:
         # Instructions pour le chat (ton familier) - par défaut
-        if CURRENT_MODEL == 'deepseek':
+        if model == 'deepseek':
             return DEEPSEEK_CHAT_INSTRUCTIONS
-        elif CURRENT_MODEL == 'deepseek-reasoner':
+        elif model == 'deepseek-reasoner':
             return DEEPSEEK_REASONER_CHAT_INSTRUCTIONS
-        elif CURRENT_MODEL == 'qwen':
+        elif model == 'qwen':
             return QWEN_CHAT_INSTRUCTIONS
-        elif CURRENT_MODEL == 'gemini':
+        elif model == 'gemini':
             return GEMINI_CHAT_INSTRUCTIONS
     
     # Pour OpenAI ou tout autre cas, retourner une chaîne vide pour éviter les erreurs.
@@ -302,6 +549,12 @@ def reload_model_settings():
         deepseek_client = None
         qwen_client = None
         gemini_openai_client = None
+        with _key_pools_lock:
+            _key_pools.clear()
+
+        # Réserve de threads Assistant : remplie en mode 'openai', vidée sinon
+        from assistant_thread_pool import on_model_changed
+        on_model_changed(CURRENT_MODEL)
 
         logger.info(f"AI model settings saved to {config_file_path}: {CURRENT_MODEL}")
     except Exception as e:
@@ -0,0 +1,199 @@
+"""
+Passerelle asynchrone vers les fournisseurs IA.
+
+Les clients AsyncOpenAI (un par clé du pool, voir ai_config) vivent sur une
+boucle asyncio unique, dans un thread dédié. Les connexions HTTP (keep-alive,
+HTTP/2 si le paquet h2 est installé) sont ainsi réutilisées d'un message à
+l'autre, même si l'appelant crée sa propre boucle à chaque update (webhook
+Telegram).
+
+- Code async (handlers Telegram) : ``await chat_completion(...)`` /
+  ``await assistant_request(...)``
+- Code sync (web, WhatsApp) : clients sync de ai_config, construits avec les
+  mêmes réglages de pool (http_client_options)
+"""
+
+import os
+import asyncio
+import logging
+import threading
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION HTTP
+# ===================================
+
+AI_HTTP_MAX_CONNECTIONS = int(os.environ.get('AI_HTTP_MAX_CONNECTIONS', '100'))
+AI_HTTP_MAX_KEEPALIVE = int(os.environ.get('AI_HTTP_MAX_KEEPALIVE', '20'))
+# httpx ferme une connexion inactive après 5 s par défaut : trop court pour un trafic de chat
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('AI_HTTP_KEEPALIVE_EXPIRY', '120'))
+AI_HTTP_CONNECT_TIMEOUT = float(os.environ.get('AI_HTTP_CONNECT_TIMEOUT', '10'))
+AI_HTTP_TIMEOUT = float(os.environ.get('AI_HTTP_TIMEOUT', '600'))
+
+try:
+    import h2  # noqa: F401  (requis par httpx pour HTTP/2)
+    _H2_AVAILABLE = True
+except ImportError:
+    _H2_AVAILABLE = False
+
+HTTP2_ENABLED = os.environ.get('AI_HTTP2', 'true').lower() == 'true' and _H2_AVAILABLE
+
+
+def http_client_options():
+    """
+    Réglages communs des clients httpx (sync et async) utilisés pour les appels IA.
+
+    Returns:
+        dict: Arguments pour DefaultHttpxClient / DefaultAsyncHttpxClient
+    """
+    return {
+        'limits': httpx.Limits(
+            max_connections=AI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=AI_HTTP_KEEPALIVE_EXPIRY
+        ),
+        'timeout': httpx.Timeout(AI_HTTP_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+        'http2': HTTP2_ENABLED,
+    }
+
+
+# ===================================
+# BOUCLE DE LA PASSERELLE
+# ===================================
+
+class _GatewayLoop:
+    """Boucle asyncio persistante qui exécute tous les appels IA asynchrones"""
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._started.set()
+        self.loop.run_forever()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._started.clear()
+                self._thread = threading.Thread(target=self._run, daemon=True, name='ai-gateway')
+                self._thread.start()
+                self._started.wait()
+                logger.info(f"Passerelle IA démarrée (HTTP/2: {HTTP2_ENABLED}, keep-alive: {AI_HTTP_KEEPALIVE_EXPIRY}s)")
+
+    def submit(self, coro_factory):
+        """Planifie coro_factory() sur la boucle de la passerelle et retourne un concurrent.futures.Future"""
+        self.ensure_started()
+
+        async def _invoke():
+            return await coro_factory()
+
+        return asyncio.run_coroutine_threadsafe(_invoke(), self.loop)
+
+
+_gateway = _GatewayLoop()
+
+
+async def _run_on_gateway(coro_factory):
+    """Exécute coro_factory() sur la boucle de la passerelle depuis n'importe quelle boucle"""
+    try:
+        current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        current_loop = None
+
+    if current_loop is not None and current_loop is _gateway.loop:
+        return await coro_factory()
+    return await asyncio.wrap_future(_gateway.submit(coro_factory))
+
+
+# ===================================
+# APPELS IA
+# ===================================
+
+async def chat_completion(model, model_name, messages, **kwargs):
+    """
+    Appel Chat Completion asynchrone (non-streaming).
+
+    Args:
+        model: Clé du modèle ('deepseek', 'gemini', ...) servant à choisir le client
+        model_name: Nom du modèle côté fournisseur (get_model_name)
+        messages: Messages au format API
+        **kwargs: Arguments supplémentaires (timeout, ...)
+
+    Returns:
+        ChatCompletion
+    """
+    from ai_config import get_async_ai_client
+
+    async def _call():
+        client = get_async_ai_client(model)
+        return await client.chat.completions.create(model=model_name, messages=messages, **kwargs)
+
+    return await _run_on_gateway(_call)
+
+
+async def stream_chat_completion(model, model_name, messages, **kwargs):
+    """
+    Appel Chat Completion en streaming, utilisable depuis n'importe quelle boucle.
+    Le flux est lu sur la boucle de la passerelle ; les fragments de texte sont
+    transmis à la boucle appelante au fur et à mesure.
+
+    Yields:
+        str: Fragments de la réponse (delta.content)
+    """
+    from ai_config import get_async_ai_client
+
+    caller_loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    end = object()
+
+    async def _call():
+        try:
+            client = get_async_ai_client(model)
+            stream = await client.chat.completions.create(
+                model=model_name, messages=messages, stream=True, **kwargs
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    caller_loop.call_soon_threadsafe(chunks.put_nowait, chunk.choices[0].delta.content)
+        finally:
+            caller_loop.call_soon_threadsafe(chunks.put_nowait, end)
+
+    future = asyncio.wrap_future(_gateway.submit(_call))
+    try:
+        while True:
+            item = await chunks.get()
+            if item is end:
+                break
+            yield item
+        # Propage l'erreur éventuelle du flux
+        await future
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+async def assistant_request(request):
+    """
+    Appel à l'API Assistants d'OpenAI via le client asynchrone.
+
+    Args:
+        request: Fonction recevant le client AsyncOpenAI et retournant une coroutine,
+                 ex: lambda client: client.beta.threads.create()
+    """
+    from ai_config import get_async_provider_client
+
+    async def _call():
+        client = get_async_provider_client('openai')
+        if client is None:
+            raise RuntimeError("OpenAI client not configured. Set OPENAI_API_KEY.")
+        return await request(client)
+
+    return await _run_on_gateway(_call)
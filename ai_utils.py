@@ -1,5 +1,7 @@
+import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing_extensions import override
 from openai import AssistantEventHandler
 from typing import List, Dict, Optional
@@ -80,6 +82,92 @@ def prepare_messages_for_api(
 
     return formatted_messages
 
+REASONING_EMIT_INTERVAL = float(os.environ.get('REASONING_EMIT_INTERVAL', '0.5'))
+
+# Traitement d'image : OCR Mathpix et upload OpenAI en parallèle, échéance commune
+IMAGE_PROCESSING_DEADLINE = float(os.environ.get('IMAGE_PROCESSING_DEADLINE', '45'))
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', '8'))
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_PROCESSING_WORKERS, thread_name_prefix='image-leg')
+
+
+class ReasoningStreamer:
+    """
+    Regroupe les deltas reasoning_content (deepseek-reasoner) et les émet au plus
+    toutes les REASONING_EMIT_INTERVAL secondes sur l'événement 'reasoning_stream'.
+    Le raisonnement n'est jamais ajouté à la réponse ni sauvegardé.
+    """
+
+    def __init__(self, socketio_emitter=None, message_id=None):
+        self.socketio_emitter = socketio_emitter
+        self.message_id = message_id
+        self.buffer = ""
+        self.started_at = None
+        self.last_emit = 0.0
+        self.finished = False
+
+    def add(self, text: str):
+        if self.finished:
+            return
+        now = time.time()
+        if self.started_at is None:
+            self.started_at = now
+        self.buffer += text
+        if now - self.last_emit >= REASONING_EMIT_INTERVAL:
+            self._flush(is_final=False)
+
+    def finish(self):
+        """Clôt la phase de réflexion (premier token de réponse ou fin du stream)"""
+        if self.started_at is not None and not self.finished:
+            self._flush(is_final=True)
+            self.finished = True
+
+    def _flush(self, is_final: bool):
+        self.last_emit = time.time()
+        elapsed = round(self.last_emit - self.started_at, 1)
+
+        if self.socketio_emitter and self.message_id:
+            self.socketio_emitter.emit('reasoning_stream', {
+                'content': self.buffer,
+                'message_id': self.message_id,
+                'is_final': is_final,
+                'elapsed': elapsed
+            })
+        self.buffer = ""
+
+
+def _prepare_chat_completion(messages_history, current_model, add_system_instructions, context, platform, purpose,
+                             system_context=''):
+    """
+    Choisit le modèle (routeur) et prépare les messages pour un appel Chat Completion.
+    Les instructions système sont celles du modèle retenu, précédées de system_context.
+
+    Returns:
+        tuple: (clé du modèle retenu, nom du modèle côté fournisseur, messages au format API)
+    """
+    from ai_config import get_model_name, get_system_instructions
+    from model_router import route_model
+
+    purpose = purpose or ('lesson' if context == 'lesson' else 'chat')
+    routed_model = route_model(messages_history, current_model, platform, purpose)
+
+    model_name = get_model_name(routed_model)
+    if not model_name:
+        logger.error(f"Could not determine model name for {routed_model}")
+        raise ValueError(f"Model name not found for {routed_model}")
+
+    # Ajouter les instructions système SEULEMENT SI DEMANDÉ
+    system_prompt = system_context or ''
+    if add_system_instructions:
+        system_prompt += get_system_instructions(context=context, model=routed_model)
+
+    final_messages = prepare_messages_for_api(
+        messages_history,
+        routed_model,
+        system_prompt or None
+    )
+    return routed_model, model_name, final_messages
+
+
 def execute_chat_completion(
     messages_history: List[Dict[str, str]],
     current_model: str,
@@ -87,7 +175,10 @@ def execute_chat_completion(
     socketio_emitter = None,
     message_id = None,
     add_system_instructions: bool = True,  # <-- NOUVEAU PARAMÈTRE
-    context: str = 'chat'  # <-- NOUVEAU: contexte pour les instructions
+    context: str = 'chat',  # <-- NOUVEAU: contexte pour les instructions
+    platform: Optional[str] = None,
+    purpose: Optional[str] = None,
+    system_context: str = ''
 ) -> Optional[str]:
     """
     Exécute un appel Chat Completion pour les modèles non-OpenAI.
@@ -100,68 +191,87 @@ def execute_chat_completion(
         message_id: ID du message pour l'émission (si stream=True)
         add_system_instructions: Si True, ajoute les instructions système par défaut.
         context: Contexte d'utilisation ('chat' ou 'lesson')
+        platform: Plateforme d'origine ('web', 'telegram', 'whatsapp') pour le routeur de modèles
+        purpose: Type de requête ('chat', 'lesson', 'reminder', 'summary'), déduit de context par défaut
+        system_context: Contexte (résumé, mémoire, avertissement) placé avant les instructions
+            système du modèle retenu par le routeur
 
     Returns:
         - Si stream=False: retourne la réponse complète (string)
         - Si stream=True: retourne la réponse complète après streaming (string)
     """
     try:
-        # 1. Récupérer client et modèle
-        from ai_config import get_ai_client, get_model_name, get_system_instructions
+        # 1-2. Choisir le modèle (routeur) et préparer les messages
+        from ai_config import get_ai_client
+        from model_router import LatencyTimer
 
-        ai_client = get_ai_client()
-        model_name = get_model_name()
-
-        if not model_name:
-            logger.error(f"Could not determine model name for {current_model}")
-            raise ValueError(f"Model name not found for {current_model}")
-
-        # 2. Préparer les messages en ajoutant les instructions système SEULEMENT SI DEMANDÉ
-        system_prompt = get_system_instructions(context=context) if add_system_instructions else None
-
-        final_messages = prepare_messages_for_api(
-            messages_history,
-            current_model,
-            system_prompt
+        routed_model, model_name, final_messages = _prepare_chat_completion(
+            messages_history, current_model, add_system_instructions, context, platform, purpose, system_context
         )
+        ai_client = get_ai_client(routed_model)
 
-        # 3. Appeler l'API
+        # 3. Appeler l'API (latence mesurée pour le routeur)
         logger.debug(f"Calling API with model={model_name}, stream={stream}, context={context}")
-        response = ai_client.chat.completions.create(
-            model=model_name,
-            messages=final_messages,
-            stream=stream
-        )
+        latency_timer = LatencyTimer(routed_model)
+        try:
+            response = ai_client.chat.completions.create(
+                model=model_name,
+                messages=final_messages,
+                stream=stream
+            )
+        except Exception:
+            latency_timer.record(success=False)
+            raise
 
         # 4. Gérer la réponse selon le mode (logique inchangée)
         if not stream:
             # Mode non-streaming (WhatsApp, Telegram)
+            latency_timer.record()
             assistant_message = response.choices[0].message.content
-            logger.info(f"Non-streaming response received from {current_model}")
+            logger.info(f"Non-streaming response received from {routed_model}")
             return assistant_message
         else:
             # Mode streaming (Web App)
             assistant_message = ""
+            reasoning_streamer = ReasoningStreamer(socketio_emitter, message_id)
+
+            try:
+                for chunk in response:
+                    chunk_content = None
+                    reasoning_chunk = None
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if delta and hasattr(delta, 'content'):
+                            chunk_content = delta.content
+                        # deepseek-reasoner : phase de réflexion, jamais ajoutée à la réponse
+                        reasoning_chunk = getattr(delta, 'reasoning_content', None) if delta else None
+
+                    if reasoning_chunk:
+                        reasoning_streamer.add(reasoning_chunk)
+
+                    if chunk_content:
+                        # Temps jusqu'au premier token
+                        latency_timer.first_token()
+                        reasoning_streamer.finish()
+
+                        # Nettoyer le chunk
+                        cleaned_chunk = _clean_response_text(chunk_content)
+                        assistant_message += cleaned_chunk
+
+                        # Émettre via SocketIO si disponible
+                        if socketio_emitter and message_id:
+                            socketio_emitter.emit('response_stream', {
+                                'content': cleaned_chunk,
+                                'message_id': message_id,
+                                'is_final': False
+                            })
+            except Exception:
+                # Flux interrompu : échec pour le routeur, même après les premiers tokens
+                latency_timer.record(success=False)
+                raise
+            latency_timer.record()
 
-            for chunk in response:
-                chunk_content = None
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta and hasattr(delta, 'content'):
-                        chunk_content = delta.content
-
-                if chunk_content:
-                    # Nettoyer le chunk
-                    cleaned_chunk = _clean_response_text(chunk_content)
-                    assistant_message += cleaned_chunk
-
-                    # Émettre via SocketIO si disponible
-                    if socketio_emitter and message_id:
-                        socketio_emitter.emit('response_stream', {
-                            'content': cleaned_chunk,
-                            'message_id': message_id,
-                            'is_final': False
-                        })
+            reasoning_streamer.finish()
 
             # Émettre le signal final
             if socketio_emitter and message_id:
@@ -172,7 +282,7 @@ def execute_chat_completion(
                     'full_response': assistant_message
                 })
 
-            logger.info(f"Streaming response completed from {current_model}")
+            logger.info(f"Streaming response completed from {routed_model}")
             return assistant_message
 
     except Exception as e:
@@ -180,6 +290,90 @@ def execute_chat_completion(
         raise
 
 
+async def execute_chat_completion_async(
+    messages_history: List[Dict[str, str]],
+    current_model: str,
+    add_system_instructions: bool = True,
+    context: str = 'chat',
+    platform: Optional[str] = None,
+    purpose: Optional[str] = None,
+    system_context: str = '',
+    **kwargs
+) -> Optional[str]:
+    """
+    Version asynchrone (non-streaming) de execute_chat_completion, pour les handlers
+    async (Telegram). L'appel passe par ai_gateway et réutilise ses connexions.
+
+    Args:
+        Voir execute_chat_completion. kwargs est transmis à l'API (ex: timeout).
+
+    Returns:
+        La réponse complète (string)
+    """
+    import ai_gateway
+    from model_router import LatencyTimer
+
+    try:
+        routed_model, model_name, final_messages = _prepare_chat_completion(
+            messages_history, current_model, add_system_instructions, context, platform, purpose, system_context
+        )
+
+        logger.debug(f"Calling async API with model={model_name}, context={context}")
+        latency_timer = LatencyTimer(routed_model)
+        try:
+            response = await ai_gateway.chat_completion(routed_model, model_name, final_messages, **kwargs)
+        except Exception:
+            latency_timer.record(success=False)
+            raise
+        latency_timer.record()
+
+        logger.info(f"Async response received from {routed_model}")
+        return response.choices[0].message.content
+
+    except Exception as e:
+        logger.error(f"Error in execute_chat_completion_async: {str(e)}", exc_info=True)
+        raise
+
+
+async def stream_chat_completion_async(
+    messages_history: List[Dict[str, str]],
+    current_model: str,
+    add_system_instructions: bool = True,
+    context: str = 'chat',
+    platform: Optional[str] = None,
+    purpose: Optional[str] = None,
+    system_context: str = '',
+    **kwargs
+):
+    """
+    Version asynchrone en streaming de execute_chat_completion (réponses
+    progressives Telegram). L'appel passe par ai_gateway.
+
+    Yields:
+        str: Fragments de la réponse
+    """
+    import ai_gateway
+    from model_router import LatencyTimer
+
+    routed_model, model_name, final_messages = _prepare_chat_completion(
+        messages_history, current_model, add_system_instructions, context, platform, purpose, system_context
+    )
+
+    logger.debug(f"Calling async streaming API with model={model_name}, context={context}")
+    latency_timer = LatencyTimer(routed_model)
+    try:
+        async for content in ai_gateway.stream_chat_completion(routed_model, model_name, final_messages, **kwargs):
+            # Temps jusqu'au premier token ; l'issue est enregistrée à la fin du flux
+            latency_timer.first_token()
+            yield content
+    except Exception as e:
+        latency_timer.record(success=False)
+        logger.error(f"Error in stream_chat_completion_async: {str(e)}", exc_info=True)
+        raise
+    latency_timer.record()
+    logger.info(f"Async streamed response received from {routed_model}")
+
+
 def _clean_response_text(text: str) -> str:
     """
     Nettoie le texte en supprimant les caractères spéciaux de formatage.
@@ -197,13 +391,16 @@ def _clean_response_text(text: str) -> str:
     cleaned_text = text.replace('*', '').replace('#', '').replace('```', '').replace('---', '')
     return cleaned_text
 
-def upload_image_to_openai(file_path: str, platform: str = "General") -> str:
+def upload_image_to_openai(file_path: Optional[str], platform: str = "General",
+                           content: Optional[bytes] = None, filename: str = "image.jpg") -> str:
     """
     Upload une image vers OpenAI et retourne l'ID du fichier
 
     Args:
-        file_path: Chemin vers le fichier image local
+        file_path: Chemin vers le fichier image local (ignoré si content est fourni)
         platform: Contexte d'origine ('Web', 'WhatsApp', 'Telegram', etc.)
+        content: Octets de l'image déjà en mémoire (aucune écriture disque)
+        filename: Nom transmis à OpenAI avec content
 
     Returns:
         str: L'ID du fichier uploadé sur OpenAI
@@ -211,35 +408,98 @@ def upload_image_to_openai(file_path: str, platform: str = "General") -> str:
     Raises:
         Exception: Si l'upload échoue
     """
-    from ai_config import openai_client
+    from ai_config import get_provider_client
 
     try:
-        with open(file_path, 'rb') as file_content:
+        # Clé choisie à chaque appel dans le pool OpenAI (pas de client figé sur la première clé)
+        openai_client = get_provider_client('openai')
+        if content is not None:
             openai_file = openai_client.files.create(
-                file=file_content,
+                file=(filename, content),
                 purpose='assistants'
             )
-            logger.info(f"Image {platform} uploadée vers OpenAI avec ID: {openai_file.id}")
-            return openai_file.id
+        else:
+            with open(file_path, 'rb') as file_content:
+                openai_file = openai_client.files.create(
+                    file=file_content,
+                    purpose='assistants'
+                )
+        logger.info(f"Image {platform} uploadée vers OpenAI avec ID: {openai_file.id}")
+        return openai_file.id
     except Exception as e:
         logger.error(f"Erreur upload OpenAI ({platform}): {str(e)}")
         raise
 
 
+def _ocr_leg(base64_data, content=None, deadline=None):
+    """OCR Mathpix sur l'image normalisée pour l'OCR (réduite, niveaux de gris)"""
+    from mathpix_utils import process_image_with_mathpix
+    from image_preprocessing import prepare_image
+
+    if content:
+        base64_data = prepare_image(content, purpose='ocr').data_url
+    return process_image_with_mathpix(base64_data, deadline=deadline)
+
+
+def _upload_leg(file_path, platform, content=None):
+    """Upload OpenAI de l'image normalisée (réduite, recompressée)"""
+    from image_preprocessing import prepare_image
+
+    if content:
+        prepared = prepare_image(content, purpose='vision')
+        return upload_image_to_openai(None, platform, content=prepared.content, filename=prepared.filename)
+    return upload_image_to_openai(file_path, platform)
+
+
+def _keep_late_leg(future, leg, cached, platform):
+    """
+    Résultat d'une branche terminée après l'échéance : mis en cache pour la prochaine
+    fois. Un fichier OpenAI qui ne peut pas être mis en cache est supprimé (sinon il
+    resterait orphelin sur le compte).
+    """
+    from image_cache import store_image
+
+    try:
+        result = future.result()
+    except Exception:
+        return  # Déjà journalisé par la branche
+
+    if leg == 'ocr':
+        if cached and "error" not in result and store_image(cached, ocr_result=result):
+            logger.info(f"OCR Mathpix tardif mis en cache pour {platform}")
+        return
+
+    if cached and store_image(cached, openai_file_id=result):
+        logger.info(f"Fichier OpenAI tardif mis en cache pour {platform}: {result}")
+        return
+    try:
+        from ai_config import get_provider_client
+        get_provider_client('openai').files.delete(result)
+        logger.info(f"Fichier OpenAI tardif supprimé pour {platform}: {result}")
+    except Exception as e:
+        logger.warning(f"Suppression du fichier OpenAI tardif {result} impossible: {str(e)}")
+
+
 def process_image_for_openai(
-    file_path: str, 
+    file_path: Optional[str], 
     base64_data: str, 
     user_text: str = "",
-    platform: str = "General"
+    platform: str = "General",
+    image_bytes: Optional[bytes] = None
 ) -> tuple:
     """
-    Traite une image pour OpenAI avec double approche (Vision API + OCR Mathpix)
+    Traite une image pour OpenAI avec double approche (Vision API + OCR Mathpix).
+    Les deux appels sont lancés en parallèle ; le résultat est retourné dès qu'ils
+    sont terminés, ou à IMAGE_PROCESSING_DEADLINE avec ce qui a abouti. Les
+    résultats déjà en cache pour la même image (image_cache) ne sont pas recalculés,
+    et chaque appel reçoit une version normalisée de l'image (image_preprocessing).
 
     Args:
-        file_path: Chemin vers le fichier image local
+        file_path: Chemin vers le fichier image local (inutile si image_bytes est fourni)
         base64_data: Données image en base64 pour Mathpix
         user_text: Message utilisateur ou caption à combiner avec l'OCR
         platform: Contexte d'origine pour la journalisation
+        image_bytes: Image déjà en mémoire, uploadée sans passer par le disque
 
     Returns:
         tuple: (openai_file_id, enhanced_message, results_dict)
@@ -257,24 +517,68 @@ def process_image_for_openai(
         'openai_file_id': None
     }
 
-    # 1. Mathpix OCR (silencieux si échec)
-    try:
-        from mathpix_utils import process_image_with_mathpix
-        mathpix_result = process_image_with_mathpix(base64_data)
-        if "error" not in mathpix_result:
-            results['formatted_summary'] = mathpix_result.get("formatted_summary", "")
-            results['mathpix_success'] = True
-            logger.info(f"Mathpix OCR réussi pour {platform}")
-    except Exception as e:
-        logger.error(f"Échec Mathpix pour {platform}: {str(e)}")
-
-    # 2. OpenAI Upload (silencieux si échec)
-    try:
-        results['openai_file_id'] = upload_image_to_openai(file_path, platform)
+    from image_cache import image_bytes_from_base64, lookup_image, store_image
+
+    # 0. Cache par contenu : une image déjà vue ne repasse ni par Mathpix ni par l'upload
+    content = image_bytes if image_bytes is not None else image_bytes_from_base64(base64_data)
+    cached = lookup_image(content) if content else None
+    if cached and cached['ocr_result'] is not None:
+        results['formatted_summary'] = cached['ocr_result'].get("formatted_summary", "")
+        results['mathpix_success'] = True
+        logger.info(f"OCR Mathpix servi depuis le cache pour {platform}")
+    if cached and cached['openai_file_id']:
+        results['openai_file_id'] = cached['openai_file_id']
         results['openai_success'] = True
-        logger.info(f"Upload OpenAI réussi pour {platform}: {results['openai_file_id']}")
-    except Exception as e:
-        logger.error(f"Échec upload OpenAI {platform}: {str(e)}")
+        logger.info(f"Fichier OpenAI réutilisé depuis le cache pour {platform}: {results['openai_file_id']}")
+
+    # 1. Mathpix OCR et 2. upload OpenAI en parallèle, avec une échéance commune
+    started = time.time()
+    # L'appel Mathpix ne dépasse pas l'échéance commune (et échoue vite si le disjoncteur est ouvert)
+    deadline = time.monotonic() + IMAGE_PROCESSING_DEADLINE
+    mathpix_future = upload_future = None
+    if not results['mathpix_success']:
+        mathpix_future = _image_executor.submit(_ocr_leg, base64_data, content, deadline)
+    if not results['openai_success']:
+        upload_future = _image_executor.submit(_upload_leg, file_path, platform, content)
+    pending = [f for f in (mathpix_future, upload_future) if f is not None]
+    done, not_done = wait(pending, timeout=IMAGE_PROCESSING_DEADLINE) if pending else (set(), set())
+
+    new_ocr_result = new_file_id = None
+
+    # Mathpix OCR (silencieux si échec)
+    if mathpix_future in done:
+        try:
+            mathpix_result = mathpix_future.result()
+            if "error" not in mathpix_result:
+                results['formatted_summary'] = mathpix_result.get("formatted_summary", "")
+                results['mathpix_success'] = True
+                new_ocr_result = mathpix_result
+                logger.info(f"Mathpix OCR réussi pour {platform}")
+        except Exception as e:
+            logger.error(f"Échec Mathpix pour {platform}: {str(e)}")
+
+    # OpenAI Upload (silencieux si échec)
+    if upload_future in done:
+        try:
+            results['openai_file_id'] = upload_future.result()
+            results['openai_success'] = True
+            new_file_id = results['openai_file_id']
+            logger.info(f"Upload OpenAI réussi pour {platform}: {results['openai_file_id']}")
+        except Exception as e:
+            logger.error(f"Échec upload OpenAI {platform}: {str(e)}")
+
+    if cached:
+        store_image(cached, ocr_result=new_ocr_result, openai_file_id=new_file_id)
+
+    if not_done:
+        # La branche en retard continue en arrière-plan : son résultat n'est pas utilisé
+        # pour cette réponse, mais mis en cache (ou le fichier OpenAI supprimé)
+        late = 'Mathpix' if mathpix_future in not_done else 'upload OpenAI'
+        logger.warning(f"Échéance de {IMAGE_PROCESSING_DEADLINE}s atteinte pour {platform}: {late} ignoré")
+        for future in not_done:
+            leg = 'ocr' if future is mathpix_future else 'upload'
+            future.add_done_callback(lambda f, leg=leg: _keep_late_leg(f, leg, cached, platform))
+    logger.debug(f"Traitement image {platform} en {time.time() - started:.2f}s")
 
     # 3. Validation - Au moins une méthode doit réussir
     if not results['mathpix_success'] and not results['openai_success']:
@@ -364,6 +668,98 @@ class OpenAIAssistantEventHandler(AssistantEventHandler):
                                 'is_final': False
                             })
 
+REMINDER_PROMPTS = {
+    'night': "En te basant sur nos échanges d'aujourd'hui, envoie-moi un message de bonne nuit très court (1-2 phrases max, style nouchi) pour me souhaiter bonne nuit et célébrer mon travail de la journée.Si on a rien fait aujourd'hui, souhaite moi simplement bonne nuit.",
+    'morning': "Envoie-moi un message de bon matin très court (1-2 phrases max, style nouchi) pour me souhaiter bon courage pour la journée.",
+    'evening': "En te basant sur nos échanges récents, envoie-moi un message de motivation très court (1-2 phrases max, style nouchi) pour m'encourager à travailler ce soir."
+}
+
+REMINDER_FALLBACK_MESSAGES = {
+    'night': "Yo poto! Bonne nuit! 😴",
+    'morning': "Yo poto! Bonne journée! 💪",
+    'evening': "Yo poto! C'est le moment de bosser! 🔥"
+}
+
+
+def _get_reminder_memory_context(user_identifier: str, platform: str) -> str:
+    """Construit le contexte mémoire de l'élève à préfixer aux instructions du rappel"""
+    from models import User, UserMemory
+    from app import app
+
+    with app.app_context():
+        user = User.query.filter_by(phone_number=f"{platform}_{user_identifier}").first()
+        if not user:
+            return ""
+        memory = UserMemory.query.filter_by(user_id=user.id).first()
+        if not memory:
+            return ""
+        derniers_sujets_str = str(memory.derniers_sujets[-2:]) if memory.derniers_sujets else "[]"
+        return (
+            f"[Contexte sur l'élève : "
+            f"Nom='{memory.nom or 'Inconnu'}', "
+            f"Niveau='{memory.niveau or 'Inconnu'}', "
+            f"Matières difficiles={memory.matieres_difficiles or '[]'}, "
+            f"Derniers sujets abordés={derniers_sujets_str}. "
+            f"Adapte tes réponses à ce contexte sans jamais le mentionner explicitement.]\n"
+            f"---\n"
+        )
+
+
+def _get_reminder_history(platform: str, thread_id: str) -> List[Dict[str, str]]:
+    """Récupère les 5 derniers messages de la conversation pour contextualiser le rappel"""
+    from models import TelegramConversation, TelegramMessage, WhatsAppMessage
+    from app import app
+
+    messages_history = []
+    with app.app_context():
+        if platform == 'telegram':
+            # Chercher la conversation Telegram
+            conversation = TelegramConversation.query.filter_by(
+                thread_id=thread_id
+            ).first()
+
+            if conversation:
+                messages_query = TelegramMessage.query.filter_by(
+                    conversation_id=conversation.id
+                ).order_by(TelegramMessage.created_at.desc()).limit(5).all()
+
+                for msg in reversed(messages_query):
+                    role = msg.role if msg.role == 'user' else 'assistant'
+                    messages_history.append({"role": role, "content": msg.content})
+
+        elif platform == 'whatsapp':
+            messages_query = WhatsAppMessage.query.filter_by(
+                thread_id=thread_id
+            ).order_by(WhatsAppMessage.timestamp.desc()).limit(5).all()
+
+            for msg in reversed(messages_query):
+                role = 'user' if msg.direction == 'inbound' else 'assistant'
+                messages_history.append({"role": role, "content": msg.content})
+
+    return messages_history
+
+
+def build_reminder_chat_messages(
+    user_identifier: str,
+    platform: str,
+    thread_id: str = None,
+    reminder_type: str = "night"
+) -> List[Dict[str, str]]:
+    """
+    Construit les messages Chat Completion d'un rappel (utilisé par le mode batch).
+
+    Returns:
+        Liste de messages prête pour l'API (instructions + mémoire, historique récent, consigne)
+    """
+    from ai_config import CURRENT_MODEL, get_system_instructions
+
+    system_prompt = _get_reminder_memory_context(user_identifier, platform) + get_system_instructions()
+    messages_history = _get_reminder_history(platform, thread_id)
+    messages_history.append({"role": "user", "content": REMINDER_PROMPTS.get(reminder_type, REMINDER_PROMPTS['night'])})
+
+    return prepare_messages_for_api(messages_history, CURRENT_MODEL, system_prompt or None)
+
+
 def generate_reminder_message(
     user_identifier: str,
     platform: str,
@@ -382,41 +778,14 @@ def generate_reminder_message(
     Returns:
         str: Message de rappel personnalisé
     """
-    from ai_config import CURRENT_MODEL, ASSISTANT_ID, openai_client, CONTEXT_MESSAGE_LIMIT
-    from models import User, UserMemory, TelegramMessage, WhatsAppMessage
+    from ai_config import CURRENT_MODEL, ASSISTANT_ID, CONTEXT_MESSAGE_LIMIT, get_provider_client
     import time
 
-    # Messages de consigne selon le type de rappel
-    reminder_prompts = {
-        'night': "En te basant sur nos échanges d'aujourd'hui, envoie-moi un message de bonne nuit très court (1-2 phrases max, style nouchi) pour me souhaiter bonne nuit et célébrer mon travail de la journée.Si on a rien fait aujourd'hui, souhaite moi simplement bonne nuit.",
-        'morning': "Envoie-moi un message de bon matin très court (1-2 phrases max, style nouchi) pour me souhaiter bon courage pour la journée.",
-        'evening': "En te basant sur nos échanges récents, envoie-moi un message de motivation très court (1-2 phrases max, style nouchi) pour m'encourager à travailler ce soir."
-    }
-
-    user_message = reminder_prompts.get(reminder_type, reminder_prompts['night'])
+    user_message = REMINDER_PROMPTS.get(reminder_type, REMINDER_PROMPTS['night'])
 
     try:
-        # === RÉCUPÉRATION DU CONTEXTE MÉMOIRE (comme dans le code existant) ===
-        memory_context = ""
-        user_phone_id = f"{platform}_{user_identifier}"
-
-        # Import local pour éviter circularité
-        from app import app
-        with app.app_context():
-            user = User.query.filter_by(phone_number=user_phone_id).first()
-            if user:
-                memory = UserMemory.query.filter_by(user_id=user.id).first()
-                if memory:
-                    derniers_sujets_str = str(memory.derniers_sujets[-2:]) if memory.derniers_sujets else "[]"
-                    memory_context = (
-                        f"[Contexte sur l'élève : "
-                        f"Nom='{memory.nom or 'Inconnu'}', "
-                        f"Niveau='{memory.niveau or 'Inconnu'}', "
-                        f"Matières difficiles={memory.matieres_difficiles or '[]'}, "
-                        f"Derniers sujets abordés={derniers_sujets_str}. "
-                        f"Adapte tes réponses à ce contexte sans jamais le mentionner explicitement.]\n"
-                        f"---\n"
-                    )
+        # === RÉCUPÉRATION DU CONTEXTE MÉMOIRE ===
+        memory_context = _get_reminder_memory_context(user_identifier, platform)
 
         from ai_config import get_system_instructions
         base_instructions = get_system_instructions()
@@ -431,6 +800,7 @@ def generate_reminder_message(
 
             # Ajouter le contexte + consigne au thread
             message_with_context = final_system_prompt + "\n\n---\n\n" + user_message
+            openai_client = get_provider_client('openai')
 
             openai_client.beta.threads.messages.create(
                 thread_id=thread_id,
@@ -445,25 +815,8 @@ def generate_reminder_message(
             )
 
             # Attendre la complétion (timeout 60s pour rappel)
-            timeout = 60
-            start_time = time.time()
-
-            while True:
-                if time.time() - start_time > timeout:
-                    logger.error("Timeout génération rappel OpenAI")
-                    raise TimeoutError("OpenAI response timed out")
-
-                run_status = openai_client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-
-                if run_status.status == 'completed':
-                    break
-                elif run_status.status in ['failed', 'cancelled', 'expired']:
-                    raise Exception(f"OpenAI Run failed: {run_status.status}")
-
-                time.sleep(1)
+            from run_poller import wait_for_run
+            wait_for_run(thread_id, run.id, timeout=60)
 
             # Récupérer la réponse
             messages = openai_client.beta.threads.messages.list(
@@ -482,33 +835,7 @@ def generate_reminder_message(
         else:
             # Utiliser Chat Completion pour les autres modèles
             # Récupérer l'historique récent pour le contexte
-            messages_history = []
-
-            with app.app_context():
-                if platform == 'telegram':
-                    # Chercher la conversation Telegram
-                    from models import TelegramConversation
-                    conversation = TelegramConversation.query.filter_by(
-                        thread_id=thread_id
-                    ).first()
-
-                    if conversation:
-                        messages_query = TelegramMessage.query.filter_by(
-                            conversation_id=conversation.id
-                        ).order_by(TelegramMessage.created_at.desc()).limit(5).all()
-
-                        for msg in reversed(messages_query):
-                            role = msg.role if msg.role == 'user' else 'assistant'
-                            messages_history.append({"role": role, "content": msg.content})
-
-                elif platform == 'whatsapp':
-                    messages_query = WhatsAppMessage.query.filter_by(
-                        thread_id=thread_id
-                    ).order_by(WhatsAppMessage.timestamp.desc()).limit(5).all()
-
-                    for msg in reversed(messages_query):
-                        role = 'user' if msg.direction == 'inbound' else 'assistant'
-                        messages_history.append({"role": role, "content": msg.content})
+            messages_history = _get_reminder_history(platform, thread_id)
 
             # Ajouter le message de rappel
             messages_history.append({"role": "user", "content": user_message})
@@ -518,7 +845,9 @@ def generate_reminder_message(
                 messages_history=messages_history,
                 current_model=CURRENT_MODEL,
                 stream=False,
-                add_system_instructions=True  # Ajoute automatiquement memory + base_instructions
+                add_system_instructions=True,  # Ajoute automatiquement memory + base_instructions
+                platform=platform,
+                purpose='reminder'
             )
 
             logger.info(f"Message rappel généré via {CURRENT_MODEL} pour {platform}/{user_identifier}")
@@ -527,12 +856,7 @@ def generate_reminder_message(
     except Exception as e:
         logger.error(f"Erreur génération message de rappel: {str(e)}", exc_info=True)
         # Fallback simple
-        fallback_messages = {
-            'night': "Yo poto! Bonne nuit! 😴",
-            'morning': "Yo poto! Bonne journée! 💪",
-            'evening': "Yo poto! C'est le moment de bosser! 🔥"
-        }
-        return fallback_messages.get(reminder_type, fallback_messages['night'])
+        return REMINDER_FALLBACK_MESSAGES.get(reminder_type, REMINDER_FALLBACK_MESSAGES['night'])
 
 def generate_lesson_from_ocr(ocr_text: str, subject: str) -> str:
     """
@@ -38,7 +38,7 @@ from flask import request as flask_request
 from flask import Response
 import asyncio
 from utils import ensure_event_loop, get_db_context
-from telegram_bot import process_telegram_update
+from telegram_bot import process_telegram_update, enqueue_telegram_update, start_telegram_loop
 from admin_routes import admin_bp
 from socket_handlers import (handle_rename, handle_delete,
                              handle_open_conversation, handle_clear_session,
@@ -75,7 +75,7 @@ from database import db
 # Import de la configuration IA centralisée
 from ai_config import (get_ai_client, get_model_name, get_system_instructions,
                        reload_model_settings, CURRENT_MODEL, ASSISTANT_ID,
-                       CONTEXT_MESSAGE_LIMIT, openai_client,
+                       CONTEXT_MESSAGE_LIMIT,
                        DEEPSEEK_INSTRUCTIONS, DEEPSEEK_REASONER_INSTRUCTIONS,
                        QWEN_INSTRUCTIONS, GEMINI_INSTRUCTIONS)
 
@@ -117,24 +117,11 @@ def handle_message(data):
     handle_message_logic(data, socketio)
 
 
-# Assurer qu'un event loop existe pour le contexte async (important dans certains déploiements)
-try:
-    loop = asyncio.get_event_loop()
-    logger.info(f"Event loop obtained: {loop}")
-except RuntimeError:
-    logger.info("No current event loop, creating a new one.")
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-
 if telegram_app:  # Vérifier si l'import a réussi
-    logger.info(
-        "Initialisation de l'application Telegram (await application.initialize())..."
-    )
+    logger.info("Démarrage de la boucle Telegram persistante (application.initialize())...")
     try:
-        # Exécuter l'initialisation async dans la boucle d'événements existante
-        # C'est important de le faire une fois au démarrage
-        loop.run_until_complete(telegram_app.initialize())
-        logger.info("Application Telegram initialisée avec succès.")
+        # Une seule initialisation, dans la boucle qui traitera tous les updates
+        start_telegram_loop()
     except Exception as init_error:
         logger.error(
             f"Échec de l'initialisation de l'application Telegram: {init_error}",
@@ -159,8 +146,8 @@ def telegram_webhook_handler(
         json_data = flask_request.get_json(force=True)
         logger.debug(f"Payload JSON: {json_data}")
 
-        # Utiliser eventlet.spawn pour traiter l'update dans un greenlet séparé
-        eventlet.spawn(process_telegram_update, json_data)
+        # Enregistrer l'update dans la file durable (traitée par le pool de workers Telegram)
+        enqueue_telegram_update(json_data)
 
         # Répondre immédiatement 200 OK à Telegram
         return Response(status=200)
@@ -448,7 +435,8 @@ def create_lesson_with_image():
     3. Création de la leçon en BD
     """
     try:
-        from mathpix_utils import process_image_with_mathpix
+        from image_cache import ocr_image_cached
+        from image_preprocessing import prepare_image
         import uuid
         import os
         from werkzeug.utils import secure_filename
@@ -465,21 +453,25 @@ def create_lesson_with_image():
         upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'lessons')
         os.makedirs(upload_folder, exist_ok=True)
         
-        # Sauvegarder l'image
+        # Sauvegarder l'image normalisée (orientation EXIF, taille réduite)
+        image_content = image_file.read()
+        prepared = prepare_image(image_content, purpose='vision', mime_type=image_file.mimetype)
         filename = secure_filename(image_file.filename)
+        if prepared.content is not image_content:
+            filename = f"{os.path.splitext(filename)[0]}{os.path.splitext(prepared.filename)[1]}"
         unique_filename = f"{uuid.uuid4()}_{filename}"
         image_path = os.path.join(upload_folder, unique_filename)
-        image_file.save(image_path)
+        with open(image_path, 'wb') as f:
+            f.write(prepared.content)
         
         # URL relative pour la BD
         image_url = f"/static/uploads/lessons/{unique_filename}"
         
-        # Traiter avec OCR
+        # Traiter avec OCR (cache par contenu : une capture déjà vue n'est pas renvoyée à Mathpix)
         import base64
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+        image_data = base64.b64encode(image_content).decode('utf-8')
         
-        ocr_result = process_image_with_mathpix(f"data:image/jpeg;base64,{image_data}")
+        ocr_result = ocr_image_cached(f"data:image/jpeg;base64,{image_data}", image_content)
         
         ocr_text = ""
         if "error" not in ocr_result:
@@ -538,7 +530,8 @@ def add_image_to_lesson(lesson_id):
     - image: fichier image
     """
     try:
-        from mathpix_utils import process_image_with_mathpix
+        from image_cache import ocr_image_cached
+        from image_preprocessing import prepare_image
         import uuid
         import os
         from werkzeug.utils import secure_filename
@@ -558,20 +551,24 @@ def add_image_to_lesson(lesson_id):
         upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'lessons')
         os.makedirs(upload_folder, exist_ok=True)
         
-        # Sauvegarder l'image
+        # Sauvegarder l'image normalisée (orientation EXIF, taille réduite)
+        image_content = image_file.read()
+        prepared = prepare_image(image_content, purpose='vision', mime_type=image_file.mimetype)
         filename = secure_filename(image_file.filename)
+        if prepared.content is not image_content:
+            filename = f"{os.path.splitext(filename)[0]}{os.path.splitext(prepared.filename)[1]}"
         unique_filename = f"{uuid.uuid4()}_{filename}"
         image_path = os.path.join(upload_folder, unique_filename)
-        image_file.save(image_path)
+        with open(image_path, 'wb') as f:
+            f.write(prepared.content)
         
         image_url = f"/static/uploads/lessons/{unique_filename}"
         
-        # OCR
+        # OCR (avec cache par contenu)
         import base64
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
+        image_data = base64.b64encode(image_content).decode('utf-8')
         
-        ocr_result = process_image_with_mathpix(f"data:image/jpeg;base64,{image_data}")
+        ocr_result = ocr_image_cached(f"data:image/jpeg;base64,{image_data}", image_content)
         
         ocr_text = ""
         if "error" not in ocr_result:
@@ -1496,6 +1493,9 @@ def delete_user(user_id):
 
                 # Si on arrive ici, c'est que la transaction a été validée avec succès
                 logger.info(f"Web user {user_id} deleted successfully")
+                if user_id.startswith('whatsapp_'):
+                    from whatsapp_cache import forget_identity
+                    forget_identity(user_id[len('whatsapp_'):])
                 return jsonify({
                     'success': True,
                     'message': 'User deleted successfully'
@@ -1728,7 +1728,10 @@ def delete_subscription(subscription_id):
 # --- DÉMARRAGE DU SCHEDULER ---
 # Import ici pour éviter l'import circulaire avec les modèles
 from memory_consolidator import run_consolidation_task
-from reminder_system import run_night_reminder_job
+from reminder_system import run_night_reminder_job, submit_reminder_batch
+from llm_batch import poll_pending_batches
+from durable_queue import purge_finished_jobs
+from image_cache import purge_expired_images
 
 # Initialisation du scheduler
 scheduler = BackgroundScheduler()
@@ -1739,19 +1742,42 @@ scheduler.add_job(func=run_consolidation_task,
                   trigger="cron",
                   hour=1,
                   minute=0)
+# Pré-génération des rappels en batch, une heure avant l'envoi (mode batch 'reminder')
+scheduler.add_job(func=submit_reminder_batch,
+                  trigger="cron",
+                  hour=22,
+                  minute=0)
 # Tâche de rappel nuit (tous les jours à 22h30)
 scheduler.add_job(func=run_night_reminder_job,
                   trigger="cron",
                   hour=23,
                   minute=0)
+# Suivi des lots batch IA (application des résultats terminés)
+scheduler.add_job(func=poll_pending_batches, trigger="interval", minutes=10)
+# Purge des jobs entrants terminés (file durable WhatsApp/Telegram)
+scheduler.add_job(func=purge_finished_jobs, trigger="cron", hour=3, minute=0)
+# Purge des entrées expirées du cache d'images (OCR / uploads OpenAI)
+scheduler.add_job(func=purge_expired_images, trigger="cron", hour=3, minute=30)
 
 # Démarrer le scheduler si ce n'est pas déjà fait
 # (La condition est utile pour éviter les redémarrages multiples en mode debug)
 if not scheduler.running:
     scheduler.start()
     logger.info(
-        "Scheduler démarré : cleanup (1h) + consolidation mémoire (00h10) + rappel nuit (22h30)"
+        "Scheduler démarré : cleanup (1h) + consolidation mémoire (00h10) + lot rappels (22h) + rappel nuit (22h30) + suivi batch IA (10min) + purge file entrante (3h) + purge cache d'images (3h30)"
     )
+
+# Reprendre les messages entrants restés en file (redémarrage, déploiement)
+from whatsapp_bot import start_inbound_consumer as start_whatsapp_consumer
+start_whatsapp_consumer()
+if telegram_app:
+    from telegram_bot import start_inbound_consumer as start_telegram_consumer
+    start_telegram_consumer()
+
+# Pré-remplir la réserve de threads Assistant si le modèle OpenAI est actif
+if CURRENT_MODEL == 'openai':
+    from assistant_thread_pool import warm_thread_pool
+    warm_thread_pool()
 # --- FIN DÉMARRAGE DU SCHEDULER ---
 
 if __name__ == '__main__':
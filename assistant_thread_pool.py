@@ -0,0 +1,186 @@
+"""
+Réserve de threads OpenAI Assistant pré-créés.
+
+En mode CURRENT_MODEL='openai', chaque nouvelle conversation (web, WhatsApp,
+Telegram) devait attendre un ``threads.create()`` avant le premier message.
+Les threads sont désormais créés à l'avance en arrière-plan : la réserve est
+remplie jusqu'à ASSISTANT_THREAD_POOL_SIZE dès qu'elle passe sous
+ASSISTANT_THREAD_POOL_LOW_WATER. Un thread non utilisé après
+ASSISTANT_THREAD_TTL secondes est supprimé plutôt que distribué.
+
+La réserve est vidée quand le modèle quitte 'openai' (reload_model_settings).
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+ASSISTANT_THREAD_POOL_SIZE = int(os.environ.get('ASSISTANT_THREAD_POOL_SIZE', '10'))
+ASSISTANT_THREAD_POOL_LOW_WATER = int(os.environ.get('ASSISTANT_THREAD_POOL_LOW_WATER', '3'))
+ASSISTANT_THREAD_TTL = int(os.environ.get('ASSISTANT_THREAD_TTL', '86400'))
+
+_pool = deque()  # (thread_id, created_at)
+_pool_lock = threading.Lock()
+_refill_thread = None
+# Incrémenté à chaque vidage : un remplissage en cours pour une ancienne génération s'arrête
+_generation = 0
+
+
+def _get_client():
+    from ai_config import get_provider_client
+    client = get_provider_client('openai')
+    if client is None:
+        raise RuntimeError("OpenAI client not configured. Set OPENAI_API_KEY.")
+    return client
+
+
+def _delete_threads(thread_ids):
+    """Supprime des threads inutilisés (best effort)"""
+    if not thread_ids:
+        return
+    try:
+        client = _get_client()
+    except Exception:
+        return
+    for thread_id in thread_ids:
+        try:
+            client.beta.threads.delete(thread_id)
+        except Exception as e:
+            logger.debug(f"Suppression du thread {thread_id} échouée: {e}")
+
+
+# ===================================
+# DISTRIBUTION
+# ===================================
+
+def take_pooled_thread_id():
+    """
+    Prend un thread dans la réserve sans jamais appeler l'API (handlers async).
+
+    Returns:
+        str: ID du thread OpenAI, ou None si la réserve est vide
+    """
+    expired = []
+    thread_id = None
+    now = time.time()
+
+    with _pool_lock:
+        while _pool:
+            candidate, created_at = _pool.popleft()
+            if now - created_at < ASSISTANT_THREAD_TTL:
+                thread_id = candidate
+                break
+            expired.append(candidate)
+        remaining = len(_pool)
+
+    if remaining < ASSISTANT_THREAD_POOL_LOW_WATER:
+        _schedule_refill()
+    if expired:
+        threading.Thread(target=_delete_threads, args=(expired,), daemon=True).start()
+
+    if thread_id:
+        logger.debug(f"Thread OpenAI {thread_id} pris dans la réserve ({remaining} restant(s))")
+    return thread_id
+
+
+def acquire_thread_id():
+    """
+    Retourne l'ID d'un thread OpenAI prêt à l'emploi.
+    Prend un thread de la réserve si possible, sinon en crée un immédiatement.
+
+    Returns:
+        str: ID du thread OpenAI
+    """
+    thread_id = take_pooled_thread_id()
+    if thread_id:
+        return thread_id
+
+    logger.info("Réserve de threads OpenAI vide, création directe")
+    return _get_client().beta.threads.create().id
+
+
+# ===================================
+# REMPLISSAGE ET VIDAGE
+# ===================================
+
+def _schedule_refill():
+    """Lance le remplissage en arrière-plan s'il n'est pas déjà en cours"""
+    global _refill_thread
+    if ASSISTANT_THREAD_POOL_SIZE <= 0:
+        return
+    with _pool_lock:
+        if _refill_thread is not None and _refill_thread.is_alive():
+            return
+        _refill_thread = threading.Thread(
+            target=_refill, args=(_generation,), daemon=True, name='assistant-thread-pool'
+        )
+        _refill_thread.start()
+
+
+def _refill(generation):
+    created = 0
+    while True:
+        with _pool_lock:
+            if generation != _generation or len(_pool) >= ASSISTANT_THREAD_POOL_SIZE:
+                break
+        try:
+            thread_id = _get_client().beta.threads.create().id
+        except Exception as e:
+            logger.error(f"Remplissage de la réserve de threads OpenAI interrompu: {e}")
+            break
+
+        with _pool_lock:
+            if generation == _generation:
+                _pool.append((thread_id, time.time()))
+                created += 1
+                continue
+        # La réserve a été vidée pendant la création
+        _delete_threads([thread_id])
+        break
+
+    if created:
+        logger.info(f"Réserve de threads OpenAI remplie (+{created}, total {len(_pool)})")
+
+
+def warm_thread_pool():
+    """Pré-remplit la réserve (démarrage de l'application ou passage au modèle 'openai')"""
+    _schedule_refill()
+
+
+def drain_thread_pool():
+    """Vide la réserve et supprime les threads non distribués (en arrière-plan)"""
+    global _generation
+    with _pool_lock:
+        _generation += 1
+        thread_ids = [thread_id for thread_id, _ in _pool]
+        _pool.clear()
+
+    if thread_ids:
+        logger.info(f"Réserve de threads OpenAI vidée ({len(thread_ids)} thread(s))")
+        threading.Thread(target=_delete_threads, args=(thread_ids,), daemon=True).start()
+
+
+def on_model_changed(current_model):
+    """Adapte la réserve au modèle actif"""
+    if current_model == 'openai':
+        warm_thread_pool()
+    else:
+        drain_thread_pool()
+
+
+def get_thread_pool_stats():
+    """Retourne l'état de la réserve (monitoring)"""
+    with _pool_lock:
+        return {
+            'available': len(_pool),
+            'target': ASSISTANT_THREAD_POOL_SIZE,
+            'low_water': ASSISTANT_THREAD_POOL_LOW_WATER
+        }
@@ -6,13 +6,14 @@ from models import Conversation, Message, User, UserMemory
 from subscription_manager import MessageLimitChecker
 from ai_config import (
     get_ai_client, get_model_name, get_system_instructions,
-    CURRENT_MODEL, ASSISTANT_ID, openai_client
+    CURRENT_MODEL, ASSISTANT_ID, get_provider_client
 )
 from ai_utils import (
     prepare_messages_for_api, process_image_for_openai,
-    OpenAIAssistantEventHandler, execute_chat_completion
+    OpenAIAssistantEventHandler, execute_chat_completion, ReasoningStreamer
 )
 from conversation_utils import conversation_is_valid, get_or_create_conversation
+from conversation_summary import truncate_history_with_summary, schedule_summary_refresh
 from utils import save_base64_image, clean_response, db_retry_session
 from datetime import datetime
 import logging
@@ -133,9 +134,10 @@ def handle_message_logic(data, socketio_instance):
 
         # Construire le prompt système final avec le warning si nécessaire
         if system_warning_message:
-            final_system_prompt = system_warning_message + "\n\n" + memory_context + base_instructions
+            system_context = system_warning_message + "\n\n" + memory_context
         else:
-            final_system_prompt = memory_context + base_instructions
+            system_context = memory_context
+        final_system_prompt = system_context + base_instructions
         # === FIN : LECTURE ET INJECTION MÉMOIRE ===
 
         # Variables to store Mathpix results
@@ -252,8 +254,8 @@ def handle_message_logic(data, socketio_instance):
                 else:
                     # Pour les autres modèles: utiliser Mathpix comme avant
                     logger.info(f"Modèle {CURRENT_MODEL} détecté: utilisation de Mathpix pour l'extraction de contenu")
-                    from mathpix_utils import process_image_with_mathpix
-                    mathpix_result = process_image_with_mathpix(data['image'])
+                    from image_cache import ocr_image_cached
+                    mathpix_result = ocr_image_cached(data['image'])
                     logger.debug(f"Résultat Mathpix obtenu: {len(str(mathpix_result))} caractères")
 
                     if "error" in mathpix_result:
@@ -355,15 +357,18 @@ def handle_message_logic(data, socketio_instance):
                     db.session.commit()
                     return
 
+                messages_history, summary_context = truncate_history_with_summary(
+                    'web', conversation.id, messages_history
+                )
                 messages = prepare_messages_for_api(
                     messages_history,
                     CURRENT_MODEL,
-                    final_system_prompt
+                    summary_context + final_system_prompt
                 )
 
                 if CURRENT_MODEL == 'openai':
                     logger.info("Utilisation d'OpenAI pour l'image en mode streaming (Assistant API)")
-                    openai_assist_client = openai_client
+                    openai_assist_client = get_provider_client('openai')
                     try:
                         content_items = [{"type": "text", "text": message_for_assistant}]
 
@@ -428,14 +433,21 @@ def handle_message_logic(data, socketio_instance):
                             stream=True
                         )
 
+                        reasoning_streamer = ReasoningStreamer(socketio_instance, db_message.id)
                         for chunk in response:
                             chunk_content = None
+                            reasoning_chunk = None
                             if chunk.choices and len(chunk.choices) > 0:
                                 delta = chunk.choices[0].delta
                                 if delta and hasattr(delta, 'content'):
                                     chunk_content = delta.content
+                                reasoning_chunk = getattr(delta, 'reasoning_content', None) if delta else None
+
+                            if reasoning_chunk:
+                                reasoning_streamer.add(reasoning_chunk)
 
                             if chunk_content:
+                                reasoning_streamer.finish()
                                 cleaned_chunk = clean_response(chunk_content)
                                 assistant_message += cleaned_chunk
                                 socketio_instance.emit('response_stream', {
@@ -444,6 +456,7 @@ def handle_message_logic(data, socketio_instance):
                                     'is_final': False
                                 })
 
+                        reasoning_streamer.finish()
                         socketio_instance.emit('response_stream', {
                             'content': '',
                             'message_id': db_message.id,
@@ -475,6 +488,7 @@ def handle_message_logic(data, socketio_instance):
                         db.session.commit()
                         logger.info(f"Réponse/Erreur pour image sauvegardée (Streamed, Message ID: {db_message.id})")
                         update_success = True
+                        schedule_summary_refresh('web', conversation.id)
                     else:
                         logger.error(f"Impossible de trouver le message {db_message.id} pour sauvegarder la réponse/erreur image (Streamed).")
                 except Exception as final_save_error:
@@ -549,19 +563,22 @@ def handle_message_logic(data, socketio_instance):
 
                     db.session.commit()
 
-                    # On injecte le prompt système dans l'historique avant l'appel
-                    if final_system_prompt:
-                        messages_history.insert(0, {"role": "system", "content": final_system_prompt})
+                    # Remplacer les anciens messages par le résumé glissant de la conversation
+                    messages_history, summary_context = truncate_history_with_summary(
+                        'web', conversation.id, messages_history
+                    )
 
+                    # Résumé, avertissement et mémoire précèdent les instructions du modèle
+                    # retenu par le routeur (qui peut différer de CURRENT_MODEL)
                     assistant_message = execute_chat_completion(
                         messages_history=messages_history,
                         current_model=CURRENT_MODEL,
                         stream=True,
                         socketio_emitter=socketio_instance,
                         message_id=db_message.id,
-                        # On indique à la fonction de ne pas rajouter les instructions système
-                        # (Nécessite une petite adaptation de execute_chat_completion pour gérer ce nouveau paramètre)
-                        add_system_instructions=False 
+                        add_system_instructions=True,
+                        platform='web',
+                        system_context=summary_context + system_context
                     )
                     logger.info(f"Streaming {CURRENT_MODEL} terminé")
 
@@ -571,6 +588,7 @@ def handle_message_logic(data, socketio_instance):
                             current_db_message.content = assistant_message
                             db.session.commit()
                             logger.info(f"Message {db_message.id} sauvegardé avec succès")
+                            schedule_summary_refresh('web', conversation.id)
                     except Exception as save_error:
                         logger.error(f"Erreur sauvegarde message: {save_error}")
                         db.session.rollback()
@@ -9,6 +9,9 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     MAX_UPLOAD_FOLDER_SIZE = 500 * 1024 * 1024  # 500 MB
     IMAGE_MAX_AGE_HOURS = 24
+    # Sous-dossiers jamais purgés (images des leçons, référencées en base)
+    UPLOAD_CLEANUP_EXCLUDE = ('lessons',)
+    UPLOAD_CLEANUP_TIME_BUDGET = float(os.getenv('UPLOAD_CLEANUP_TIME_BUDGET', '10'))  # secondes par passage
 
     # Flask settings
     SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'your-secret-key')
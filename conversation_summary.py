@@ -0,0 +1,292 @@
+"""
+Résumés glissants des conversations (Web, Telegram, WhatsApp).
+
+Quand une conversation dépasse CONTEXT_MESSAGE_LIMIT messages, les plus anciens
+sont remplacés dans le prompt par un résumé stocké en base. Le résumé est
+rafraîchi en arrière-plan (un seul worker, basse priorité) tous les
+SUMMARY_REFRESH_TURNS échanges, de manière incrémentale : seul l'ancien résumé
+et les nouveaux messages sortis de la fenêtre sont envoyés à l'IA.
+"""
+
+import os
+import time
+import logging
+from queue import Queue, Empty
+from threading import Lock, Thread
+from datetime import datetime
+
+from sqlalchemy import func
+
+from database import db
+from models import (
+    ConversationSummary, Message, TelegramMessage, WhatsAppMessage
+)
+from ai_config import CONTEXT_MESSAGE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Nombre d'échanges (question + réponse) entre deux rafraîchissements du résumé
+SUMMARY_REFRESH_TURNS = int(os.environ.get('SUMMARY_REFRESH_TURNS', '10'))
+SUMMARY_MAX_CHARS = int(os.environ.get('SUMMARY_MAX_CHARS', '2000'))
+SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'gpt-4.1-mini')
+# Fournisseur de SUMMARY_MODEL ('openai', 'deepseek', 'qwen', 'gemini')
+SUMMARY_PROVIDER = os.environ.get('SUMMARY_PROVIDER', 'openai')
+# Pause entre deux résumés pour laisser la priorité au trafic interactif
+SUMMARY_WORKER_PAUSE = float(os.environ.get('SUMMARY_WORKER_PAUSE', '1'))
+
+# Messages récents laissés hors du résumé lors d'un rafraîchissement. La fenêtre
+# envoyée au modèle (CONTEXT_MESSAGE_LIMIT) recouvre donc toujours la fin du résumé
+# jusqu'au rafraîchissement suivant.
+_KEEP_RECENT = max(CONTEXT_MESSAGE_LIMIT - 2 * SUMMARY_REFRESH_TURNS, 1)
+
+_refresh_queue = Queue()
+_pending_keys = set()
+_pending_lock = Lock()
+_worker_thread = None
+
+
+# ===================================
+# LECTURE DU RÉSUMÉ
+# ===================================
+
+def get_summary_context(platform, conversation_id):
+    """
+    Retourne le résumé formaté pour être ajouté au prompt système.
+
+    Args:
+        platform: 'web', 'telegram' ou 'whatsapp'
+        conversation_id: ID de la conversation (thread_id pour WhatsApp)
+
+    Returns:
+        str: Bloc de contexte, ou "" si aucun résumé n'existe
+    """
+    try:
+        summary = ConversationSummary.query.filter_by(
+            platform=platform,
+            conversation_id=str(conversation_id)
+        ).first()
+    except Exception as e:
+        logger.error(f"Erreur lecture résumé {platform}/{conversation_id}: {e}")
+        return ""
+
+    if not summary or not summary.summary:
+        return ""
+
+    return (
+        f"[Résumé des échanges précédents avec l'élève : {summary.summary}\n"
+        f"Utilise ce résumé comme mémoire de la conversation sans jamais le mentionner.]\n"
+        f"---\n"
+    )
+
+
+def truncate_history_with_summary(platform, conversation_id, messages_history, limit=None):
+    """
+    Remplace les messages hors fenêtre par le résumé de la conversation.
+
+    Si aucun résumé n'existe encore, l'historique est renvoyé tel quel pour ne
+    pas perdre de contexte en attendant le premier rafraîchissement.
+
+    Args:
+        platform: 'web', 'telegram' ou 'whatsapp'
+        conversation_id: ID de la conversation
+        messages_history: Historique [{"role": "...", "content": "..."}]
+        limit: Taille de la fenêtre (par défaut CONTEXT_MESSAGE_LIMIT)
+
+    Returns:
+        tuple: (historique tronqué, contexte de résumé à préfixer au prompt système)
+    """
+    limit = limit or CONTEXT_MESSAGE_LIMIT
+    if len(messages_history) <= limit:
+        return messages_history, ""
+
+    summary_context = get_summary_context(platform, conversation_id)
+    if not summary_context:
+        return messages_history, ""
+
+    recent = messages_history[-limit:]
+    # La fenêtre doit commencer par un message utilisateur (exigence de deepseek-reasoner)
+    while len(recent) > 1 and recent[0]['role'] != 'user':
+        recent = recent[1:]
+
+    logger.debug(f"Historique {platform}/{conversation_id} tronqué: {len(messages_history)} -> {len(recent)} messages + résumé")
+    return recent, summary_context
+
+
+# ===================================
+# RAFRAÎCHISSEMENT EN ARRIÈRE-PLAN
+# ===================================
+
+def schedule_summary_refresh(platform, conversation_id):
+    """
+    Demande un rafraîchissement du résumé (non bloquant).
+    Le worker vérifie lui-même si le seuil de SUMMARY_REFRESH_TURNS est atteint.
+    """
+    key = (platform, str(conversation_id))
+    with _pending_lock:
+        if key in _pending_keys:
+            return
+        _pending_keys.add(key)
+    _refresh_queue.put(key)
+    _ensure_worker()
+
+
+def _ensure_worker():
+    """Démarre le worker de résumé s'il n'est pas déjà actif"""
+    global _worker_thread
+    with _pending_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = Thread(target=_summary_worker, daemon=True, name='conversation-summary')
+            _worker_thread.start()
+
+
+def _summary_worker():
+    """Worker unique qui traite les demandes de résumé une par une"""
+    from app import app  # Import local pour éviter circularité
+
+    logger.info("Worker de résumé de conversation démarré")
+    while True:
+        try:
+            key = _refresh_queue.get(timeout=300)
+        except Empty:
+            logger.info("Worker de résumé arrêté (inactif)")
+            return
+
+        with _pending_lock:
+            _pending_keys.discard(key)
+
+        platform, conversation_id = key
+        with app.app_context():
+            try:
+                refresh_conversation_summary(platform, conversation_id)
+            except Exception as e:
+                logger.error(f"Erreur rafraîchissement résumé {platform}/{conversation_id}: {e}", exc_info=True)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+        _refresh_queue.task_done()
+        time.sleep(SUMMARY_WORKER_PAUSE)
+
+
+def _conversation_query(platform, conversation_id):
+    """Requête des messages non vides d'une conversation, dans l'ordre chronologique"""
+    if platform == 'web':
+        model, order = Message, Message.created_at
+        query = Message.query.filter_by(conversation_id=int(conversation_id))
+    elif platform == 'telegram':
+        model, order = TelegramMessage, TelegramMessage.created_at
+        query = TelegramMessage.query.filter_by(conversation_id=int(conversation_id))
+    elif platform == 'whatsapp':
+        model, order = WhatsAppMessage, WhatsAppMessage.timestamp
+        query = WhatsAppMessage.query.filter_by(thread_id=conversation_id)
+    else:
+        raise ValueError(f"Plateforme inconnue: {platform}")
+
+    query = query.filter(model.content.isnot(None), func.trim(model.content) != '')
+    return query, order
+
+
+def _count_conversation_messages(platform, conversation_id):
+    """Nombre de messages non vides d'une conversation (sans les charger)"""
+    query, _ = _conversation_query(platform, conversation_id)
+    return query.count()
+
+
+def _load_conversation_messages(platform, conversation_id, start=0, stop=None):
+    """Charge les messages [start:stop] d'une conversation au format [{"role", "content"}]"""
+    query, order = _conversation_query(platform, conversation_id)
+    query = query.order_by(order).offset(start)
+    if stop is not None:
+        query = query.limit(stop - start)
+
+    if platform == 'whatsapp':
+        return [{"role": 'user' if m.direction == 'inbound' else 'assistant', "content": m.content} for m in query.all()]
+    return [{"role": m.role, "content": m.content} for m in query.all()]
+
+
+def _summarize(previous_summary, new_messages):
+    """Appelle l'IA pour fusionner l'ancien résumé et les nouveaux messages"""
+    from ai_config import get_ai_client, get_model_name, get_provider_client
+
+    transcript = "\n".join(
+        f"{'Élève' if m['role'] == 'user' else 'Exô'}: {m['content']}" for m in new_messages
+    )
+    # Garder la fin si le bloc est trop long (~3-4K tokens)
+    transcript = transcript[-15000:]
+
+    prompt = f"""
+Tu maintiens le résumé d'une séance de tutorat entre un élève et Exô (assistant éducatif).
+
+RÉSUMÉ ACTUEL :
+{previous_summary or "(aucun)"}
+
+NOUVEAUX ÉCHANGES :
+{transcript}
+
+TÂCHE :
+Réécris un résumé unique, factuel et concis (maximum {SUMMARY_MAX_CHARS} caractères) qui conserve :
+- les exercices et notions travaillés, avec les résultats ou méthodes importants
+- ce que l'élève a compris et ce qui lui pose encore problème
+- les questions restées en suspens
+N'invente rien. Réponds uniquement avec le résumé.
+"""
+
+    client, model = get_provider_client(SUMMARY_PROVIDER), SUMMARY_MODEL
+    if client is None:
+        # Fournisseur du modèle de résumé non configuré : modèle du chat
+        client, model = get_ai_client(), get_model_name() or SUMMARY_MODEL
+
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "Tu résumes des conversations éducatives."},
+            {"role": "user", "content": prompt}
+        ],
+        timeout=60
+    )
+    return (response.choices[0].message.content or "").strip()[:SUMMARY_MAX_CHARS]
+
+
+def refresh_conversation_summary(platform, conversation_id):
+    """
+    Rafraîchit le résumé si au moins SUMMARY_REFRESH_TURNS échanges sont sortis
+    de la zone déjà résumée. Doit être appelé dans un app_context.
+
+    Returns:
+        bool: True si le résumé a été mis à jour
+    """
+    message_count = _count_conversation_messages(platform, conversation_id)
+
+    summary = ConversationSummary.query.filter_by(
+        platform=platform,
+        conversation_id=str(conversation_id)
+    ).first()
+    covered = summary.messages_covered if summary else 0
+
+    # Tant que la fenêtre contient encore tout ce qui n'est pas résumé, rien à faire
+    if message_count - covered < _KEEP_RECENT + 2 * SUMMARY_REFRESH_TURNS or message_count <= CONTEXT_MESSAGE_LIMIT:
+        return False
+
+    # Seuls les messages qui sortent de la fenêtre sont chargés
+    new_covered = message_count - _KEEP_RECENT
+    new_messages = _load_conversation_messages(platform, conversation_id, covered, new_covered)
+    new_summary = _summarize(summary.summary if summary else None, new_messages)
+    if not new_summary:
+        logger.warning(f"Résumé vide retourné pour {platform}/{conversation_id}, ignoré.")
+        return False
+
+    if summary:
+        summary.summary = new_summary
+        summary.messages_covered = new_covered
+        summary.updated_at = datetime.utcnow()
+    else:
+        db.session.add(ConversationSummary(
+            platform=platform,
+            conversation_id=str(conversation_id),
+            summary=new_summary,
+            messages_covered=new_covered
+        ))
+    db.session.commit()
+
+    logger.info(f"📝 Résumé {platform}/{conversation_id} mis à jour ({new_covered} messages couverts)")
+    return True
@@ -5,6 +5,7 @@ from flask_login import current_user
 from database import db
 from models import Conversation
 from utils import db_retry_session
+from assistant_thread_pool import acquire_thread_id
 
 logger = logging.getLogger(__name__)
 
@@ -64,13 +65,11 @@ def get_or_create_conversation(thread_id=None, message_content=None):
             # Si la conversation n'appartient pas à l'utilisateur actuel, on ignore ce thread_id
 
         # Create new thread and conversation
-        from ai_config import CURRENT_MODEL, get_ai_client
+        from ai_config import CURRENT_MODEL
 
-        client = get_ai_client()
         if CURRENT_MODEL == 'openai':
-            # Only create thread for OpenAI
-            thread = client.beta.threads.create()
-            thread_id = thread.id
+            # Only create thread for OpenAI (pris dans la réserve pré-créée)
+            thread_id = acquire_thread_id()
         else:
             # For other models, generate a UUID as thread_id
             thread_id = str(uuid.uuid4())
@@ -0,0 +1,623 @@
+"""
+File durable des messages entrants (WhatsApp, Telegram).
+
+Le webhook enregistre chaque message dans la table inbound_job avant de
+répondre 200 à Meta/Telegram ; un consommateur par processus réclame ensuite
+les jobs et les confie au pool de workers de la plateforme. Un redéploiement
+ou un crash ne perd donc plus les messages en cours : un job réclamé mais
+jamais terminé redevient disponible après INBOUND_VISIBILITY_TIMEOUT.
+
+- Idempotence : (platform, message_id) est unique, un message renvoyé par la
+  plateforme n'est mis en file qu'une fois ; complete_job() peut être rejoué.
+- Ordre : seul le plus ancien job non terminé d'une conversation peut être
+  réclamé, les suivants attendent qu'il soit terminé.
+- Multi-processus : la réclamation est un UPDATE conditionnel, un seul
+  processus peut l'emporter. Chaque réclamation reçoit son propre jeton de
+  verrou (locked_by) : le worker renouvelle le bail au démarrage puis
+  périodiquement, et ne termine le job que s'il détient encore le verrou.
+  Une copie périmée (job repris après expiration) n'est donc jamais traitée.
+- Rafales : un élève envoie souvent sa question en plusieurs messages courts.
+  Si la plateforme fournit une fonction de fusion, un job dont la rafale est
+  encore ouverte est rendu à la file jusqu'à la fin de la fenêtre de calme
+  (sans occuper de worker), puis absorbe les messages suivants de la
+  conversation pour une seule génération (voir defer_open_burst, collect_burst).
+
+Fonctionne avec PostgreSQL comme avec la base SQLite de développement.
+"""
+
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import InboundJob
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+# Doit couvrir le traitement le plus long (génération IA avec retries)
+INBOUND_VISIBILITY_TIMEOUT = int(os.environ.get('INBOUND_VISIBILITY_TIMEOUT', '600'))
+INBOUND_MAX_ATTEMPTS = int(os.environ.get('INBOUND_MAX_ATTEMPTS', '3'))
+INBOUND_RETRY_DELAY = int(os.environ.get('INBOUND_RETRY_DELAY', '30'))
+INBOUND_POLL_INTERVAL = float(os.environ.get('INBOUND_POLL_INTERVAL', '2'))
+INBOUND_RETENTION_DAYS = int(os.environ.get('INBOUND_RETENTION_DAYS', '7'))
+# Rafales : attente maximale totale et nombre maximal de messages fusionnés
+BURST_MAX_WAIT = float(os.environ.get('BURST_MAX_WAIT', '8'))
+BURST_MAX_MESSAGES = int(os.environ.get('BURST_MAX_MESSAGES', '5'))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_ACTIVE_STATUSES = ('pending', 'processing')
+
+_consumers = {}  # platform -> DurableQueueConsumer de ce processus
+
+
+class JobFailedError(Exception):
+    """Traitement à retenter (génération IA ou envoi de la réponse en échec) : le job passe par fail_job"""
+
+
+# ===================================
+# OPÉRATIONS SUR LA FILE
+# ===================================
+
+def enqueue_job(platform, message_id, conversation_key, payload):
+    """
+    Enregistre un message entrant. Doit être appelé dans un app_context.
+
+    Returns:
+        bool: True si le job a été créé, False s'il existait déjà (doublon)
+    """
+    job = InboundJob(
+        platform=platform,
+        message_id=str(message_id),
+        conversation_key=str(conversation_key),
+        payload=payload
+    )
+    try:
+        db.session.add(job)
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        logger.info(f"Job {platform}/{message_id} déjà en file, ignoré")
+        return False
+
+
+def job_exists(platform, message_id):
+    """Indique si un message est déjà en file (même clé unique que enqueue_job : redélivrance)"""
+    return db.session.query(InboundJob.id).filter_by(
+        platform=platform, message_id=str(message_id)
+    ).first() is not None
+
+
+def _new_lock():
+    """Jeton propre à une réclamation : distingue deux réclamations successives d'un même processus"""
+    return f"{WORKER_ID}/{uuid.uuid4().hex[:8]}"
+
+
+def _claimable(now):
+    return or_(InboundJob.locked_until.is_(None), InboundJob.locked_until < now)
+
+
+def claim_jobs(platform, limit=10):
+    """
+    Réclame jusqu'à `limit` jobs disponibles (un au plus par conversation).
+
+    Returns:
+        list[dict]: Jobs réclamés (id, platform, message_id, conversation_key, payload)
+    """
+    now = datetime.utcnow()
+
+    # Tête de file de chaque conversation
+    heads = db.session.query(func.min(InboundJob.id)).filter(
+        InboundJob.platform == platform,
+        InboundJob.status.in_(_ACTIVE_STATUSES)
+    ).group_by(InboundJob.conversation_key)
+
+    candidates = InboundJob.query.filter(
+        InboundJob.id.in_(heads),
+        _claimable(now)
+    ).order_by(InboundJob.id).limit(limit).all()
+
+    claimed = []
+    for job in candidates:
+        if job.attempts >= INBOUND_MAX_ATTEMPTS:
+            # Job abandonné par des workers successifs : ne pas bloquer la conversation
+            InboundJob.query.filter(
+                InboundJob.id == job.id,
+                InboundJob.status.in_(_ACTIVE_STATUSES),
+                _claimable(now)
+            ).update({
+                'status': 'failed',
+                'locked_by': None,
+                'locked_until': None,
+                'last_error': job.last_error or 'visibility timeout exceeded'
+            }, synchronize_session=False)
+            db.session.commit()
+            logger.error(f"Job {platform}/{job.message_id} abandonné après {job.attempts} tentative(s)")
+            continue
+
+        lock = _new_lock()
+        rows = InboundJob.query.filter(
+            InboundJob.id == job.id,
+            InboundJob.status.in_(_ACTIVE_STATUSES),
+            _claimable(now)
+        ).update({
+            'status': 'processing',
+            'locked_by': lock,
+            'locked_until': now + timedelta(seconds=INBOUND_VISIBILITY_TIMEOUT),
+            'attempts': InboundJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if rows == 1:
+            claimed.append({
+                'id': job.id,
+                'platform': job.platform,
+                'message_id': job.message_id,
+                'conversation_key': job.conversation_key,
+                'payload': job.payload,
+                'created_at': job.created_at,
+                'lock': lock
+            })
+
+    return claimed
+
+
+def renew_lock(platform, lock):
+    """
+    Prolonge le bail des jobs détenus par un jeton de verrou (job principal et
+    jobs absorbés). Doit être appelé dans un app_context.
+
+    Returns:
+        bool: False si le verrou a été perdu (job expiré puis repris ailleurs)
+    """
+    rows = InboundJob.query.filter(
+        InboundJob.platform == platform,
+        InboundJob.locked_by == lock,
+        InboundJob.status == 'processing'
+    ).update({
+        'locked_until': datetime.utcnow() + timedelta(seconds=INBOUND_VISIBILITY_TIMEOUT)
+    }, synchronize_session=False)
+    db.session.commit()
+    return rows > 0
+
+
+def _burst_followers(platform, job, can_merge, now):
+    """Messages fusionnables qui suivent le job dans sa conversation (s'arrête au premier non fusionnable)"""
+    followers = InboundJob.query.filter(
+        InboundJob.platform == platform,
+        InboundJob.conversation_key == job['conversation_key'],
+        InboundJob.status == 'pending',
+        InboundJob.id > job['id'],
+        _claimable(now)
+    ).order_by(InboundJob.id).limit(BURST_MAX_MESSAGES - 1).all()
+
+    mergeable = []
+    for follower in followers:
+        if not can_merge(follower.payload):
+            break
+        mergeable.append(follower)
+    return mergeable, len(mergeable) < len(followers)
+
+
+def defer_open_burst(platform, job, can_merge, window):
+    """
+    Rend à la file un job dont la rafale est encore ouverte : moins de `window`
+    secondes depuis le dernier message, moins de BURST_MAX_WAIT depuis le premier
+    et moins de BURST_MAX_MESSAGES messages. Le job redevient réclamable à la fin
+    de la fenêtre de calme ; la tentative n'est pas comptée et aucun worker n'attend.
+    Doit être appelé dans un app_context.
+
+    Returns:
+        bool: True si le job a été différé
+    """
+    now = datetime.utcnow()
+    first_arrival = job.get('created_at') or now
+    followers, interrupted = _burst_followers(platform, job, can_merge, now)
+    if interrupted or len(followers) + 1 >= BURST_MAX_MESSAGES:
+        return False
+
+    last_arrival = max([first_arrival] + [f.created_at for f in followers if f.created_at])
+    until = min(last_arrival + timedelta(seconds=window), first_arrival + timedelta(seconds=BURST_MAX_WAIT))
+    if until <= now:
+        return False
+
+    rows = InboundJob.query.filter(
+        InboundJob.id == job['id'],
+        InboundJob.locked_by == job['lock'],
+        InboundJob.status == 'processing'
+    ).update({
+        'status': 'pending',
+        'locked_by': None,
+        'locked_until': until,
+        'attempts': InboundJob.attempts - 1
+    }, synchronize_session=False)
+    db.session.commit()
+    return rows == 1
+
+
+def collect_burst(platform, job, can_merge):
+    """
+    Absorbe les messages fusionnables qui suivent un job réclamé dans la même
+    conversation (BURST_MAX_MESSAGES au plus), sans attente : la fenêtre de calme
+    est gérée en amont par defer_open_burst. Doit être appelé dans un app_context.
+
+    Les jobs absorbés sont verrouillés comme le job principal et suivent son sort.
+    Un message non fusionnable termine la rafale : il sera traité normalement,
+    après celle-ci.
+
+    Returns:
+        list[dict]: Jobs absorbés, dans l'ordre d'arrivée
+    """
+    now = datetime.utcnow()
+    followers, _ = _burst_followers(platform, job, can_merge, now)
+
+    absorbed = []
+    for follower in followers:
+        rows = InboundJob.query.filter(
+            InboundJob.id == follower.id,
+            InboundJob.status == 'pending'
+        ).update({
+            'status': 'processing',
+            'locked_by': job['lock'],
+            'locked_until': now + timedelta(seconds=INBOUND_VISIBILITY_TIMEOUT)
+        }, synchronize_session=False)
+        db.session.commit()
+        if rows != 1:
+            break
+        absorbed.append({
+            'id': follower.id,
+            'message_id': follower.message_id,
+            'payload': follower.payload
+        })
+
+    if absorbed:
+        logger.info(f"Rafale {platform}/{job['conversation_key']}: {len(absorbed) + 1} messages fusionnés")
+    return absorbed
+
+
+def _owned(query, lock):
+    """Restreint une requête aux jobs détenus par `lock` (None : pas de contrôle)"""
+    return query if lock is None else query.filter(InboundJob.locked_by == lock)
+
+
+def complete_job(platform, message_id, lock=None):
+    """
+    Marque un job comme terminé (idempotent) et réveille le consommateur.
+
+    Returns:
+        bool: False si `lock` ne détient plus le job (repris par un autre worker)
+    """
+    rows = _owned(InboundJob.query.filter_by(platform=platform, message_id=str(message_id)), lock).update({
+        'status': 'done',
+        'locked_by': None,
+        'locked_until': None
+    }, synchronize_session=False)
+    db.session.commit()
+    if rows == 0 and lock is not None:
+        logger.warning(f"Job {platform}/{message_id} terminé sans verrou (repris par un autre worker)")
+        return False
+
+    # Le message suivant de la conversation devient réclamable : pas d'attente du prochain tour
+    consumer = _consumers.get(platform)
+    if consumer is not None:
+        consumer.notify()
+    return True
+
+
+def fail_job(platform, message_id, error, lock=None):
+    """
+    Enregistre un échec : nouvelle tentative différée, ou abandon après INBOUND_MAX_ATTEMPTS.
+    Sans effet si `lock` ne détient plus le job : la réclamation en cours décide.
+
+    Returns:
+        bool: True si le job est abandonné (plus de nouvelle tentative)
+    """
+    job = InboundJob.query.filter_by(platform=platform, message_id=str(message_id)).first()
+    if not job or job.status == 'done':
+        return False
+    if lock is not None and job.locked_by != lock:
+        logger.warning(f"Échec du job {platform}/{message_id} ignoré: verrou perdu")
+        return False
+
+    job.last_error = str(error)[:2000]
+    job.locked_by = None
+    if job.attempts >= INBOUND_MAX_ATTEMPTS:
+        job.status = 'failed'
+        job.locked_until = None
+        logger.error(f"Job {platform}/{message_id} en échec définitif: {error}")
+    else:
+        job.status = 'pending'
+        job.locked_until = datetime.utcnow() + timedelta(seconds=INBOUND_RETRY_DELAY * job.attempts)
+    db.session.commit()
+    return job.status == 'failed'
+
+
+def _release_absorbed(platform, message_ids, lock=None):
+    """Rend les jobs absorbés par une rafale dont le traitement a échoué"""
+    _owned(InboundJob.query.filter(
+        InboundJob.platform == platform,
+        InboundJob.message_id.in_([str(m) for m in message_ids]),
+        InboundJob.status == 'processing'
+    ), lock).update({
+        'status': 'pending',
+        'locked_by': None,
+        'locked_until': None
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def release_job(platform, message_id, lock=None):
+    """Rend un job réclamé mais non démarré (pool saturé) ; la tentative n'est pas comptée"""
+    _owned(InboundJob.query.filter_by(platform=platform, message_id=str(message_id)).filter(
+        InboundJob.status == 'processing'
+    ), lock).update({
+        'status': 'pending',
+        'locked_by': None,
+        'locked_until': None,
+        'attempts': InboundJob.attempts - 1
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def purge_finished_jobs():
+    """Supprime les jobs terminés ou en échec plus anciens que INBOUND_RETENTION_DAYS (tâche planifiée)"""
+    from app import app  # Import local pour éviter circularité
+
+    with app.app_context():
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=INBOUND_RETENTION_DAYS)
+            deleted = InboundJob.query.filter(
+                InboundJob.status.in_(('done', 'failed')),
+                InboundJob.updated_at < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if deleted:
+                logger.info(f"🧹 {deleted} job(s) entrant(s) purgé(s)")
+        except Exception as e:
+            logger.error(f"Erreur purge des jobs entrants: {e}", exc_info=True)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def count_active_jobs(platform, conversation_key=None):
+    """Nombre de jobs en attente ou en cours d'une plateforme, ou d'une seule conversation (profondeur de file)"""
+    query = InboundJob.query.filter(
+        InboundJob.platform == platform,
+        InboundJob.status.in_(_ACTIVE_STATUSES)
+    )
+    if conversation_key is not None:
+        query = query.filter(InboundJob.conversation_key == str(conversation_key))
+    return query.count()
+
+
+def get_lane_depths(platform, limit=10):
+    """Conversations ayant le plus de jobs en attente ou en cours (monitoring)"""
+    rows = db.session.query(InboundJob.conversation_key, func.count(InboundJob.id))\
+                     .filter(InboundJob.platform == platform, InboundJob.status.in_(_ACTIVE_STATUSES))\
+                     .group_by(InboundJob.conversation_key)\
+                     .order_by(func.count(InboundJob.id).desc())\
+                     .limit(limit).all()
+    return [{'conversation_key': key, 'depth': depth} for key, depth in rows]
+
+
+def get_inbound_queue_stats():
+    """Nombre de jobs par plateforme et statut (monitoring)"""
+    rows = db.session.query(InboundJob.platform, InboundJob.status, func.count(InboundJob.id))\
+                     .group_by(InboundJob.platform, InboundJob.status).all()
+    stats = {}
+    for platform, status, count in rows:
+        stats.setdefault(platform, {})[status] = count
+    return stats
+
+
+# ===================================
+# CONSOMMATEUR
+# ===================================
+
+def make_job_handler(platform, handler, merge=None, can_merge=None, coalesce_window=0, on_give_up=None):
+    """
+    Enveloppe le handler d'une plateforme pour le pool de workers :
+    handler(payload) puis complete_job / fail_job.
+    Le handler doit lever une exception (JobFailedError) quand la réponse n'a pas
+    été produite ou livrée : le job est alors retenté, puis abandonné après
+    INBOUND_MAX_ATTEMPTS tentatives.
+    Les travaux sans 'id' (repli en mémoire si la base est indisponible) ne sont pas suivis.
+
+    Args:
+        platform: Plateforme des jobs ('whatsapp', 'telegram')
+        handler: Fonction de traitement d'un payload
+        merge: merge(payload, [payloads suivants]) -> payload unique pour une rafale
+        can_merge: can_merge(payload) -> bool, messages pouvant faire partie d'une rafale
+        coalesce_window: Fenêtre de calme (secondes) qui clôt une rafale, 0 pour désactiver
+        on_give_up: on_give_up(payload) après l'abandon du job (prévenir l'utilisateur)
+    """
+    def run_job(job):
+        from app import app  # Import local pour éviter circularité
+
+        if job.get('id') and not _start_job(app, platform, job):
+            # Copie périmée : le job a expiré dans la file du pool et a été réclamé à nouveau
+            logger.warning(f"Job {platform}/{job['message_id']} repris par un autre worker, ignoré")
+            return
+
+        bursting = bool(merge and coalesce_window > 0 and job.get('id') and can_merge(job['payload']))
+        if bursting and _defer_if_burst_open(app, job):
+            return
+
+        heartbeat = _LeaseHeartbeat(app, platform, job['lock']) if job.get('id') else None
+        try:
+            _run_tracked_job(app, job, bursting)
+        finally:
+            if heartbeat:
+                heartbeat.stop()
+
+    def _defer_if_burst_open(app, job):
+        with app.app_context():
+            try:
+                if defer_open_burst(platform, job, can_merge, coalesce_window):
+                    logger.debug(f"Job {platform}/{job['message_id']} différé (rafale en cours)")
+                    return True
+            except Exception as e:
+                logger.error(f"Erreur report de rafale {platform}/{job['message_id']}: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        return False
+
+    def _run_tracked_job(app, job, bursting):
+        payload = job['payload']
+        absorbed = []
+        if bursting:
+            with app.app_context():
+                try:
+                    absorbed = collect_burst(platform, job, can_merge)
+                except Exception as e:
+                    logger.error(f"Erreur collecte de rafale {platform}/{job['message_id']}: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if absorbed:
+                payload = merge(payload, [j['payload'] for j in absorbed])
+
+        try:
+            handler(payload)
+            outcome = None
+        except Exception as e:
+            outcome = e
+
+        if not job.get('id'):
+            if outcome:
+                raise outcome
+            return
+
+        gave_up = False
+        with app.app_context():
+            try:
+                if outcome is None:
+                    complete_job(platform, job['message_id'], job['lock'])
+                    for absorbed_job in absorbed:
+                        complete_job(platform, absorbed_job['message_id'], job['lock'])
+                else:
+                    logger.error(f"Job {platform}/{job['message_id']} en erreur: {outcome}")
+                    gave_up = fail_job(platform, job['message_id'], outcome, job['lock'])
+                    if absorbed:
+                        _release_absorbed(platform, [j['message_id'] for j in absorbed], job['lock'])
+            except Exception as e:
+                logger.error(f"Erreur mise à jour du job {platform}/{job['message_id']}: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+        if gave_up and on_give_up:
+            try:
+                on_give_up(payload)
+            except Exception as e:
+                logger.error(f"Erreur notification d'abandon du job {platform}/{job['message_id']}: {e}")
+
+    return run_job
+
+
+def _start_job(app, platform, job):
+    """Renouvelle le bail au démarrage du traitement : le temps passé dans la file du pool ne compte pas"""
+    with app.app_context():
+        try:
+            return renew_lock(platform, job['lock'])
+        except Exception as e:
+            # Base indisponible : le traitement reste possible, l'expiration protège la file
+            logger.error(f"Erreur renouvellement du bail {platform}/{job['message_id']}: {e}")
+            db.session.rollback()
+            return True
+        finally:
+            db.session.remove()
+
+
+class _LeaseHeartbeat:
+    """Prolonge le bail d'un job tous les tiers de INBOUND_VISIBILITY_TIMEOUT pendant le traitement"""
+
+    def __init__(self, app, platform, lock):
+        self.app = app
+        self.platform = platform
+        self.lock = lock
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"lease-{platform}")
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        interval = max(INBOUND_VISIBILITY_TIMEOUT / 3, 1)
+        while not self._stopped.wait(timeout=interval):
+            with self.app.app_context():
+                try:
+                    if not renew_lock(self.platform, self.lock):
+                        logger.warning(f"Bail perdu pour le verrou {self.lock} ({self.platform})")
+                        return
+                except Exception as e:
+                    logger.error(f"Erreur renouvellement du bail {self.platform}: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+class DurableQueueConsumer:
+    """Réclame les jobs d'une plateforme et les confie à son pool de workers"""
+
+    def __init__(self, platform, pool, batch_size=10):
+        self.platform = platform
+        self.pool = pool
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        _consumers[platform] = self
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name=f"inbound-{self.platform}"
+                )
+                self._thread.start()
+                logger.info(f"Consommateur de file durable {self.platform} démarré ({WORKER_ID})")
+
+    def notify(self):
+        """Réveille le consommateur (nouveau job enregistré par ce processus)"""
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        from app import app  # Import local pour éviter circularité
+
+        while True:
+            self._wakeup.wait(timeout=INBOUND_POLL_INTERVAL)
+            self._wakeup.clear()
+
+            with app.app_context():
+                try:
+                    jobs = claim_jobs(self.platform, limit=self.batch_size)
+                    saturated = False
+                    for job in jobs:
+                        if not self.pool.submit(job['conversation_key'], job):
+                            # Pool saturé : le job reste en base et sera repris
+                            release_job(self.platform, job['message_id'], job['lock'])
+                            saturated = True
+                    if len(jobs) == self.batch_size and not saturated:
+                        # Il reste probablement des jobs : pas d'attente au prochain tour
+                        self._wakeup.set()
+                except Exception as e:
+                    logger.error(f"Erreur consommateur {self.platform}: {e}", exc_info=True)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
@@ -0,0 +1,347 @@
+"""
+Cache des traitements d'image par contenu (OCR Mathpix, upload OpenAI).
+
+Les élèves renvoient souvent la même photo d'exercice (transferts entre
+camarades, renvois sur une autre plateforme). Chaque copie coûtait un appel
+Mathpix et un nouvel upload de fichier OpenAI. Les résultats sont désormais
+indexés par l'empreinte SHA-256 des octets de l'image :
+
+- OCR : formatted_summary, texte et drapeaux has_* (le format de
+  process_image_with_mathpix, sans les détails bruts)
+- ID du fichier OpenAI déjà uploadé
+
+Option IMAGE_CACHE_PERCEPTUAL (désactivée par défaut, nécessite Pillow) :
+les copies recompressées par WhatsApp/Telegram sont retrouvées par une
+empreinte perceptuelle. Le dHash 64 bits ne sert qu'à trouver des candidats
+(deux exercices d'une même page de manuel peuvent le partager) ; la
+correspondance est confirmée par une empreinte fine de 1024 bits, à
+IMAGE_CACHE_PERCEPTUAL_MAX_DISTANCE bits près. Sur une correspondance
+perceptuelle, seul l'OCR est réutilisé, jamais le fichier OpenAI de l'autre
+image.
+
+Deux niveaux : un LRU en mémoire (propre au processus) devant la table
+image_cache_entry (partagée entre processus). Les entrées expirent après
+IMAGE_CACHE_TTL_DAYS jours. Une erreur du cache n'empêche jamais le
+traitement de l'image : on retombe simplement sur les appels normaux.
+"""
+
+import io
+import os
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import ImageCacheEntry
+
+try:
+    from PIL import Image
+    _PIL_AVAILABLE = True
+except ImportError:
+    _PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+IMAGE_CACHE_ENABLED = os.environ.get('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+IMAGE_CACHE_TTL_DAYS = int(os.environ.get('IMAGE_CACHE_TTL_DAYS', '30'))
+IMAGE_CACHE_MEMORY_SIZE = int(os.environ.get('IMAGE_CACHE_MEMORY_SIZE', '500'))
+IMAGE_CACHE_PERCEPTUAL = os.environ.get('IMAGE_CACHE_PERCEPTUAL', 'false').lower() == 'true' and _PIL_AVAILABLE
+# Bits différents tolérés sur l'empreinte fine (1024 bits) pour confirmer une copie
+IMAGE_CACHE_PERCEPTUAL_MAX_DISTANCE = int(os.environ.get('IMAGE_CACHE_PERCEPTUAL_MAX_DISTANCE', '16'))
+_PERCEPTUAL_CANDIDATES = 20
+
+# Champs du résultat Mathpix conservés (ceux lus par les appelants)
+OCR_CACHED_FIELDS = ('text', 'formatted_summary', 'has_math', 'has_table',
+                     'has_chemistry', 'has_geometry', 'has_diagram')
+
+_memory = OrderedDict()  # sha256 -> {'phash', 'ocr_result', 'openai_file_id', 'expires_at'}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'perceptual_hits': 0, 'misses': 0, 'stored': 0}
+
+
+# ===================================
+# EMPREINTES
+# ===================================
+
+def image_bytes_from_base64(image_data):
+    """Décode une image base64 (avec ou sans préfixe data URL), ou None si invalide"""
+    if not image_data:
+        return None
+    if "base64," in image_data:
+        image_data = image_data.split("base64,", 1)[1]
+    try:
+        return base64.b64decode(image_data)
+    except (ValueError, TypeError):
+        return None
+
+
+def content_hash(content):
+    """Empreinte exacte (SHA-256 hexadécimal) des octets de l'image"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def _dhash(gray, size):
+    """dHash de size x size bits (différences horizontales), en hexadécimal"""
+    pixels = list(gray.resize((size + 1, size)).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (1 if left > pixels[row * (size + 1) + col + 1] else 0)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def perceptual_hashes(content):
+    """
+    Empreintes perceptuelles, stables à la recompression JPEG et au redimensionnement.
+
+    Returns:
+        tuple: (dHash 64 bits pour la recherche de candidats, dHash 1024 bits pour
+        la confirmation), ou (None, None) si désactivé ou image illisible
+    """
+    if not IMAGE_CACHE_PERCEPTUAL:
+        return None, None
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            gray = img.convert('L')
+            return _dhash(gray, 8), _dhash(gray, 32)
+    except Exception as e:
+        logger.debug(f"Empreinte perceptuelle impossible: {e}")
+        return None, None
+
+
+def hamming_distance(hex_a, hex_b):
+    """Nombre de bits différents entre deux empreintes hexadécimales de même taille"""
+    return bin(int(hex_a, 16) ^ int(hex_b, 16)).count('1')
+
+
+def compact_ocr_result(mathpix_result):
+    """Réduit un résultat Mathpix aux champs mis en cache"""
+    return {field: mathpix_result.get(field) for field in OCR_CACHED_FIELDS if field in mathpix_result}
+
+
+# ===================================
+# LECTURE / ÉCRITURE
+# ===================================
+
+def _remember(sha256, entry):
+    with _lock:
+        _memory[sha256] = entry
+        _memory.move_to_end(sha256)
+        while len(_memory) > IMAGE_CACHE_MEMORY_SIZE:
+            _memory.popitem(last=False)
+
+
+def _entry_from_row(row):
+    return {
+        'phash': row.phash,
+        'fingerprint': row.fingerprint,
+        'ocr_result': row.ocr_result,
+        'openai_file_id': row.openai_file_id,
+        'expires_at': row.expires_at
+    }
+
+
+def lookup_image(content):
+    """
+    Cherche les résultats déjà obtenus pour cette image.
+
+    Args:
+        content: Octets de l'image
+
+    Returns:
+        dict: {'sha256', 'phash', 'fingerprint', 'ocr_result', 'openai_file_id'} ;
+        ocr_result et openai_file_id valent None s'ils ne sont pas (encore) en cache
+        (openai_file_id toujours None sur une correspondance perceptuelle)
+    """
+    sha256 = content_hash(content)
+    found = {'sha256': sha256, 'phash': None, 'fingerprint': None,
+             'ocr_result': None, 'openai_file_id': None}
+    if not IMAGE_CACHE_ENABLED:
+        return found
+
+    now = datetime.utcnow()
+    with _lock:
+        entry = _memory.get(sha256)
+        if entry and entry['expires_at'] > now:
+            _memory.move_to_end(sha256)
+            _stats['hits'] += 1
+            found.update({k: entry[k] for k in ('phash', 'fingerprint', 'ocr_result', 'openai_file_id')})
+            return found
+        if entry:
+            del _memory[sha256]
+
+    from app import app  # Import local pour éviter circularité
+
+    try:
+        # Contexte dédié : ne touche pas à la session SQLAlchemy de l'appelant
+        with app.app_context():
+            row = ImageCacheEntry.query.filter(
+                ImageCacheEntry.sha256 == sha256,
+                ImageCacheEntry.expires_at > now
+            ).first()
+            perceptual = False
+            if row is None:
+                found['phash'], found['fingerprint'] = perceptual_hashes(content)
+                if found['phash']:
+                    # Le dHash 64 bits ne donne que des candidats, confirmés par l'empreinte fine
+                    candidates = ImageCacheEntry.query.filter(
+                        ImageCacheEntry.phash == found['phash'],
+                        ImageCacheEntry.fingerprint.isnot(None),
+                        ImageCacheEntry.ocr_result.isnot(None),
+                        ImageCacheEntry.expires_at > now
+                    ).order_by(ImageCacheEntry.updated_at.desc()).limit(_PERCEPTUAL_CANDIDATES).all()
+                    row = next((
+                        c for c in candidates
+                        if hamming_distance(c.fingerprint, found['fingerprint']) <= IMAGE_CACHE_PERCEPTUAL_MAX_DISTANCE
+                    ), None)
+                    perceptual = row is not None
+            entry = _entry_from_row(row) if row is not None else None
+    except Exception as e:
+        logger.warning(f"Cache d'images indisponible (lecture): {e}")
+        return found
+
+    with _lock:
+        if entry is None:
+            _stats['misses'] += 1
+        else:
+            _stats['perceptual_hits' if perceptual else 'hits'] += 1
+
+    if entry is None:
+        return found
+
+    if perceptual:
+        # Seul l'OCR est repris : le fichier OpenAI est celui d'une autre image
+        logger.info(f"🖼️ Image reconnue par empreinte perceptuelle ({found['phash']})")
+        found['ocr_result'] = entry['ocr_result']
+        return found
+
+    _remember(sha256, entry)
+    found.update({k: entry[k] for k in ('phash', 'fingerprint', 'ocr_result', 'openai_file_id')})
+    return found
+
+
+def store_image(cached, ocr_result=None, openai_file_id=None):
+    """
+    Enregistre les nouveaux résultats d'une image (complète une entrée existante
+    sans effacer les champs non fournis).
+
+    Args:
+        cached: Dictionnaire retourné par lookup_image
+        ocr_result: Résultat Mathpix réussi (sans clé 'error')
+        openai_file_id: ID du fichier uploadé sur OpenAI
+
+    Returns:
+        bool: True si les résultats ont été enregistrés
+    """
+    if not IMAGE_CACHE_ENABLED or (ocr_result is None and openai_file_id is None):
+        return False
+
+    sha256 = cached['sha256']
+    if ocr_result is not None:
+        ocr_result = compact_ocr_result(ocr_result)
+    expires_at = datetime.utcnow() + timedelta(days=IMAGE_CACHE_TTL_DAYS)
+
+    from app import app  # Import local pour éviter circularité
+
+    try:
+        with app.app_context():
+            row = ImageCacheEntry.query.filter_by(sha256=sha256).first()
+            if row is None:
+                row = ImageCacheEntry(sha256=sha256, phash=cached.get('phash'),
+                                      fingerprint=cached.get('fingerprint'))
+                db.session.add(row)
+            if ocr_result is not None:
+                row.ocr_result = ocr_result
+            if openai_file_id:
+                row.openai_file_id = openai_file_id
+            row.expires_at = expires_at
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Même image enregistrée en parallèle par un autre worker
+                db.session.rollback()
+                return False
+            entry = _entry_from_row(row)
+    except Exception as e:
+        logger.warning(f"Cache d'images indisponible (écriture): {e}")
+        return False
+
+    _remember(sha256, entry)
+    with _lock:
+        _stats['stored'] += 1
+    return True
+
+
+# ===================================
+# OCR AVEC CACHE
+# ===================================
+
+def ocr_image_cached(image_data, content=None):
+    """
+    process_image_with_mathpix avec cache : même format de résultat.
+
+    Args:
+        image_data: Image en base64 (avec ou sans préfixe data URL)
+        content: Octets de l'image s'ils sont déjà en mémoire (évite un décodage)
+
+    Returns:
+        dict: Résultat Mathpix (les détails bruts sont absents en cas de hit)
+    """
+    from mathpix_utils import process_image_with_mathpix
+
+    if content is None:
+        content = image_bytes_from_base64(image_data)
+    if not IMAGE_CACHE_ENABLED or not content:
+        return process_image_with_mathpix(image_data)
+
+    cached = lookup_image(content)
+    if cached['ocr_result'] is not None:
+        logger.info(f"🖼️ OCR Mathpix servi depuis le cache ({cached['sha256'][:12]})")
+        return dict(cached['ocr_result'], details={})
+
+    from image_preprocessing import prepare_image
+
+    result = process_image_with_mathpix(prepare_image(content, purpose='ocr').data_url)
+    if "error" not in result:
+        store_image(cached, ocr_result=result)
+    return result
+
+
+def purge_expired_images():
+    """Supprime les entrées expirées du cache d'images (tâche planifiée)"""
+    from app import app  # Import local pour éviter circularité
+
+    with app.app_context():
+        try:
+            deleted = ImageCacheEntry.query.filter(
+                ImageCacheEntry.expires_at < datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if deleted:
+                logger.info(f"🧹 {deleted} entrée(s) du cache d'images purgée(s)")
+        except Exception as e:
+            logger.error(f"Erreur purge du cache d'images: {e}", exc_info=True)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def get_image_cache_stats():
+    """Efficacité du cache d'images (monitoring)"""
+    with _lock:
+        stats = dict(_stats)
+        stats.update({
+            'memory_entries': len(_memory),
+            'perceptual_enabled': IMAGE_CACHE_PERCEPTUAL
+        })
+    return stats
@@ -0,0 +1,133 @@
+"""
+Normalisation des images avant OCR (Mathpix) et upload (OpenAI, stockage).
+
+Les photos de téléphone arrivent en pleine résolution (plusieurs Mo) et
+partaient telles quelles, gonflées par le base64. Chaque image passe
+désormais par une étape commune :
+
+1. Orientation EXIF appliquée (photos prises en portrait)
+2. Réduction à IMAGE_MAX_DIMENSION pixels sur le plus grand côté
+3. Niveaux de gris pour l'OCR seul (purpose='ocr')
+4. Recompression en JPEG ou WebP (IMAGE_OUTPUT_FORMAT)
+
+Si le résultat n'est pas plus léger et que l'image n'a été ni tournée ni
+réduite, l'original est conservé. Pillow est optionnel : sans lui (ou si
+l'image est illisible), l'image passe inchangée.
+"""
+
+import io
+import os
+import time
+import uuid
+import logging
+import threading
+
+from media_fetcher import FetchedMedia
+
+try:
+    from PIL import Image, ImageOps
+    _PIL_AVAILABLE = True
+except ImportError:
+    _PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+IMAGE_PREPROCESS_ENABLED = os.environ.get('IMAGE_PREPROCESS_ENABLED', 'true').lower() == 'true' and _PIL_AVAILABLE
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '2048'))
+IMAGE_OCR_GRAYSCALE = os.environ.get('IMAGE_OCR_GRAYSCALE', 'true').lower() == 'true'
+IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'JPEG').upper()  # JPEG ou WEBP
+IMAGE_OUTPUT_QUALITY = int(os.environ.get('IMAGE_OUTPUT_QUALITY', '85'))
+
+_FORMATS = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'WEBP': ('image/webp', 'webp'),
+}
+_EXIF_ORIENTATION = 0x0112
+
+if IMAGE_OUTPUT_FORMAT not in _FORMATS:
+    logger.warning(f"IMAGE_OUTPUT_FORMAT inconnu ({IMAGE_OUTPUT_FORMAT}), JPEG utilisé")
+    IMAGE_OUTPUT_FORMAT = 'JPEG'
+
+_stats = {}  # purpose -> compteurs
+_stats_lock = threading.Lock()
+
+if not _PIL_AVAILABLE:
+    logger.info("Pillow non installé : les images sont envoyées sans normalisation")
+
+
+def _record(purpose, bytes_in, bytes_out, elapsed, transformed):
+    with _stats_lock:
+        stats = _stats.setdefault(purpose, {
+            'images': 0, 'transformed': 0, 'bytes_in': 0, 'bytes_out': 0, 'total_ms': 0.0
+        })
+        stats['images'] += 1
+        stats['transformed'] += 1 if transformed else 0
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += bytes_out
+        stats['total_ms'] += elapsed * 1000
+
+
+def prepare_image(content, purpose='vision', mime_type='image/jpeg'):
+    """
+    Normalise une image pour l'OCR ou l'upload.
+
+    Args:
+        content: Octets de l'image d'origine
+        purpose: 'vision' (upload OpenAI, stockage) ou 'ocr' (Mathpix seul)
+        mime_type: Type MIME de l'original (retourné si l'image est inchangée)
+
+    Returns:
+        FetchedMedia: image prête à l'envoi (content, mime_type, filename, data_url)
+    """
+    original = FetchedMedia(content, mime_type)
+    if not IMAGE_PREPROCESS_ENABLED or not content:
+        return original
+
+    started = time.time()
+    output_mime, extension = _FORMATS[IMAGE_OUTPUT_FORMAT]
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            rotated = img.getexif().get(_EXIF_ORIENTATION, 1) != 1
+            resized = max(img.size) > IMAGE_MAX_DIMENSION
+            # Décodage JPEG à échelle réduite quand l'image est très grande
+            img.draft('RGB', (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > IMAGE_MAX_DIMENSION:
+                img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+            if purpose == 'ocr' and IMAGE_OCR_GRAYSCALE:
+                img = img.convert('L')
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+
+            buffer = io.BytesIO()
+            img.save(buffer, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY, optimize=True)
+            output = buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"Normalisation d'image impossible ({purpose}), original conservé: {e}")
+        _record(purpose, len(content), len(content), time.time() - started, False)
+        return original
+
+    if len(output) >= len(content) and not (rotated or resized):
+        _record(purpose, len(content), len(content), time.time() - started, False)
+        return original
+
+    elapsed = time.time() - started
+    _record(purpose, len(content), len(output), elapsed, True)
+    logger.debug(f"Image normalisée ({purpose}): {len(content)} -> {len(output)} octets en {elapsed * 1000:.0f} ms")
+    return FetchedMedia(output, output_mime, f"image_{uuid.uuid4()}.{extension}")
+
+
+def get_preprocessing_stats():
+    """Octets économisés et temps passé par usage (monitoring)"""
+    with _stats_lock:
+        stats = {purpose: dict(values) for purpose, values in _stats.items()}
+    for values in stats.values():
+        values['avg_ms'] = round(values['total_ms'] / values['images'], 1) if values['images'] else 0
+        values['total_ms'] = round(values['total_ms'], 1)
+    return {'enabled': IMAGE_PREPROCESS_ENABLED, 'purposes': stats}
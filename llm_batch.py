@@ -0,0 +1,452 @@
+"""
+Mode batch (hors ligne) pour les tâches IA de fond.
+
+La consolidation mémoire et la génération des rappels de nuit n'ont pas besoin
+d'une réponse immédiate : au lieu d'une complétion synchrone par utilisateur,
+les requêtes sont écrites dans un fichier JSONL puis soumises à un endpoint
+batch. Les résultats sont récupérés par polling et appliqués de manière
+idempotente (chaque custom_id n'est appliqué qu'une seule fois).
+
+Deux backends :
+- OpenAIBatchBackend : Batch API OpenAI (files purpose='batch' + batches.create)
+- LocalBatchBackend  : stand-in local qui traite le JSONL lui-même (dev / tests,
+                       ou fournisseur sans Batch API)
+"""
+
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta
+
+from database import db
+from models import LLMBatchJob
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+# Liste des workloads en mode batch : "consolidation,reminder", "all" ou vide (désactivé)
+LLM_BATCH_MODE = os.environ.get('LLM_BATCH_MODE', '')
+# 'openai', 'local' ou vide (auto : openai si une clé OpenAI est configurée)
+LLM_BATCH_BACKEND = os.environ.get('LLM_BATCH_BACKEND', '')
+LLM_BATCH_MODEL = os.environ.get('LLM_BATCH_MODEL', 'gpt-4.1-mini')
+LLM_BATCH_DIR = os.environ.get('LLM_BATCH_DIR', 'instance/batches')
+LLM_BATCH_COMPLETION_WINDOW = '24h'
+# Lots sans applier (consommés directement) non repris après ce délai : abandonnés
+LLM_BATCH_ORPHAN_HOURS = int(os.environ.get('LLM_BATCH_ORPHAN_HOURS', '24'))
+# Résultats appliqués entre deux enregistrements de applied_ids
+LLM_BATCH_APPLY_CHUNK = int(os.environ.get('LLM_BATCH_APPLY_CHUNK', '100'))
+CHAT_COMPLETIONS_ENDPOINT = '/v1/chat/completions'
+
+# Statuts terminaux de la Batch API OpenAI
+_TERMINAL_FAILURE_STATUSES = ('failed', 'expired', 'cancelled')
+
+# job_type -> fonction(custom_id, response_body, context) appelée pour chaque résultat
+_batch_appliers = {}
+
+
+def is_batch_mode_enabled(workload):
+    """
+    Indique si un workload ('consolidation', 'reminder') doit passer par le mode batch.
+
+    Args:
+        workload: Nom du workload
+
+    Returns:
+        bool: True si LLM_BATCH_MODE contient le workload (ou 'all' / 'true')
+    """
+    enabled = [w.strip().lower() for w in LLM_BATCH_MODE.split(',') if w.strip()]
+    return workload in enabled or 'all' in enabled or 'true' in enabled
+
+
+def register_batch_applier(job_type, applier):
+    """Enregistre la fonction qui applique les résultats d'un type de lot"""
+    _batch_appliers[job_type] = applier
+
+
+# ===================================
+# FICHIERS JSONL
+# ===================================
+
+def build_batch_request(custom_id, body, url=CHAT_COMPLETIONS_ENDPOINT):
+    """Construit une ligne de requête au format de la Batch API"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": url,
+        "body": body
+    }
+
+
+def write_batch_file(job_type, requests):
+    """
+    Écrit les requêtes dans un fichier JSONL.
+
+    Args:
+        job_type: Type de lot (utilisé dans le nom du fichier)
+        requests: Liste de requêtes construites avec build_batch_request
+
+    Returns:
+        str: Chemin du fichier écrit
+    """
+    os.makedirs(LLM_BATCH_DIR, exist_ok=True)
+    file_name = f"{job_type}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jsonl"
+    file_path = os.path.join(LLM_BATCH_DIR, file_name)
+
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    return file_path
+
+
+def parse_batch_output(jsonl_text):
+    """
+    Parse un fichier de sortie JSONL.
+
+    Returns:
+        dict: custom_id -> {'body': dict ou None, 'error': str ou None}
+    """
+    results = {}
+    for line in jsonl_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            logger.warning(f"Ligne de sortie batch illisible ignorée: {line[:100]}")
+            continue
+
+        response = item.get('response') or {}
+        error = item.get('error')
+        if not error and response.get('status_code', 200) >= 400:
+            error = f"HTTP {response.get('status_code')}"
+
+        results[item.get('custom_id')] = {
+            'body': response.get('body') if not error else None,
+            'error': str(error) if error else None
+        }
+    return results
+
+
+def get_response_message(body):
+    """Retourne le message (dict) de la première réponse d'un body chat.completion"""
+    if not body:
+        return {}
+    choices = body.get('choices') or []
+    if not choices:
+        return {}
+    return choices[0].get('message') or {}
+
+
+# ===================================
+# BACKENDS
+# ===================================
+
+class OpenAIBatchBackend:
+    """Soumission via la Batch API OpenAI (hors des limites de débit interactives)"""
+
+    name = 'openai'
+
+    def __init__(self, client=None):
+        if client is None:
+            from ai_config import get_provider_client
+            client = get_provider_client('openai')
+        if client is None:
+            raise RuntimeError("OpenAI client not configured for batch mode. Set OPENAI_API_KEY.")
+        self.client = client
+
+    def submit(self, file_path, job_type):
+        """Envoie le fichier JSONL et crée le lot. Retourne l'ID du lot."""
+        with open(file_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_ENDPOINT,
+            completion_window=LLM_BATCH_COMPLETION_WINDOW,
+            metadata={'job_type': job_type}
+        )
+        return batch.id
+
+    def retrieve(self, batch_id):
+        """
+        Returns:
+            tuple: (status, output_jsonl ou None, error_message ou None)
+        """
+        batch = self.client.batches.retrieve(batch_id)
+
+        if batch.status in _TERMINAL_FAILURE_STATUSES:
+            error_message = None
+            if batch.errors and getattr(batch.errors, 'data', None):
+                error_message = "; ".join(e.message for e in batch.errors.data if e.message)
+            return 'failed', None, error_message or batch.status
+
+        if batch.status != 'completed':
+            return 'pending', None, None
+
+        output_text = ""
+        if batch.output_file_id:
+            output_text = self.client.files.content(batch.output_file_id).text
+        if batch.error_file_id:
+            # Les requêtes en erreur sont dans un fichier séparé, avec le même format
+            output_text += "\n" + self.client.files.content(batch.error_file_id).text
+        return 'completed', output_text, None
+
+    def cancel(self, batch_id):
+        """Annule un lot en cours : les requêtes non traitées ne sont pas facturées"""
+        self.client.batches.cancel(batch_id)
+
+
+class LocalBatchBackend:
+    """
+    Stand-in local : traite le JSONL ligne par ligne et écrit un fichier de sortie
+    au format de la Batch API. Utilisé pour les tests et les fournisseurs sans Batch API.
+    """
+
+    name = 'local'
+
+    def __init__(self, handler=None):
+        # handler(body) -> dict chat.completion ; par défaut le client IA configuré
+        self.handler = handler or self._default_handler
+
+    @staticmethod
+    def _default_handler(body):
+        from ai_config import get_ai_client
+        response = get_ai_client().chat.completions.create(**body)
+        return response.model_dump()
+
+    @staticmethod
+    def _output_path(batch_id):
+        return os.path.join(LLM_BATCH_DIR, f"{batch_id}.output.jsonl")
+
+    def submit(self, file_path, job_type):
+        batch_id = f"local_{job_type}_{uuid.uuid4().hex}"
+        os.makedirs(LLM_BATCH_DIR, exist_ok=True)
+
+        with open(file_path, 'r', encoding='utf-8') as f_in, \
+                open(self._output_path(batch_id), 'w', encoding='utf-8') as f_out:
+            for line in f_in:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                result = {"id": uuid.uuid4().hex, "custom_id": request['custom_id'], "response": None, "error": None}
+                try:
+                    body = self.handler(request['body'])
+                    result["response"] = {"status_code": 200, "body": body}
+                except Exception as e:
+                    logger.warning(f"Batch local: requête {request['custom_id']} échouée: {e}")
+                    result["error"] = {"message": str(e)}
+                f_out.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+        return batch_id
+
+    def retrieve(self, batch_id):
+        output_path = self._output_path(batch_id)
+        if not os.path.exists(output_path):
+            return 'failed', None, 'Fichier de sortie local introuvable'
+        with open(output_path, 'r', encoding='utf-8') as f:
+            return 'completed', f.read(), None
+
+    def cancel(self, batch_id):
+        # Lot traité dès la soumission : rien à annuler
+        pass
+
+
+def get_batch_backend(name=None):
+    """Retourne le backend batch configuré (LLM_BATCH_BACKEND, sinon auto)"""
+    name = name or LLM_BATCH_BACKEND or ('openai' if os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_API_KEYS') else 'local')
+    if name == 'openai':
+        return OpenAIBatchBackend()
+    return LocalBatchBackend()
+
+
+def get_batch_model(backend):
+    """Modèle à utiliser dans les requêtes du lot selon le backend"""
+    if backend.name == 'openai':
+        return LLM_BATCH_MODEL
+    from ai_config import get_model_name
+    return get_model_name() or LLM_BATCH_MODEL
+
+
+# ===================================
+# CYCLE DE VIE D'UN LOT
+# ===================================
+
+def submit_batch(job_type, requests, context=None, backend=None):
+    """
+    Écrit, soumet et enregistre un lot. Doit être appelé dans un app_context.
+
+    Args:
+        job_type: Type de lot ('consolidation', 'reminder', ...)
+        requests: Liste de requêtes (build_batch_request)
+        context: dict custom_id -> métadonnées utilisées à l'application des résultats
+        backend: Backend à utiliser (par défaut get_batch_backend())
+
+    Returns:
+        LLMBatchJob ou None si rien à soumettre / échec de soumission
+    """
+    if not requests:
+        return None
+
+    backend = backend or get_batch_backend()
+    file_path = write_batch_file(job_type, requests)
+
+    try:
+        batch_id = backend.submit(file_path, job_type)
+    except Exception as e:
+        logger.error(f"❌ BATCH: Échec de soumission du lot {job_type} ({len(requests)} requêtes): {e}", exc_info=True)
+        return None
+
+    job = LLMBatchJob(
+        job_type=job_type,
+        backend=backend.name,
+        batch_id=batch_id,
+        input_file_path=file_path,
+        request_count=len(requests),
+        status='submitted',
+        context=context or {},
+        applied_ids=[]
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    logger.info(f"📦 BATCH: Lot {job_type} soumis ({len(requests)} requêtes, backend={backend.name}, id={batch_id})")
+    return job
+
+
+def refresh_batch(job, backend=None):
+    """
+    Met à jour le statut d'un lot et retourne ses résultats s'il est terminé.
+
+    Returns:
+        dict: custom_id -> {'body', 'error'} si le lot est terminé, sinon None
+    """
+    backend = backend or get_batch_backend(job.backend)
+    status, output_text, error_message = backend.retrieve(job.batch_id)
+
+    if status == 'pending':
+        return None
+
+    if status == 'failed':
+        job.status = 'failed'
+        job.error_message = error_message
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        logger.error(f"❌ BATCH: Lot {job.batch_id} en échec: {error_message}")
+        return None
+
+    if job.status == 'submitted':
+        job.status = 'completed'
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+
+    return parse_batch_output(output_text or "")
+
+
+def cancel_batch(job, backend=None):
+    """
+    Abandonne un lot dont les résultats ne seront pas utilisés et l'annule chez le
+    fournisseur, pour ne pas payer à la fois le lot et la génération de repli.
+    Doit être appelé dans un app_context.
+    """
+    job.status = 'abandoned'
+    db.session.commit()
+
+    try:
+        backend = backend or get_batch_backend(job.backend)
+        backend.cancel(job.batch_id)
+        logger.info(f"🛑 BATCH: Lot {job.job_type} {job.batch_id} annulé")
+    except Exception as e:
+        # Lot déjà terminé ou expiré côté fournisseur : rien de plus à faire
+        logger.warning(f"BATCH: Annulation du lot {job.batch_id} impossible: {e}")
+
+
+def apply_batch_results(job, results, applier):
+    """
+    Applique les résultats d'un lot de manière idempotente.
+
+    Chaque custom_id appliqué est mémorisé dans job.applied_ids : un second passage
+    (redémarrage, poller concurrent) ne réapplique pas les résultats déjà traités.
+    La liste est enregistrée tous les LLM_BATCH_APPLY_CHUNK résultats (et non à chaque
+    résultat) : après un arrêt brutal, au plus un paquet est réappliqué.
+
+    Returns:
+        dict: Statistiques {'applied', 'skipped', 'failed'}
+    """
+    stats = {'applied': 0, 'skipped': 0, 'failed': 0}
+    applied_ids = set(job.applied_ids or [])
+    context = job.context or {}
+    unsaved = 0
+
+    for custom_id, result in results.items():
+        if custom_id in applied_ids:
+            stats['skipped'] += 1
+            continue
+
+        if result['error']:
+            logger.warning(f"BATCH: Requête {custom_id} en erreur: {result['error']}")
+            stats['failed'] += 1
+        else:
+            try:
+                applier(custom_id, result['body'], context.get(custom_id) or {})
+                stats['applied'] += 1
+            except Exception as e:
+                logger.error(f"BATCH: Erreur d'application du résultat {custom_id}: {e}", exc_info=True)
+                db.session.rollback()
+                stats['failed'] += 1
+                continue
+
+        applied_ids.add(custom_id)
+        unsaved += 1
+        if unsaved >= LLM_BATCH_APPLY_CHUNK:
+            # Réassigner la liste pour que SQLAlchemy détecte la modification de la colonne JSON
+            job.applied_ids = list(applied_ids)
+            db.session.commit()
+            unsaved = 0
+
+    job.applied_ids = list(applied_ids)
+    job.status = 'applied'
+    db.session.commit()
+
+    logger.info(f"✅ BATCH: Lot {job.batch_id} appliqué: {stats['applied']} appliqué(s), "
+                f"{stats['skipped']} déjà traité(s), {stats['failed']} échec(s)")
+    return stats
+
+
+def poll_pending_batches():
+    """
+    Tâche planifiée : vérifie les lots en attente et applique les résultats des lots terminés.
+    Les lots sans applier enregistré (ex: rappels, consommés par le job d'envoi) sont
+    laissés à leur consommateur, puis abandonnés au-delà de la fenêtre de complétion.
+    """
+    from app import app
+
+    with app.app_context():
+        try:
+            jobs = LLMBatchJob.query.filter(
+                LLMBatchJob.status.in_(['submitted', 'completed'])
+            ).order_by(LLMBatchJob.created_at).all()
+            orphan_before = datetime.utcnow() - timedelta(hours=LLM_BATCH_ORPHAN_HOURS)
+
+            for job in jobs:
+                applier = _batch_appliers.get(job.job_type)
+                if applier is None:
+                    if job.created_at and job.created_at < orphan_before:
+                        logger.warning(f"⏳ BATCH: Lot {job.job_type} {job.batch_id} jamais consommé, abandonné")
+                        cancel_batch(job)
+                    continue
+                try:
+                    results = refresh_batch(job)
+                    if results is not None:
+                        apply_batch_results(job, results, applier)
+                except Exception as e:
+                    logger.error(f"❌ BATCH: Erreur lors du polling du lot {job.batch_id}: {e}", exc_info=True)
+                    db.session.rollback()
+
+        except Exception as e:
+            logger.error(f"❌ BATCH: Erreur critique dans poll_pending_batches: {e}", exc_info=True)
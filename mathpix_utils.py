@@ -1,17 +1,187 @@
 import os
 import re
+import time
 import logging
+import threading
+from collections import deque
+
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
-def process_image_with_mathpix(image_data):
+# ===================================
+# CONFIGURATION CLIENT MATHPIX
+# ===================================
+
+# Peut pointer vers un serveur local de test qui imite l'API Mathpix
+MATHPIX_BASE_URL = os.environ.get('MATHPIX_BASE_URL', 'https://api.mathpix.com/v3').rstrip('/')
+MATHPIX_HTTP_POOL_SIZE = int(os.environ.get('MATHPIX_HTTP_POOL_SIZE', '10'))
+MATHPIX_CONNECT_TIMEOUT = float(os.environ.get('MATHPIX_CONNECT_TIMEOUT', '5'))
+MATHPIX_READ_TIMEOUT = float(os.environ.get('MATHPIX_READ_TIMEOUT', '20'))
+
+# Disjoncteur : au-delà de MATHPIX_BREAKER_ERROR_RATE d'échecs (ou d'appels plus lents
+# que MATHPIX_SLOW_CALL) sur les MATHPIX_BREAKER_WINDOW derniers appels, Mathpix n'est
+# plus appelé pendant MATHPIX_BREAKER_COOLDOWN secondes (les appelants passent en vision seule)
+MATHPIX_BREAKER_WINDOW = int(os.environ.get('MATHPIX_BREAKER_WINDOW', '20'))
+MATHPIX_BREAKER_MIN_CALLS = int(os.environ.get('MATHPIX_BREAKER_MIN_CALLS', '5'))
+MATHPIX_BREAKER_ERROR_RATE = float(os.environ.get('MATHPIX_BREAKER_ERROR_RATE', '0.5'))
+MATHPIX_BREAKER_COOLDOWN = float(os.environ.get('MATHPIX_BREAKER_COOLDOWN', '30'))
+MATHPIX_SLOW_CALL = float(os.environ.get('MATHPIX_SLOW_CALL', '10'))
+
+
+class MathpixUnavailableError(Exception):
+    """Mathpix non appelé : disjoncteur ouvert ou échéance de l'appelant dépassée"""
+
+
+class CircuitBreaker:
+    """Disjoncteur sur fenêtre glissante (fermé -> ouvert -> semi-ouvert -> fermé)"""
+
+    def __init__(self, name, window=MATHPIX_BREAKER_WINDOW, min_calls=MATHPIX_BREAKER_MIN_CALLS,
+                 error_rate=MATHPIX_BREAKER_ERROR_RATE, cooldown=MATHPIX_BREAKER_COOLDOWN,
+                 slow_call=MATHPIX_SLOW_CALL):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.slow_call = slow_call
+        self.state = 'closed'
+        self._results = deque(maxlen=window)  # True = succès rapide
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'trips': 0}
+
+    def allow(self):
+        """True si un appel peut partir (un seul appel d'essai en semi-ouvert)"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'closed' or (self.state == 'half_open' and not self._trial_in_flight):
+                self._trial_in_flight = self.state == 'half_open'
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record(self, success, elapsed):
+        """Enregistre le résultat d'un appel autorisé par allow()"""
+        slow = elapsed >= self.slow_call
+        healthy = success and not slow
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['failures'] += 0 if success else 1
+            self._stats['slow_calls'] += 1 if slow else 0
+
+            if self.state == 'half_open':
+                self._trial_in_flight = False
+                if healthy:
+                    self.state = 'closed'
+                    self._results.clear()
+                    logger.info(f"Disjoncteur {self.name} refermé")
+                else:
+                    self._open()
+                return
+
+            self._results.append(healthy)
+            failures = self._results.count(False)
+            if self.state == 'closed' and len(self._results) >= self.min_calls \
+                    and failures / len(self._results) >= self.error_rate:
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self._opened_at = time.monotonic()
+        self._stats['trips'] += 1
+        logger.warning(f"⚡ Disjoncteur {self.name} ouvert pour {self.cooldown:.0f}s")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'state': self.state, 'recent_failures': list(self._results).count(False)})
+        return stats
+
+
+class MathpixClient:
+    """Client Mathpix avec pool de connexions keep-alive, disjoncteur et échéance"""
+
+    def __init__(self, base_url=MATHPIX_BASE_URL, pool_size=MATHPIX_HTTP_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker('mathpix')
+
+    def post_text(self, payload, headers, deadline=None):
+        """
+        Appelle /text.
+
+        Args:
+            payload: Requête Mathpix
+            headers: En-têtes d'authentification
+            deadline: Échéance absolue (time.monotonic()) de l'appelant ; les timeouts
+                de connexion et de lecture sont réduits au temps restant
+
+        Returns:
+            dict: Réponse JSON de Mathpix
+
+        Raises:
+            MathpixUnavailableError: disjoncteur ouvert ou échéance déjà dépassée
+            requests.exceptions.RequestException: erreur HTTP ou réseau
+        """
+        connect_timeout, read_timeout = MATHPIX_CONNECT_TIMEOUT, MATHPIX_READ_TIMEOUT
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise MathpixUnavailableError("Deadline exceeded before calling Mathpix")
+            connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+
+        if not self.breaker.allow():
+            raise MathpixUnavailableError("Mathpix circuit open")
+
+        started = time.monotonic()
+        try:
+            response = self.session.post(f"{self.base_url}/text", headers=headers, json=payload,
+                                         timeout=(connect_timeout, read_timeout))
+        except requests.exceptions.RequestException:
+            self.breaker.record(False, time.monotonic() - started)
+            raise
+
+        # Une image refusée (4xx) ne dit rien de la santé du service
+        self.breaker.record(response.status_code < 500 and response.status_code != 429,
+                            time.monotonic() - started)
+        response.raise_for_status()
+        return response.json()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_mathpix_client():
+    """Retourne le client Mathpix partagé du processus"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MathpixClient()
+    return _client
+
+
+def get_mathpix_stats():
+    """État du disjoncteur Mathpix (monitoring)"""
+    return get_mathpix_client().breaker.stats()
+
+
+def process_image_with_mathpix(image_data, deadline=None):
     """
     Process image data with Mathpix API to extract mathematical content, tables, 
     chemical diagrams, and geometric figures
 
     Args:
         image_data (str): Base64-encoded image data
+        deadline (float): Optional absolute deadline (time.monotonic()) for the Mathpix call
 
     Returns:
         dict: Structured result containing all extracted data
@@ -33,13 +203,16 @@ def process_image_with_mathpix(image_data):
     }
 
     try:
-        # Clean base64 data if needed
+        # Clean base64 data if needed (keep the image type when it is given)
+        mime_type = "image/jpeg"
         if isinstance(image_data, str) and "base64," in image_data:
-            image_data = image_data.split("base64,")[1]
+            header, image_data = image_data.split("base64,", 1)
+            if header.startswith("data:image/"):
+                mime_type = header[len("data:"):].rstrip(";")
 
         # Configuration avancée pour détecter math, chimie, géométrie ET schémas biologiques
         payload = {
-            "src": f"data:image/jpeg;base64,{image_data}",
+            "src": f"data:{mime_type};base64,{image_data}",
             "formats": ["text", "data", "html"],
             "data_options": {
                 "include_asciimath": True,
@@ -53,13 +226,8 @@ def process_image_with_mathpix(image_data):
             }
         }
 
-        # Send request to Mathpix
-        url = "https://api.mathpix.com/v3/text"
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-
-        result = response.json()
-        logger.info(f"Mathpix response status: {response.status_code}")
+        # Send request to Mathpix (shared pooled client, circuit breaker, deadline)
+        result = get_mathpix_client().post_text(payload, headers, deadline=deadline)
         logger.debug(f"Mathpix raw result: {result}")
         logger.info(f"Mathpix extracted text length: {len(result.get('text', ''))}")
 
@@ -115,6 +283,9 @@ def process_image_with_mathpix(image_data):
 
         return structured_result
 
+    except MathpixUnavailableError as e:
+        logger.warning(f"Mathpix skipped: {str(e)}")
+        return {"error": f"Mathpix unavailable: {str(e)}"}
     except Exception as e:
         logger.error(f"Error processing image with Mathpix: {str(e)}")
         return {"error": f"Error processing image: {str(e)}"}
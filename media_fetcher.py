@@ -0,0 +1,122 @@
+"""
+Récupération des médias entrants (photos Telegram, ...) en mémoire.
+
+Le média est lu en streaming dans un tampon borné (MEDIA_MAX_BYTES), via une
+session HTTP partagée (connexions keep-alive) et avec timeouts. Le même
+contenu sert ensuite à l'OCR (data URL base64, calculée une seule fois) et
+à l'upload OpenAI (octets directement) : rien n'est écrit sur disque, sauf
+si un appelant a réellement besoin d'un chemin (FetchedMedia.save).
+"""
+
+import os
+import base64
+import logging
+import threading
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', str(16 * 1024 * 1024)))
+MEDIA_CONNECT_TIMEOUT = float(os.environ.get('MEDIA_CONNECT_TIMEOUT', '5'))
+MEDIA_READ_TIMEOUT = float(os.environ.get('MEDIA_READ_TIMEOUT', '30'))
+MEDIA_HTTP_POOL_SIZE = int(os.environ.get('MEDIA_HTTP_POOL_SIZE', '20'))
+
+_CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class MediaTooLargeError(ValueError):
+    """Média plus volumineux que la limite autorisée"""
+
+
+def http_session():
+    """Session HTTP partagée (keep-alive) pour les API de fichiers des bots"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MEDIA_HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def default_timeout():
+    return (MEDIA_CONNECT_TIMEOUT, MEDIA_READ_TIMEOUT)
+
+
+class FetchedMedia:
+    """Média téléchargé en mémoire"""
+
+    def __init__(self, content, mime_type='image/jpeg', filename=None):
+        self.content = content
+        self.mime_type = mime_type or 'image/jpeg'
+        self.filename = filename or f"media_{uuid.uuid4()}.jpg"
+        self._data_url = None
+        self._path = None
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def data_url(self):
+        """Data URL base64 (Mathpix, Vision), encodée une seule fois"""
+        if self._data_url is None:
+            encoded = base64.b64encode(self.content).decode('utf-8')
+            self._data_url = f"data:{self.mime_type};base64,{encoded}"
+        return self._data_url
+
+    def save(self, folder):
+        """Écrit le média sur disque (uniquement si un chemin est nécessaire) et retourne son chemin"""
+        if self._path is None:
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, self.filename)
+            with open(path, 'wb') as f:
+                f.write(self.content)
+            self._path = path
+        return self._path
+
+
+def fetch_media(url, headers=None, max_bytes=MEDIA_MAX_BYTES, filename=None):
+    """
+    Télécharge un média en streaming dans un tampon mémoire borné.
+
+    Returns:
+        FetchedMedia
+
+    Raises:
+        MediaTooLargeError: si le média dépasse max_bytes
+        requests.exceptions.RequestException: en cas d'erreur HTTP ou réseau
+    """
+    response = http_session().get(url, headers=headers, timeout=default_timeout(), stream=True)
+    with response:
+        response.raise_for_status()
+        declared = int(response.headers.get('Content-Length') or 0)
+        if declared > max_bytes:
+            raise MediaTooLargeError(f"Media too large: {declared} bytes")
+
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+            content.extend(chunk)
+            if len(content) > max_bytes:
+                raise MediaTooLargeError(f"Media too large: more than {max_bytes} bytes")
+
+        mime_type = (response.headers.get('Content-Type') or '').split(';')[0].strip()
+        if not mime_type.startswith('image/'):
+            # Telegram sert les photos en application/octet-stream
+            mime_type = 'image/jpeg'
+
+    logger.debug(f"Média récupéré en mémoire: {len(content)} octets ({mime_type})")
+    return FetchedMedia(bytes(content), mime_type, filename)
@@ -18,8 +18,12 @@ from models import (
     TelegramConversation, TelegramMessage,
     WhatsAppMessage
 )
-from ai_config import openai_client, CURRENT_MODEL
+from ai_config import get_provider_client, CURRENT_MODEL
 from ai_functions import MEMORY_FUNCTIONS
+from llm_batch import (
+    is_batch_mode_enabled, build_batch_request, submit_batch,
+    register_batch_applier, get_batch_backend, get_batch_model, get_response_message
+)
 
 logger = logging.getLogger(__name__)
 
@@ -154,19 +158,17 @@ def _update_streak(memory):
 # FONCTION PRINCIPALE DE CONSOLIDATION
 # ============================================================================
 
-def consolidate_memory_for_user(user_id, conversation_transcript):
+def _build_consolidation_messages(user_id, conversation_transcript):
     """
-    Analyse un transcript de conversation et met à jour la mémoire de l'utilisateur.
-    Utilise l'IA avec function calling pour extraire les informations pertinentes.
+    Construit les messages envoyés à l'IA pour analyser un transcript.
 
     Args:
-        user_id: ID de l'utilisateur dans la table User
-        conversation_transcript: Texte complet de la conversation à analyser
-    """
-    if not conversation_transcript or not conversation_transcript.strip():
-        logger.warning(f"Tentative de consolidation pour user_id {user_id} avec un transcript vide.")
-        return
+        user_id: ID de l'utilisateur (pour les logs)
+        conversation_transcript: Texte complet de la conversation
 
+    Returns:
+        list: Messages au format Chat Completion
+    """
     # Limiter la taille du transcript pour éviter de dépasser les limites de tokens
     max_chars = 15000  # ~3-4K tokens
     if len(conversation_transcript) > max_chars:
@@ -194,15 +196,62 @@ IMPORTANT :
 - Un sujet est "étudié" s'il y a eu des explications ou exercices, pas juste une mention
 """
 
+    return [
+        {"role": "system", "content": "Tu es un analyseur intelligent de conversations éducatives."},
+        {"role": "user", "content": consolidation_prompt}
+    ]
+
+
+def _apply_memory_tool_calls(user_id, tool_calls):
+    """
+    Exécute les appels de fonction retournés par l'IA et met à jour les métadonnées.
+
+    Args:
+        user_id: ID de l'utilisateur dans la table User
+        tool_calls: Liste de tuples (nom_fonction, arguments_json)
+    """
+    for function_name, raw_arguments in tool_calls:
+        arguments = json.loads(raw_arguments)
+
+        logger.debug(f"Function call détecté: {function_name} avec args: {arguments}")
+
+        if function_name == "update_user_profile":
+            _update_memory_profile(user_id, arguments)
+        elif function_name == "log_study_session":
+            _log_study_session(user_id, arguments)
+
+    # Mettre à jour les métadonnées (streak, nb_interactions)
+    from app import app as _app
+    with _app.app_context():
+        memory = UserMemory.query.filter_by(user_id=user_id).first()
+        if memory:
+            _update_streak(memory)
+            memory.nb_interactions = (memory.nb_interactions or 0) + 1
+            db.session.commit()
+            logger.info(f"🧠 Consolidation réussie pour user_id {user_id} (streak: {memory.streak_jours} jours)")
+
+
+def consolidate_memory_for_user(user_id, conversation_transcript):
+    """
+    Analyse un transcript de conversation et met à jour la mémoire de l'utilisateur.
+    Utilise l'IA avec function calling pour extraire les informations pertinentes.
+
+    Args:
+        user_id: ID de l'utilisateur dans la table User
+        conversation_transcript: Texte complet de la conversation à analyser
+    """
+    if not conversation_transcript or not conversation_transcript.strip():
+        logger.warning(f"Tentative de consolidation pour user_id {user_id} avec un transcript vide.")
+        return
+
+    messages = _build_consolidation_messages(user_id, conversation_transcript)
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            response = openai_client.chat.completions.create(
+            response = get_provider_client('openai').chat.completions.create(
                 model="gpt-4.1-mini",  # Utiliser explicitement votre modèle
-                messages=[
-                    {"role": "system", "content": "Tu es un analyseur intelligent de conversations éducatives."},
-                    {"role": "user", "content": consolidation_prompt}
-                ],
+                messages=messages,
                 tools=MEMORY_FUNCTIONS,
                 tool_choice="auto",
                 timeout=60
@@ -215,26 +264,10 @@ IMPORTANT :
                 return
 
             # Exécuter les appels de fonction
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                arguments = json.loads(tool_call.function.arguments)
-
-                logger.debug(f"Function call détecté: {function_name} avec args: {arguments}")
-
-                if function_name == "update_user_profile":
-                    _update_memory_profile(user_id, arguments)
-                elif function_name == "log_study_session":
-                    _log_study_session(user_id, arguments)
-
-            # Mettre à jour les métadonnées (streak, nb_interactions)
-            from app import app as _app
-            with _app.app_context():
-                memory = UserMemory.query.filter_by(user_id=user_id).first()
-                if memory:
-                    _update_streak(memory)
-                    memory.nb_interactions = (memory.nb_interactions or 0) + 1
-                    db.session.commit()
-                    logger.info(f"🧠 Consolidation réussie pour user_id {user_id} (streak: {memory.streak_jours} jours)")
+            _apply_memory_tool_calls(
+                user_id,
+                [(tool_call.function.name, tool_call.function.arguments) for tool_call in tool_calls]
+            )
 
             return  # Succès, sortir de la boucle de retry
 
@@ -248,6 +281,105 @@ IMPORTANT :
                 time.sleep(wait_time)
 
 
+# ============================================================================
+# MODE BATCH (HORS LIMITES INTERACTIVES)
+# ============================================================================
+
+def _mark_conversation_consolidated(platform, conversation_id, consolidation_record=None, consolidated_at=None):
+    """
+    Met à jour ou crée le tampon de consolidation d'une conversation.
+
+    Args:
+        platform: 'web', 'telegram' ou 'whatsapp'
+        conversation_id: ID de la conversation (thread_id pour WhatsApp)
+        consolidation_record: Tampon existant s'il a déjà été chargé
+        consolidated_at: Date du transcript consolidé (par défaut maintenant) ; en mode
+            batch, les messages arrivés après la soumission restent à consolider
+    """
+    consolidated_at = consolidated_at or datetime.utcnow()
+    if consolidation_record is None:
+        consolidation_record = ConsolidatedConversation.query.filter_by(
+            platform=platform,
+            conversation_id=conversation_id
+        ).first()
+
+    if consolidation_record:
+        if not consolidation_record.consolidated_at or consolidation_record.consolidated_at < consolidated_at:
+            consolidation_record.consolidated_at = consolidated_at
+    else:
+        db.session.add(ConsolidatedConversation(
+            platform=platform,
+            conversation_id=conversation_id,
+            consolidated_at=consolidated_at
+        ))
+    db.session.commit()
+
+
+def _get_pending_batch_conversations():
+    """
+    Retourne les conversations déjà présentes dans un lot non encore appliqué,
+    pour éviter de les soumettre une seconde fois.
+
+    Returns:
+        set: Clés "plateforme:conversation_id"
+    """
+    from models import LLMBatchJob
+
+    pending = set()
+    jobs = LLMBatchJob.query.filter(
+        LLMBatchJob.job_type == 'consolidation',
+        LLMBatchJob.status.in_(['submitted', 'completed'])
+    ).all()
+    for job in jobs:
+        for item in (job.context or {}).values():
+            pending.add(f"{item.get('platform')}:{item.get('conversation_id')}")
+    return pending
+
+
+def _add_consolidation_request(batch_requests, batch_context, platform, conversation_id, user_id, transcript, model):
+    """Ajoute la consolidation d'une conversation au lot en cours de construction"""
+    custom_id = f"consolidation:{platform}:{conversation_id}"
+    batch_requests.append(build_batch_request(custom_id, {
+        "model": model,
+        "messages": _build_consolidation_messages(user_id, transcript),
+        "tools": MEMORY_FUNCTIONS,
+        "tool_choice": "auto"
+    }))
+    batch_context[custom_id] = {
+        "platform": platform,
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        # Date du transcript soumis, reprise comme tampon de consolidation à l'application
+        "submitted_at": datetime.utcnow().isoformat()
+    }
+
+
+def _apply_consolidation_result(custom_id, response_body, context):
+    """
+    Applique le résultat d'une consolidation traitée en batch.
+    Appelé une seule fois par custom_id (voir llm_batch.apply_batch_results).
+    """
+    user_id = context['user_id']
+    tool_calls = get_response_message(response_body).get('tool_calls') or []
+
+    if tool_calls:
+        _apply_memory_tool_calls(
+            user_id,
+            [(call['function']['name'], call['function']['arguments']) for call in tool_calls]
+        )
+    else:
+        logger.info(f"Aucune information à consolider pour user_id {user_id}.")
+
+    submitted_at = context.get('submitted_at')
+    _mark_conversation_consolidated(
+        context['platform'], context['conversation_id'],
+        consolidated_at=datetime.fromisoformat(submitted_at) if submitted_at else None
+    )
+
+
+register_batch_applier('consolidation', _apply_consolidation_result)
+
+
 # ============================================================================
 # TÂCHE PLANIFIÉE (SCHEDULER)
 # ============================================================================
@@ -256,11 +388,27 @@ def run_consolidation_task():
     """
     Tâche planifiée qui recherche les conversations inactives sur les 3 plateformes
     et déclenche leur consolidation.
+
+    En mode batch (LLM_BATCH_MODE contient 'consolidation'), les requêtes sont
+    regroupées dans un lot unique ; les résultats sont appliqués par poll_pending_batches.
     """
     logger.info("🔄 SCHEDULER: Démarrage de la tâche de consolidation...")
 
     try:
+        from app import app
         with app.app_context():
+            batch_mode = is_batch_mode_enabled('consolidation')
+            batch_backend = None
+            if batch_mode:
+                try:
+                    batch_backend = get_batch_backend()
+                except Exception as backend_error:
+                    logger.error(f"SCHEDULER: Backend batch indisponible, consolidation synchrone: {backend_error}")
+                    batch_mode = False
+            batch_model = get_batch_model(batch_backend) if batch_mode else None
+            batch_requests, batch_context = [], {}
+            pending_keys = _get_pending_batch_conversations() if batch_mode else set()
+
             # Seuil d'inactivité : 10 minutes pour avoir une marge de sécurité
             inactive_since = datetime.utcnow() - timedelta(minutes=60)
             logger.debug(f"SCHEDULER: Recherche des conversations inactives avant {inactive_since.strftime('%Y-%m-%d %H:%M:%S')} UTC")
@@ -291,21 +439,20 @@ def run_consolidation_task():
                         if consolidation_record and consolidation_record.consolidated_at >= conv.updated_at:
                             logger.debug(f"SCHEDULER (Web): Conv {conv.id} non modifiée depuis la dernière consolidation, ignorée.")
                             continue
+                        if f"web:{conv.id}" in pending_keys:
+                            continue
                         messages = Message.query.filter_by(conversation_id=conv.id).order_by(Message.created_at).all()
                         if not messages:
                             continue
                         transcript = "\n".join([f"{'Élève' if msg.role == 'user' else 'Exô'}: {msg.content}" for msg in messages])
                         logger.info(f"📝 Web: Consolidation conv {conv.id} (user {conv.user_id})")
-                        consolidate_memory_for_user(conv.user_id, transcript)
-                        # Mettre à jour ou créer le tampon de consolidation
-                        if consolidation_record:
-                            consolidation_record.consolidated_at = datetime.utcnow()
+                        if batch_mode:
+                            _add_consolidation_request(batch_requests, batch_context, 'web', str(conv.id),
+                                                       conv.user_id, transcript, batch_model)
                         else:
-                            db.session.add(ConsolidatedConversation(
-                                platform='web',
-                                conversation_id=str(conv.id)
-                            ))
-                        db.session.commit()
+                            consolidate_memory_for_user(conv.user_id, transcript)
+                            # Mettre à jour ou créer le tampon de consolidation
+                            _mark_conversation_consolidated('web', str(conv.id), consolidation_record)
                         consolidations_count += 1
                         if consolidations_count >= max_consolidations_per_run:
                             break
@@ -329,6 +476,8 @@ def run_consolidation_task():
                         if consolidation_record and consolidation_record.consolidated_at >= tg_conv.updated_at:
                             logger.debug(f"SCHEDULER (Telegram): Conv {tg_conv.id} non modifiée depuis la dernière consolidation, ignorée.")
                             continue
+                        if f"telegram:{tg_conv.id}" in pending_keys:
+                            continue
                         user_phone_id = f"telegram_{tg_conv.telegram_user_id}"
                         web_user = User.query.filter_by(phone_number=user_phone_id).first()
                         if not web_user:
@@ -339,16 +488,13 @@ def run_consolidation_task():
                             continue
                         transcript = "\n".join([f"{'Élève' if msg.role == 'user' else 'Exô'}: {msg.content}" for msg in messages])
                         logger.info(f"📱 Telegram: Consolidation conv {tg_conv.id} (user {web_user.id})")
-                        consolidate_memory_for_user(web_user.id, transcript)
-                        # Mettre à jour ou créer le tampon de consolidation
-                        if consolidation_record:
-                            consolidation_record.consolidated_at = datetime.utcnow()
+                        if batch_mode:
+                            _add_consolidation_request(batch_requests, batch_context, 'telegram', str(tg_conv.id),
+                                                       web_user.id, transcript, batch_model)
                         else:
-                            db.session.add(ConsolidatedConversation(
-                                platform='telegram',
-                                conversation_id=str(tg_conv.id)
-                            ))
-                        db.session.commit()
+                            consolidate_memory_for_user(web_user.id, transcript)
+                            # Mettre à jour ou créer le tampon de consolidation
+                            _mark_conversation_consolidated('telegram', str(tg_conv.id), consolidation_record)
                         consolidations_count += 1
                         if consolidations_count >= max_consolidations_per_run:
                             break
@@ -381,6 +527,8 @@ def run_consolidation_task():
                         if consolidation_record and consolidation_record.consolidated_at >= last_message.timestamp:
                             logger.debug(f"SCHEDULER (WhatsApp): Thread {thread_id[:12]} non modifié depuis la dernière consolidation, ignoré.")
                             continue
+                        if f"whatsapp:{thread_id}" in pending_keys:
+                            continue
 
                         first_msg = WhatsAppMessage.query.filter_by(thread_id=thread_id, direction='inbound').order_by(WhatsAppMessage.timestamp).first()
                         if not first_msg:
@@ -394,22 +542,26 @@ def run_consolidation_task():
                             continue
                         transcript = "\n".join([f"{'Élève' if msg.direction == 'inbound' else 'Exô'}: {msg.content}" for msg in messages])
                         logger.info(f"💬 WhatsApp: Consolidation thread {thread_id[:8]}... (user {web_user.id})")
-                        consolidate_memory_for_user(web_user.id, transcript)
-
-                        if consolidation_record:
-                            consolidation_record.consolidated_at = datetime.utcnow()
+                        if batch_mode:
+                            _add_consolidation_request(batch_requests, batch_context, 'whatsapp', thread_id,
+                                                       web_user.id, transcript, batch_model)
                         else:
-                            db.session.add(ConsolidatedConversation(
-                                platform='whatsapp',
-                                conversation_id=thread_id
-                            ))
-                        db.session.commit()
+                            consolidate_memory_for_user(web_user.id, transcript)
+                            _mark_conversation_consolidated('whatsapp', thread_id, consolidation_record)
                         consolidations_count += 1
                         if consolidations_count >= max_consolidations_per_run:
                             break
             except Exception as wa_error:
                 logger.error(f"Erreur consolidation WhatsApp: {wa_error}", exc_info=True)
 
+            # ===== SOUMISSION DU LOT (MODE BATCH) =====
+            if batch_mode and batch_requests:
+                job = submit_batch('consolidation', batch_requests, batch_context, backend=batch_backend)
+                if job is None:
+                    logger.error(f"SCHEDULER: Soumission du lot de consolidation échouée, {len(batch_requests)} conversation(s) reportée(s).")
+                else:
+                    logger.info(f"📦 SCHEDULER: {len(batch_requests)} consolidation(s) soumise(s) en batch (lot {job.batch_id}).")
+
             logger.info(f"✅ SCHEDULER: Tâche terminée. {consolidations_count} consolidation(s) effectuée(s).")
 
     except Exception as e:
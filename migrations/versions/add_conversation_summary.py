@@ -0,0 +1,36 @@
+"""Add conversation_summary table
+
+Revision ID: add_conversation_summary
+Revises: add_llm_batch_job
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_conversation_summary'
+down_revision = 'add_llm_batch_job'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Créer la table conversation_summary"""
+    op.create_table(
+        'conversation_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('platform', sa.String(length=20), nullable=False),
+        sa.Column('conversation_id', sa.String(length=255), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('messages_covered', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('platform', 'conversation_id', name='uq_conversation_summary_platform_id')
+    )
+
+
+def downgrade():
+    """Supprimer la table conversation_summary"""
+    op.drop_table('conversation_summary')
@@ -0,0 +1,42 @@
+"""Add image_cache_entry table
+
+Revision ID: add_image_cache_entry
+Revises: add_inbound_job
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_cache_entry'
+down_revision = 'add_inbound_job'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Créer la table image_cache_entry (cache OCR / upload OpenAI par empreinte)"""
+    op.create_table(
+        'image_cache_entry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('phash', sa.String(length=16), nullable=True),
+        sa.Column('ocr_result', sa.JSON(), nullable=True),
+        sa.Column('openai_file_id', sa.String(length=128), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256')
+    )
+    op.create_index('ix_image_cache_entry_phash', 'image_cache_entry', ['phash'], unique=False)
+    op.create_index('ix_image_cache_entry_expires_at', 'image_cache_entry', ['expires_at'], unique=False)
+
+
+def downgrade():
+    """Supprimer la table image_cache_entry"""
+    op.drop_index('ix_image_cache_entry_expires_at', table_name='image_cache_entry')
+    op.drop_index('ix_image_cache_entry_phash', table_name='image_cache_entry')
+    op.drop_table('image_cache_entry')
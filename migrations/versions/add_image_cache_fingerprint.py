@@ -0,0 +1,26 @@
+"""Add fingerprint column to image_cache_entry
+
+Revision ID: add_image_cache_fingerprint
+Revises: add_image_cache_entry
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_cache_fingerprint'
+down_revision = 'add_image_cache_entry'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Ajouter l'empreinte perceptuelle fine (confirmation des candidats phash)"""
+    op.add_column('image_cache_entry', sa.Column('fingerprint', sa.String(length=256), nullable=True))
+
+
+def downgrade():
+    """Supprimer la colonne fingerprint"""
+    op.drop_column('image_cache_entry', 'fingerprint')
@@ -0,0 +1,45 @@
+"""Add inbound_job table
+
+Revision ID: add_inbound_job
+Revises: add_conversation_summary
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_inbound_job'
+down_revision = 'add_conversation_summary'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Créer la table inbound_job (file durable des messages entrants)"""
+    op.create_table(
+        'inbound_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('platform', sa.String(length=20), nullable=False),
+        sa.Column('message_id', sa.String(length=128), nullable=False),
+        sa.Column('conversation_key', sa.String(length=255), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('locked_by', sa.String(length=128), nullable=True),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('platform', 'message_id', name='uq_inbound_job_platform_message')
+    )
+    op.create_index('ix_inbound_job_status_conversation', 'inbound_job',
+                    ['status', 'platform', 'conversation_key', 'id'], unique=False)
+
+
+def downgrade():
+    """Supprimer la table inbound_job"""
+    op.drop_index('ix_inbound_job_status_conversation', table_name='inbound_job')
+    op.drop_table('inbound_job')
@@ -0,0 +1,47 @@
+"""Add llm_batch_job table
+
+Revision ID: add_llm_batch_job
+Revises: add_warning_messages_sent
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_llm_batch_job'
+down_revision = 'add_warning_messages_sent'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Créer la table llm_batch_job"""
+    op.create_table(
+        'llm_batch_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_type', sa.String(length=50), nullable=False),
+        sa.Column('backend', sa.String(length=20), nullable=False),
+        sa.Column('batch_id', sa.String(length=128), nullable=False),
+        sa.Column('input_file_path', sa.String(length=512), nullable=True),
+        sa.Column('request_count', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='submitted'),
+        sa.Column('context', sa.JSON(), nullable=True),
+        sa.Column('applied_ids', sa.JSON(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('batch_id')
+    )
+
+    op.create_index('ix_llm_batch_job_status', 'llm_batch_job', ['status'])
+    op.create_index('ix_llm_batch_job_type_created_at', 'llm_batch_job', ['job_type', 'created_at'], postgresql_ops={'created_at': 'DESC'})
+
+
+def downgrade():
+    """Supprimer la table llm_batch_job"""
+    op.drop_index('ix_llm_batch_job_type_created_at', table_name='llm_batch_job')
+    op.drop_index('ix_llm_batch_job_status', table_name='llm_batch_job')
+    op.drop_table('llm_batch_job')
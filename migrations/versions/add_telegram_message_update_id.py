@@ -0,0 +1,28 @@
+"""Add update_id column to telegram_message
+
+Revision ID: add_telegram_message_update_id
+Revises: add_image_cache_fingerprint
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_telegram_message_update_id'
+down_revision = 'add_image_cache_fingerprint'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Ajouter l'update Telegram d'origine (nouvelles tentatives idempotentes)"""
+    op.add_column('telegram_message', sa.Column('update_id', sa.BigInteger(), nullable=True))
+    op.create_index('ix_telegram_message_update_id', 'telegram_message', ['update_id'])
+
+
+def downgrade():
+    """Supprimer la colonne update_id"""
+    op.drop_index('ix_telegram_message_update_id', table_name='telegram_message')
+    op.drop_column('telegram_message', 'update_id')
@@ -0,0 +1,289 @@
+"""
+Routeur de modèles selon le type de requête.
+
+Placé devant execute_chat_completion : au lieu d'envoyer tout le trafic vers
+CURRENT_MODEL, chaque appel est classé (salutation courte, suite d'image OCR,
+problème long, rappel, cours...) puis dirigé vers un palier de modèles :
+
+- 'fast'      : messages triviaux, rappels, résumés (modèle rapide et peu coûteux)
+- 'reasoning' : problèmes longs ou contenu d'image extrait (modèle de raisonnement)
+- 'default'   : tout le reste (CURRENT_MODEL)
+
+Dans chaque palier, le premier modèle configuré dont la latence récente (p90)
+respecte le budget est choisi ; les statistiques de latence sont alimentées par
+execute_chat_completion via record_model_latency. Un candidat écarté pour
+taux d'erreur ne reçoit plus de trafic : après ROUTER_ERROR_COOLDOWN secondes,
+un appel d'essai lui est confié, et un succès efface son historique d'erreurs.
+
+Le routeur est désactivé par défaut (MODEL_ROUTER_ENABLED) et ne s'applique
+jamais au mode Assistant OpenAI (CURRENT_MODEL='openai').
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+MODEL_ROUTER_ENABLED = os.environ.get('MODEL_ROUTER_ENABLED', 'false').lower() == 'true'
+
+# Paliers : listes ordonnées de modèles candidats (clés de CURRENT_MODEL)
+ROUTER_FAST_MODELS = os.environ.get('ROUTER_FAST_MODELS', 'gemini,deepseek')
+ROUTER_REASONING_MODELS = os.environ.get('ROUTER_REASONING_MODELS', 'deepseek-reasoner')
+
+ROUTER_SHORT_MESSAGE_CHARS = int(os.environ.get('ROUTER_SHORT_MESSAGE_CHARS', '40'))
+ROUTER_LONG_MESSAGE_CHARS = int(os.environ.get('ROUTER_LONG_MESSAGE_CHARS', '600'))
+
+# Budgets de latence (p90, secondes) au-delà desquels un candidat est écarté.
+# Les bots (Telegram/WhatsApp) n'ont pas de streaming : budget plus strict.
+ROUTER_LATENCY_BUDGET = {
+    'fast': float(os.environ.get('ROUTER_FAST_LATENCY_BUDGET', '8')),
+    'reasoning': float(os.environ.get('ROUTER_REASONING_LATENCY_BUDGET', '90')),
+}
+ROUTER_BOT_REASONING_LATENCY_BUDGET = float(os.environ.get('ROUTER_BOT_REASONING_LATENCY_BUDGET', '45'))
+# Un candidat dont plus de la moitié des appels récents ont échoué est écarté
+ROUTER_MAX_ERROR_RATE = float(os.environ.get('ROUTER_MAX_ERROR_RATE', '0.5'))
+# Délai avant de confier un appel d'essai à un candidat écarté (secondes)
+ROUTER_ERROR_COOLDOWN = float(os.environ.get('ROUTER_ERROR_COOLDOWN', '60'))
+
+IMAGE_CONTENT_MARKER = "[Extracted Image Content]"
+_LATENCY_SAMPLES = 50
+
+# Indices d'un exercice à résoudre (problème plutôt que conversation)
+_PROBLEM_PATTERN = re.compile(
+    r"(\d\s*[+\-*/^=]\s*\d|\b(résous|résoudre|calcule|calculer|démontre|démontrer|montre que|"
+    r"justifie|dérivée|intégrale|limite|équation|inéquation|probabilité|exercice)\b)",
+    re.IGNORECASE
+)
+
+_SUPPORTED_MODELS = ('deepseek', 'deepseek-reasoner', 'qwen', 'gemini')
+_MODEL_PROVIDERS = {
+    'deepseek': 'deepseek',
+    'deepseek-reasoner': 'deepseek',
+    'qwen': 'qwen',
+    'gemini': 'gemini',
+}
+
+
+# ===================================
+# STATISTIQUES DE LATENCE
+# ===================================
+
+_latencies = defaultdict(lambda: deque(maxlen=_LATENCY_SAMPLES))
+_errors = defaultdict(lambda: deque(maxlen=_LATENCY_SAMPLES))
+_excluded = {}  # modèle -> instant (monotonic) de l'exclusion ou du dernier essai
+_stats_lock = threading.Lock()
+
+
+def record_model_latency(model, seconds, success=True):
+    """
+    Enregistre la latence d'un appel (temps jusqu'au premier token en streaming,
+    durée totale sinon).
+
+    Args:
+        model: Clé du modèle ('deepseek', 'gemini', ...)
+        seconds: Latence mesurée
+        success: False si l'appel a échoué (comptabilisé dans le taux d'erreur)
+    """
+    with _stats_lock:
+        _latencies[model].append(seconds)
+        if success and _excluded.pop(model, None) is not None:
+            # Appel d'essai réussi : le candidat est réintégré avec un historique neuf
+            _errors[model].clear()
+            logger.info(f"🔀 Routage: {model} réintégré après un appel d'essai réussi")
+        _errors[model].append(0 if success else 1)
+
+
+def get_model_latency_p90(model):
+    """Retourne la latence p90 récente d'un modèle, ou None sans mesure"""
+    with _stats_lock:
+        samples = sorted(_latencies[model])
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+
+
+def get_model_error_rate(model):
+    """Retourne le taux d'erreur récent d'un modèle (0.0 sans mesure)"""
+    with _stats_lock:
+        errors = list(_errors[model])
+    return sum(errors) / len(errors) if errors else 0.0
+
+
+def get_router_stats():
+    """Retourne les statistiques de latence par modèle (monitoring)"""
+    with _stats_lock:
+        models = list(_latencies.keys())
+    stats = {}
+    for model in models:
+        with _stats_lock:
+            samples = list(_latencies[model])
+            errors = list(_errors[model])
+        stats[model] = {
+            'samples': len(samples),
+            'p50': sorted(samples)[len(samples) // 2] if samples else None,
+            'p90': get_model_latency_p90(model),
+            'error_rate': round(get_model_error_rate(model), 3),
+            'excluded': model in _excluded
+        }
+    return stats
+
+
+# ===================================
+# ROUTAGE
+# ===================================
+
+def _parse_models(value):
+    return [m.strip() for m in value.split(',') if m.strip() in _SUPPORTED_MODELS]
+
+
+def _is_configured(model):
+    """Un modèle est utilisable si au moins une clé de son fournisseur est configurée"""
+    from ai_config import _get_provider_keys
+    return bool(_get_provider_keys(_MODEL_PROVIDERS[model]))
+
+
+def classify_request(messages_history, platform=None, purpose='chat'):
+    """
+    Détermine le palier d'une requête.
+
+    Args:
+        messages_history: Historique [{"role": "...", "content": "..."}]
+        platform: 'web', 'telegram', 'whatsapp' ou None
+        purpose: 'chat', 'lesson', 'reminder' ou 'summary'
+
+    Returns:
+        str: 'fast', 'reasoning' ou 'default'
+    """
+    if purpose in ('reminder', 'summary'):
+        return 'fast'
+    if purpose == 'lesson':
+        return 'default'
+
+    last_user_message = ""
+    for msg in reversed(messages_history):
+        if msg.get('role') == 'user':
+            last_user_message = msg.get('content') or ""
+            break
+
+    if IMAGE_CONTENT_MARKER in last_user_message:
+        return 'reasoning'
+
+    # Ignorer les préfixes de consigne (ex: "⛔n'utilise pas le latex⛔...") pour mesurer la demande réelle
+    user_text = last_user_message.rsplit('⛔', 1)[-1].strip()
+
+    if len(user_text) >= ROUTER_LONG_MESSAGE_CHARS:
+        return 'reasoning'
+    if _PROBLEM_PATTERN.search(user_text):
+        return 'reasoning' if platform == 'web' else 'default'
+    if len(user_text) <= ROUTER_SHORT_MESSAGE_CHARS:
+        return 'fast'
+    return 'default'
+
+
+def _probe_allowed(model):
+    """
+    Candidat au-dessus de ROUTER_MAX_ERROR_RATE : écarté, sauf pour un appel
+    d'essai toutes les ROUTER_ERROR_COOLDOWN secondes (sans cela il ne recevrait
+    plus jamais de mesure et resterait écarté indéfiniment).
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        since = _excluded.get(model)
+        if since is None:
+            _excluded[model] = now
+            logger.warning(f"🔀 Routage: {model} écarté (taux d'erreur > {ROUTER_MAX_ERROR_RATE:.0%})")
+            return False
+        if now - since < ROUTER_ERROR_COOLDOWN:
+            return False
+        _excluded[model] = now  # Un seul essai par période
+    logger.info(f"🔀 Routage: appel d'essai vers {model}")
+    return True
+
+
+def _pick_candidate(candidates, budget):
+    """Premier candidat sain dont le p90 respecte le budget ; sinon le plus rapide mesuré"""
+    measured = []
+    for model in candidates:
+        if get_model_error_rate(model) > ROUTER_MAX_ERROR_RATE:
+            if _probe_allowed(model):
+                return model
+            continue
+        p90 = get_model_latency_p90(model)
+        if p90 is None or p90 <= budget:
+            return model
+        measured.append((p90, model))
+    return min(measured)[1] if measured else None
+
+
+def route_model(messages_history, current_model, platform=None, purpose='chat'):
+    """
+    Choisit le modèle à utiliser pour un appel Chat Completion.
+
+    Args:
+        messages_history: Historique de la requête
+        current_model: Modèle configuré globalement (CURRENT_MODEL)
+        platform: 'web', 'telegram', 'whatsapp' ou None
+        purpose: 'chat', 'lesson', 'reminder' ou 'summary'
+
+    Returns:
+        str: Clé du modèle retenu (current_model si le routage ne s'applique pas)
+    """
+    if not MODEL_ROUTER_ENABLED or current_model not in _SUPPORTED_MODELS:
+        return current_model
+
+    tier = classify_request(messages_history, platform, purpose)
+    if tier == 'default':
+        return current_model
+
+    source = ROUTER_FAST_MODELS if tier == 'fast' else ROUTER_REASONING_MODELS
+    candidates = [m for m in _parse_models(source) if _is_configured(m)]
+    if not candidates:
+        return current_model
+
+    budget = ROUTER_LATENCY_BUDGET[tier]
+    if tier == 'reasoning' and platform in ('telegram', 'whatsapp'):
+        budget = min(budget, ROUTER_BOT_REASONING_LATENCY_BUDGET)
+
+    chosen = _pick_candidate(candidates, budget)
+    if tier == 'reasoning' and chosen is not None:
+        # Si le modèle de raisonnement est trop lent, rester sur le modèle par défaut
+        p90 = get_model_latency_p90(chosen)
+        default_p90 = get_model_latency_p90(current_model)
+        if p90 is not None and p90 > budget and (default_p90 is None or default_p90 < p90):
+            chosen = current_model
+
+    chosen = chosen or current_model
+    if chosen != current_model:
+        logger.info(f"🔀 Routage: palier '{tier}' ({platform or 'n/a'}/{purpose}) -> {chosen}")
+    return chosen
+
+
+class LatencyTimer:
+    """
+    Mesure la latence d'un appel et l'enregistre une seule fois. En streaming,
+    first_token() fige la latence (temps jusqu'au premier token) et record() est
+    appelé à la fin du flux : un flux interrompu est compté comme un échec.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.start = time.time()
+        self.first_token_at = None
+        self.recorded = False
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+
+    def record(self, success=True):
+        if not self.recorded:
+            self.recorded = True
+            record_model_latency(self.model, (self.first_token_at or time.time()) - self.start, success)
@@ -117,6 +117,8 @@ class TelegramMessage(db.Model):
     role = db.Column(db.String(50), nullable=False)
     content = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.String(512))
+    # Update Telegram d'origine : une nouvelle tentative de la file durable ne réenregistre rien
+    update_id = db.Column(db.BigInteger, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Index combiné explicite avec DESC
@@ -378,3 +380,92 @@ class Lesson(db.Model):
         db.Index('ix_lesson_subject', 'subject'),
         db.Index('ix_lesson_status', 'status'),
     )
+
+class LLMBatchJob(db.Model):
+    """Table pour suivre les lots (Batch API) soumis pour les tâches IA de fond"""
+    __tablename__ = 'llm_batch_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # 'consolidation', 'reminder'
+    backend = db.Column(db.String(20), nullable=False)  # 'openai' ou 'local'
+    batch_id = db.Column(db.String(128), unique=True, nullable=False)  # ID renvoyé par le backend
+    input_file_path = db.Column(db.String(512))  # Fichier JSONL soumis
+    request_count = db.Column(db.Integer, default=0)
+
+    # Suivi
+    status = db.Column(db.String(20), nullable=False, default='submitted')  # submitted, completed, applied, failed, abandoned
+    context = db.Column(db.JSON)  # custom_id -> métadonnées nécessaires pour appliquer le résultat
+    applied_ids = db.Column(db.JSON)  # custom_ids déjà appliqués (idempotence)
+    error_message = db.Column(db.Text)
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    # Index pour le poller (lots en attente)
+    __table_args__ = (
+        db.Index('ix_llm_batch_job_status', 'status'),
+        db.Index('ix_llm_batch_job_type_created_at', 'job_type', desc(created_at)),
+    )
+
+class ConversationSummary(db.Model):
+    """Résumé glissant d'une conversation (remplace l'historique tronqué dans le prompt)"""
+    __tablename__ = 'conversation_summary'
+
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(20), nullable=False)  # 'web', 'telegram', 'whatsapp'
+    conversation_id = db.Column(db.String(255), nullable=False)  # ID de conversation ou thread_id WhatsApp
+    summary = db.Column(db.Text, nullable=False)
+    messages_covered = db.Column(db.Integer, nullable=False, default=0)  # Nb de messages (les plus anciens) couverts par le résumé
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Un seul résumé par conversation
+    __table_args__ = (
+        db.UniqueConstraint('platform', 'conversation_id', name='uq_conversation_summary_platform_id'),
+    )
+
+class InboundJob(db.Model):
+    """File durable des messages entrants (WhatsApp, Telegram) en attente de traitement"""
+    __tablename__ = 'inbound_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    platform = db.Column(db.String(20), nullable=False)  # 'whatsapp', 'telegram'
+    message_id = db.Column(db.String(128), nullable=False)  # ID du message/update côté plateforme (idempotence)
+    conversation_key = db.Column(db.String(255), nullable=False)  # thread_id WhatsApp ou chat_id Telegram (ordre)
+    payload = db.Column(db.JSON, nullable=False)
+
+    # Suivi
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(128))  # Processus/worker qui traite le job
+    locked_until = db.Column(db.DateTime)  # Fin du délai de visibilité (ou date de nouvelle tentative)
+    last_error = db.Column(db.Text)
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Un message de plateforme n'est mis en file qu'une seule fois
+        db.UniqueConstraint('platform', 'message_id', name='uq_inbound_job_platform_message'),
+        # Recherche du prochain job par conversation
+        db.Index('ix_inbound_job_status_conversation', 'status', 'platform', 'conversation_key', 'id'),
+    )
+
+class ImageCacheEntry(db.Model):
+    """Cache des traitements d'image (OCR Mathpix, upload OpenAI) par empreinte du contenu"""
+    __tablename__ = 'image_cache_entry'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)  # Empreinte exacte des octets
+    phash = db.Column(db.String(16), index=True)  # Empreinte perceptuelle (copies recompressées), optionnelle
+    fingerprint = db.Column(db.String(256))  # Empreinte perceptuelle fine (1024 bits) confirmant un candidat phash
+
+    # Résultats réutilisables
+    ocr_result = db.Column(db.JSON)  # formatted_summary, text et drapeaux has_* de Mathpix
+    openai_file_id = db.Column(db.String(128))
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
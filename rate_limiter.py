@@ -0,0 +1,126 @@
+"""
+Limitation du débit entrant par expéditeur sur les bots (WhatsApp, Telegram).
+
+Un seau à jetons par identité (numéro WhatsApp, ID Telegram) : BOT_RATE_BURST
+messages d'affilée, puis BOT_RATE_PER_MINUTE messages par minute en régime
+établi. Un message refusé n'est pas mis en file (aucune génération) ; l'élève
+reçoit au plus une réponse toute faite par BOT_RATE_NOTICE_INTERVAL secondes.
+
+Les seaux sont en mémoire, propres au processus, et bornés (LRU) : un
+expéditeur oublié repart avec un seau plein, ce qui reste sans danger.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+BOT_RATE_BURST = float(os.environ.get('BOT_RATE_BURST', '5'))
+BOT_RATE_PER_MINUTE = float(os.environ.get('BOT_RATE_PER_MINUTE', '6'))
+BOT_RATE_NOTICE_INTERVAL = int(os.environ.get('BOT_RATE_NOTICE_INTERVAL', '60'))
+BOT_RATE_MAX_SENDERS = int(os.environ.get('BOT_RATE_MAX_SENDERS', '20000'))
+BOT_RATE_LIMIT_MESSAGE = os.environ.get(
+    'BOT_RATE_LIMIT_MESSAGE',
+    "Doucement 😅 Tu envoies beaucoup de messages à la suite. Attends une minute avant de continuer !"
+)
+
+
+class TokenBucketLimiter:
+    """Seaux à jetons par expéditeur"""
+
+    def __init__(self, name, burst=BOT_RATE_BURST, per_minute=BOT_RATE_PER_MINUTE,
+                 max_senders=BOT_RATE_MAX_SENDERS):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_senders = max_senders
+        self._buckets = OrderedDict()  # sender -> [jetons, dernier remplissage, dernier avertissement]
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'limited': 0, 'notices': 0}
+        self._limited_by_sender = {}
+
+    def allow(self, sender):
+        """
+        Consomme un jeton pour cet expéditeur.
+
+        Returns:
+            bool: False si l'expéditeur dépasse son débit
+        """
+        if self.rate <= 0 and self.burst <= 0:
+            return True
+        sender = str(sender)
+        now = time.time()
+
+        with self._lock:
+            bucket = self._buckets.get(sender)
+            if bucket is None:
+                bucket = [self.burst, now, 0.0]
+                self._buckets[sender] = bucket
+                while len(self._buckets) > self.max_senders:
+                    evicted, _ = self._buckets.popitem(last=False)
+                    self._limited_by_sender.pop(evicted, None)
+            else:
+                self._buckets.move_to_end(sender)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self._stats['allowed'] += 1
+                return True
+
+            self._stats['limited'] += 1
+            self._limited_by_sender[sender] = self._limited_by_sender.get(sender, 0) + 1
+
+        logger.warning(f"Limite de débit {self.name} atteinte pour {sender}")
+        return False
+
+    def should_notify(self, sender):
+        """True si l'expéditeur limité n'a pas été prévenu depuis BOT_RATE_NOTICE_INTERVAL"""
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(str(sender))
+            if bucket is None or now - bucket[2] < BOT_RATE_NOTICE_INTERVAL:
+                return False
+            bucket[2] = now
+            self._stats['notices'] += 1
+            return True
+
+    def stats(self):
+        """Compteurs et expéditeurs les plus limités (monitoring)"""
+        with self._lock:
+            stats = dict(self._stats)
+            top = sorted(self._limited_by_sender.items(), key=lambda item: item[1], reverse=True)[:10]
+            stats.update({
+                'tracked_senders': len(self._buckets),
+                'top_limited': [{'sender': s, 'limited': c} for s, c in top],
+                'burst': self.burst,
+                'per_minute': round(self.rate * 60, 2)
+            })
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(platform):
+    """Retourne le limiteur partagé d'une plateforme ('whatsapp', 'telegram')"""
+    with _limiters_lock:
+        if platform not in _limiters:
+            _limiters[platform] = TokenBucketLimiter(platform)
+        return _limiters[platform]
+
+
+def get_rate_limit_stats():
+    """Métriques de tous les limiteurs"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {platform: limiter.stats() for platform, limiter in limiters.items()}
@@ -1,3 +1,4 @@
+import os
 import logging
 import time
 import random
@@ -6,15 +7,22 @@ from typing import List, Dict, Tuple
 from database import db
 from models import (
     User, TelegramUser, WhatsAppMessage, 
-    TelegramConversation, ReminderLog
+    TelegramConversation, ReminderLog, LLMBatchJob
 )
-from ai_utils import generate_reminder_message
+from ai_utils import generate_reminder_message, build_reminder_chat_messages, _clean_response_text
 from utils import db_retry_session
+from llm_batch import (
+    is_batch_mode_enabled, build_batch_request, submit_batch, refresh_batch,
+    apply_batch_results, cancel_batch, get_batch_backend, get_batch_model, get_response_message,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Âge max du lot de rappels (soumis en avance par submit_reminder_batch) repris à l'envoi
+REMINDER_BATCH_MAX_AGE_HOURS = int(os.environ.get('REMINDER_BATCH_MAX_AGE_HOURS', '3'))
+
 
 # ============================================
 # FONCTIONS DE VÉRIFICATION DES CONDITIONS
@@ -212,22 +220,26 @@ def get_eligible_telegram_users() -> List[Dict]:
 # ENVOI DES RAPPELS
 # ============================================
 
-def send_reminder_to_whatsapp_user(user_data: Dict, scheduled_for: datetime) -> bool:
+def send_reminder_to_whatsapp_user(user_data: Dict, scheduled_for: datetime, message: str = None) -> bool:
     """
     Envoie un rappel à un utilisateur WhatsApp
+
+    Args:
+        message: Message pré-généré (mode batch). Si None, il est généré à la volée.
     """
     phone_number = user_data['phone_number']
     thread_id = user_data['thread_id']
     hours_since = user_data['context'].get('hours_since', 0)
 
     try:
-        # Générer le message
-        message = generate_reminder_message(
-            user_identifier=phone_number,
-            platform='whatsapp',
-            thread_id=thread_id,
-            reminder_type='night'
-        )
+        # Générer le message (sauf s'il a été pré-généré en batch)
+        if not message:
+            message = generate_reminder_message(
+                user_identifier=phone_number,
+                platform='whatsapp',
+                thread_id=thread_id,
+                reminder_type='night'
+            )
 
         # Envoyer via WhatsApp
         from whatsapp_bot import send_reminder_whatsapp
@@ -291,35 +303,31 @@ def send_reminder_to_whatsapp_user(user_data: Dict, scheduled_for: datetime) ->
         return False
 
 
-def send_reminder_to_telegram_user(user_data: Dict, scheduled_for: datetime) -> bool:
+def send_reminder_to_telegram_user(user_data: Dict, scheduled_for: datetime, message: str = None) -> bool:
     """
     Envoie un rappel à un utilisateur Telegram
+
+    Args:
+        message: Message pré-généré (mode batch). Si None, il est généré à la volée.
     """
     telegram_id = user_data['telegram_id']
     thread_id = user_data['thread_id']
     hours_since = user_data['context'].get('hours_since', 0)
 
     try:
-        # Générer le message
-        message = generate_reminder_message(
-            user_identifier=str(telegram_id),
-            platform='telegram',
-            thread_id=thread_id,
-            reminder_type='night'
-        )
-
-        # Envoyer via Telegram (fonction async)
-        from telegram_bot import send_reminder_telegram
-        import asyncio
+        # Générer le message (sauf s'il a été pré-généré en batch)
+        if not message:
+            message = generate_reminder_message(
+                user_identifier=str(telegram_id),
+                platform='telegram',
+                thread_id=thread_id,
+                reminder_type='night'
+            )
 
-        # Créer une nouvelle boucle ou utiliser l'existante
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+        # Envoyer via Telegram (fonction async, exécutée sur la boucle Telegram persistante)
+        from telegram_bot import send_reminder_telegram, run_telegram_coroutine
 
-        success = loop.run_until_complete(send_reminder_telegram(telegram_id, message))
+        success = run_telegram_coroutine(send_reminder_telegram(telegram_id, message), timeout=60)
 
         # Si envoi réussi, sauvegarder dans TelegramMessage pour affichage admin
         if success:
@@ -383,10 +391,110 @@ def send_reminder_to_telegram_user(user_data: Dict, scheduled_for: datetime) ->
         return False
 
 
+def submit_reminder_batch(reminder_type: str = 'night'):
+    """
+    Job planifié avant le rappel nuit : soumet la génération de tous les messages
+    en un seul lot (Batch API), sans attendre le résultat. Le job d'envoi reprend
+    le lot avec collect_reminder_messages ; les utilisateurs absents du lot
+    (devenus éligibles entre-temps, échec) sont générés à la volée.
+    """
+    if not is_batch_mode_enabled('reminder'):
+        return
+
+    from app import app
+
+    with app.app_context():
+        whatsapp_users = get_eligible_whatsapp_users()
+        telegram_users = get_eligible_telegram_users()
+
+        try:
+            backend = get_batch_backend()
+        except Exception as e:
+            logger.error(f"[BATCH] Backend indisponible, les rappels seront générés à l'envoi: {str(e)}")
+            return
+
+        model = get_batch_model(backend)
+        requests = []
+
+        targets = [('whatsapp', u['phone_number'], u['thread_id']) for u in whatsapp_users] + \
+                  [('telegram', str(u['telegram_id']), u['thread_id']) for u in telegram_users]
+
+        for platform, identifier, thread_id in targets:
+            try:
+                messages = build_reminder_chat_messages(identifier, platform, thread_id, reminder_type)
+            except Exception as e:
+                logger.warning(f"[BATCH] Contexte du rappel indisponible pour {platform}/{identifier}: {str(e)}")
+                continue
+            requests.append(build_batch_request(f"{platform}:{identifier}", {
+                "model": model,
+                "messages": messages
+            }))
+
+        submit_batch('reminder', requests, backend=backend)
+
+
+def collect_reminder_messages() -> Dict[str, str]:
+    """
+    Reprend le lot de rappels soumis en avance, sans attente : un lot non terminé
+    au moment de l'envoi est annulé et les messages sont générés à la volée.
+
+    Returns:
+        Dict: "plateforme:identifiant" -> message généré
+    """
+    since = datetime.utcnow() - timedelta(hours=REMINDER_BATCH_MAX_AGE_HOURS)
+
+    # Lots des soirs précédents jamais repris (redémarrage pendant l'attente) : annulés
+    stale = LLMBatchJob.query.filter(
+        LLMBatchJob.job_type == 'reminder',
+        LLMBatchJob.status.in_(['submitted', 'completed']),
+        LLMBatchJob.created_at < since
+    ).all()
+    for stale_job in stale:
+        cancel_batch(stale_job)
+    if stale:
+        logger.warning(f"[BATCH] {len(stale)} lot(s) de rappels périmé(s) abandonné(s)")
+
+    job = LLMBatchJob.query.filter(
+        LLMBatchJob.job_type == 'reminder',
+        LLMBatchJob.status.in_(['submitted', 'completed']),
+        LLMBatchJob.created_at >= since
+    ).order_by(LLMBatchJob.created_at.desc()).first()
+
+    if job is None:
+        logger.info("[BATCH] Aucun lot de rappels en attente, génération à la volée")
+        return {}
+
+    try:
+        results = refresh_batch(job)
+    except Exception as e:
+        logger.error(f"[BATCH] Lot de rappels {job.batch_id} illisible: {str(e)}")
+        db.session.rollback()
+        results = None
+
+    if results is None:
+        if job.status != 'failed':
+            # Annulé chez le fournisseur : sinon le lot et la génération à la volée sont facturés
+            logger.warning(f"[BATCH] Lot de rappels {job.batch_id} non terminé à l'heure d'envoi, annulé")
+            cancel_batch(job)
+        return {}
+
+    generated = {}
+
+    def _collect(custom_id, response_body, context):
+        content = _clean_response_text((get_response_message(response_body).get('content') or '').strip())
+        if content:
+            generated[custom_id] = content
+
+    apply_batch_results(job, results, _collect)
+    logger.info(f"[BATCH] {len(generated)}/{job.request_count} rappels pré-générés")
+    return generated
+
+
 def send_reminders_gradually(
     whatsapp_users: List[Dict],
     telegram_users: List[Dict],
-    scheduled_for: datetime
+    scheduled_for: datetime,
+    pregenerated_messages: Dict[str, str] = None
 ) -> Dict[str, int]:
     """
     Envoie les rappels de façon graduelle avec délais aléatoires
@@ -395,6 +503,7 @@ def send_reminders_gradually(
         whatsapp_users: Liste des utilisateurs WhatsApp éligibles
         telegram_users: Liste des utilisateurs Telegram éligibles
         scheduled_for: Datetime de l'heure prévue (22h30)
+        pregenerated_messages: Messages pré-générés en batch ("plateforme:identifiant" -> message)
 
     Returns:
         Dict avec statistiques d'envoi
@@ -407,6 +516,7 @@ def send_reminders_gradually(
     ]
 
     random.shuffle(all_users)
+    pregenerated_messages = pregenerated_messages or {}
 
     stats = {
         'whatsapp_sent': 0,
@@ -424,13 +534,15 @@ def send_reminders_gradually(
 
         # Envoyer selon la plateforme
         if platform == 'whatsapp':
-            success = send_reminder_to_whatsapp_user(user_data, scheduled_for)
+            message = pregenerated_messages.get(f"whatsapp:{user_data['phone_number']}")
+            success = send_reminder_to_whatsapp_user(user_data, scheduled_for, message)
             if success:
                 stats['whatsapp_sent'] += 1
             else:
                 stats['whatsapp_failed'] += 1
         else:  # telegram
-            success = send_reminder_to_telegram_user(user_data, scheduled_for)
+            message = pregenerated_messages.get(f"telegram:{user_data['telegram_id']}")
+            success = send_reminder_to_telegram_user(user_data, scheduled_for, message)
             if success:
                 stats['telegram_sent'] += 1
             else:
@@ -483,11 +595,17 @@ def run_night_reminder_job():
         logger.info(f"  - WhatsApp: {len(whatsapp_eligible)}")
         logger.info(f"  - Telegram: {len(telegram_eligible)}")
 
+        # Messages pré-générés en batch (lot soumis en avance par submit_reminder_batch)
+        pregenerated_messages = {}
+        if is_batch_mode_enabled('reminder'):
+            pregenerated_messages = collect_reminder_messages()
+
         # Envoi graduel
         stats = send_reminders_gradually(
             whatsapp_eligible,
             telegram_eligible,
-            scheduled_for
+            scheduled_for,
+            pregenerated_messages
         )
 
         logger.info("="*60)
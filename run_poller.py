@@ -0,0 +1,187 @@
+"""
+Service unique de suivi des runs de l'API Assistants d'OpenAI.
+
+Au lieu d'une boucle ``runs.retrieve`` toutes les secondes par run active
+(chacune bloquant un greenlet ou un thread), les appelants enregistrent
+(thread_id, run_id) et attendent un Future. Un seul thread de suivi vérifie
+les runs arrivées à échéance à chaque tour, avec un intervalle adaptatif :
+rapide au début (la plupart des runs courtes finissent en quelques secondes),
+puis de plus en plus espacé jusqu'à RUN_POLL_MAX_INTERVAL.
+
+- Code sync (WhatsApp, rappels) : ``wait_for_run(thread_id, run_id, timeout)``
+- Code async (Telegram) : ``await wait_for_run_async(thread_id, run_id, timeout)``
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+RUN_POLL_INITIAL_INTERVAL = float(os.environ.get('RUN_POLL_INITIAL_INTERVAL', '0.5'))
+RUN_POLL_MAX_INTERVAL = float(os.environ.get('RUN_POLL_MAX_INTERVAL', '3'))
+RUN_POLL_BACKOFF = float(os.environ.get('RUN_POLL_BACKOFF', '1.5'))
+# Nombre de runs.retrieve exécutés en parallèle à chaque tour
+RUN_POLL_WORKERS = int(os.environ.get('RUN_POLL_WORKERS', '4'))
+
+_FAILED_STATUSES = ('failed', 'cancelled', 'expired')
+
+
+class RunFailedError(Exception):
+    """Run terminée sans succès (failed, cancelled, expired)"""
+
+    def __init__(self, run):
+        self.run = run
+        super().__init__(f"Run failed with status: {run.status}")
+
+
+class _TrackedRun:
+    """Une run suivie et son calendrier de vérification"""
+
+    def __init__(self, thread_id, run_id, timeout):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.future = Future()
+        self.deadline = time.time() + timeout
+        self.interval = RUN_POLL_INITIAL_INTERVAL
+        self.next_poll = time.time() + RUN_POLL_INITIAL_INTERVAL
+        self.in_flight = False
+        self.polls = 0
+
+
+# ===================================
+# SERVICE DE SUIVI
+# ===================================
+
+class RunPoller:
+    """Suit toutes les runs actives depuis un seul thread"""
+
+    def __init__(self):
+        self._runs = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=RUN_POLL_WORKERS, thread_name_prefix='run-poll')
+
+    def register(self, thread_id, run_id, timeout=120):
+        """
+        Enregistre une run à suivre.
+
+        Returns:
+            concurrent.futures.Future: résolu avec la run terminée ('completed'),
+            ou en erreur (RunFailedError, TimeoutError)
+        """
+        tracked = _TrackedRun(thread_id, run_id, timeout)
+        with self._cond:
+            self._runs[run_id] = tracked
+            self._ensure_thread()
+            self._cond.notify()
+        return tracked.future
+
+    def stats(self):
+        """Nombre de runs suivies (monitoring)"""
+        with self._cond:
+            return {'active_runs': len(self._runs)}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, daemon=True, name='run-poller')
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._runs:
+                    # Aucun run : le thread s'arrête s'il reste inactif
+                    self._cond.wait(timeout=300)
+                    if not self._runs:
+                        self._thread = None
+                        return
+
+                now = time.time()
+                due = [r for r in self._runs.values() if not r.in_flight and r.next_poll <= now]
+                for tracked in due:
+                    tracked.in_flight = True
+
+                pending = [r.next_poll for r in self._runs.values() if not r.in_flight]
+
+            for tracked in due:
+                self._executor.submit(self._check, tracked)
+
+            with self._cond:
+                wait = (min(pending) - time.time()) if pending else RUN_POLL_INITIAL_INTERVAL
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+
+    def _finish(self, tracked):
+        with self._cond:
+            self._runs.pop(tracked.run_id, None)
+
+    def _check(self, tracked):
+        from ai_config import get_provider_client
+
+        try:
+            run = get_provider_client('openai').beta.threads.runs.retrieve(
+                thread_id=tracked.thread_id,
+                run_id=tracked.run_id
+            )
+            tracked.polls += 1
+
+            if run.status == 'completed':
+                self._finish(tracked)
+                logger.debug(f"Run {tracked.run_id} terminée après {tracked.polls} vérification(s)")
+                tracked.future.set_result(run)
+                return
+            if run.status in _FAILED_STATUSES:
+                self._finish(tracked)
+                tracked.future.set_exception(RunFailedError(run))
+                return
+        except Exception as e:
+            # Erreur réseau/API ponctuelle : on réessaie au prochain intervalle
+            logger.warning(f"Vérification de la run {tracked.run_id} échouée: {e}")
+
+        now = time.time()
+        if now > tracked.deadline:
+            self._finish(tracked)
+            logger.error(f"Thread {tracked.thread_id}: Timeout run {tracked.run_id}")
+            tracked.future.set_exception(TimeoutError("OpenAI response timed out"))
+            return
+
+        with self._cond:
+            tracked.interval = min(tracked.interval * RUN_POLL_BACKOFF, RUN_POLL_MAX_INTERVAL)
+            tracked.next_poll = min(now + tracked.interval, tracked.deadline)
+            tracked.in_flight = False
+            self._cond.notify()
+
+
+_poller = RunPoller()
+
+
+def wait_for_run(thread_id, run_id, timeout=120):
+    """
+    Attend la fin d'une run (bloquant, compatible eventlet).
+
+    Returns:
+        La run terminée
+
+    Raises:
+        RunFailedError: si la run échoue
+        TimeoutError: si la run n'est pas terminée après timeout secondes
+    """
+    return _poller.register(thread_id, run_id, timeout).result()
+
+
+async def wait_for_run_async(thread_id, run_id, timeout=120):
+    """Équivalent async de wait_for_run (handlers Telegram)"""
+    return await asyncio.wrap_future(_poller.register(thread_id, run_id, timeout))
+
+
+def get_run_poller_stats():
+    """Retourne l'état du service de suivi des runs"""
+    return _poller.stats()
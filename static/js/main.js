@@ -914,6 +914,37 @@ document.addEventListener('DOMContentLoaded', function () {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     });
 
+    // Phase de réflexion (deepseek-reasoner) : indicateur de progression, jamais stocké comme réponse
+    socket.on('reasoning_stream', function (data) {
+        const streamInfo = activeStreamMessages[data.message_id];
+        // Ignorer si le message est inconnu ou si la réponse a déjà commencé
+        if (!streamInfo || streamInfo.content !== '') {
+            return;
+        }
+
+        streamInfo.reasoning = (streamInfo.reasoning || '') + (data.content || '');
+
+        let reasoningElement = streamInfo.element.querySelector('.stream-reasoning');
+        if (!reasoningElement) {
+            streamInfo.element.innerHTML = `
+                <div class="stream-reasoning">
+                    <div class="stream-reasoning-title"></div>
+                    <div class="stream-reasoning-text"></div>
+                </div>
+            `;
+            reasoningElement = streamInfo.element.querySelector('.stream-reasoning');
+        }
+
+        const seconds = data.elapsed ? ` (${Math.round(data.elapsed)} s)` : '';
+        reasoningElement.querySelector('.stream-reasoning-title').textContent = data.is_final
+            ? `💭 Réflexion terminée${seconds}, rédaction de la réponse…`
+            : `💭 Réflexion en cours…${seconds}`;
+        // N'afficher que la fin du raisonnement
+        reasoningElement.querySelector('.stream-reasoning-text').textContent = streamInfo.reasoning.slice(-300);
+
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+
     // Listen for conversation updates
     socket.on('conversation_updated', function (data) {
         if (data.success) {
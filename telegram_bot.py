@@ -5,6 +5,9 @@ import os
 import logging
 import asyncio
 import time
+import copy
+import atexit
+import threading
 import openai
 import httpx
 from telegram import Update, constants
@@ -21,25 +24,34 @@ import os
 import uuid
 import base64
 import telegram
-from mathpix_utils import process_image_with_mathpix
+from image_cache import ocr_image_cached
 from flask import Blueprint
 from flask import jsonify, request, session
 from models import TelegramUser, User, UserMemory, TelegramConversation, TelegramMessage
 
 # Import de la configuration IA centralisée
 from ai_config import (
-    get_ai_client,
     get_model_name,
     get_system_instructions,
     ASSISTANT_ID,
-    CONTEXT_MESSAGE_LIMIT,
-    openai_client
+    CONTEXT_MESSAGE_LIMIT
 )
 
 from utils import db_retry_session
+import ai_gateway
+from assistant_thread_pool import take_pooled_thread_id
+from run_poller import wait_for_run_async, RunFailedError
+from worker_pool import ShardedWorkerPool
+from durable_queue import (
+    DurableQueueConsumer, JobFailedError, enqueue_job, job_exists, make_job_handler, count_active_jobs,
+    get_lane_depths
+)
+from rate_limiter import get_limiter, BOT_RATE_LIMIT_MESSAGE
 from ai_utils import prepare_messages_for_api, upload_image_to_openai, process_image_for_openai
+from media_fetcher import fetch_media, http_session, default_timeout
+from conversation_summary import get_summary_context, schedule_summary_refresh
 from config import Config
-from subscription_manager import MessageLimitChecker
+from subscription_manager import MessageLimitChecker, SubscriptionManager
 
 from database import db
 
@@ -54,6 +66,102 @@ logger = logging.getLogger(__name__)
 # Store thread IDs for each user
 user_threads = defaultdict(lambda: None)
 
+# ===================================
+# RÉPONSES PROGRESSIVES (STREAMING)
+# ===================================
+
+TELEGRAM_STREAMING = os.environ.get('TELEGRAM_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# Premier envoi dès N caractères reçus, puis une modification au plus toutes les N secondes
+TELEGRAM_STREAM_FIRST_CHARS = int(os.environ.get('TELEGRAM_STREAM_FIRST_CHARS', '40'))
+TELEGRAM_STREAM_EDIT_INTERVAL = float(os.environ.get('TELEGRAM_STREAM_EDIT_INTERVAL', '1.0'))
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_STREAM_INTERRUPTED_NOTE = "⚠️ Réponse interrompue par une erreur, renvoie ta question si elle est incomplète."
+
+
+def _split_telegram_text(text):
+    """Découpe un texte en morceaux de TELEGRAM_MESSAGE_LIMIT caractères max (coupure sur un saut de ligne si possible)"""
+    parts = []
+    while len(text) > TELEGRAM_MESSAGE_LIMIT:
+        cut = text.rfind('\n', 0, TELEGRAM_MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = TELEGRAM_MESSAGE_LIMIT
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+class TelegramStreamReply:
+    """
+    Affiche une réponse au fil de la génération : un premier message dès
+    TELEGRAM_STREAM_FIRST_CHARS caractères, puis des edit_message_text limités à
+    un toutes les TELEGRAM_STREAM_EDIT_INTERVAL secondes, et une dernière
+    modification avec le texte final. Au-delà de 4096 caractères, la suite
+    part dans un nouveau message.
+    """
+
+    def __init__(self, user_message):
+        self.user_message = user_message
+        self.text = ""
+        self._sent = []  # Messages Telegram envoyés, un par morceau de 4096 caractères
+        self._shown = []  # Texte actuellement affiché dans chaque message
+        self._last_edit = 0.0
+
+    @property
+    def started(self):
+        return bool(self._sent)
+
+    async def add(self, content):
+        """Ajoute un fragment et met à jour l'affichage si le rythme le permet"""
+        self.text += content
+        if not self._sent:
+            if len(self.text.strip()) >= TELEGRAM_STREAM_FIRST_CHARS:
+                await self._render(self.text)
+        elif time.time() - self._last_edit >= TELEGRAM_STREAM_EDIT_INTERVAL:
+            await self._render(self.text)
+
+    async def finish(self, final_text):
+        """Affiche le texte final (envoi normal si rien n'a encore été affiché)"""
+        await self._render(final_text, final=True)
+
+        # Texte final plus court que le texte diffusé : les messages en trop sont retirés
+        keep = len(_split_telegram_text(final_text))
+        for message in self._sent[keep:]:
+            try:
+                await message.delete()
+            except telegram.error.TelegramError as e:
+                logger.warning(f"Suppression d'un morceau de réponse diffusée impossible: {e}")
+        del self._sent[keep:]
+        del self._shown[keep:]
+
+    async def _render(self, text, final=False):
+        parts = _split_telegram_text(text)
+        self._last_edit = time.time()
+        for index, part in enumerate(parts):
+            if not part.strip():
+                continue
+            # Pendant le flux, un morceau non terminé est suivi d'un indicateur
+            shown = part if final or index < len(parts) - 1 else f"{part} ▌"
+            try:
+                if index < len(self._sent):
+                    if self._shown[index] != shown:
+                        await self._sent[index].edit_text(shown)
+                        self._shown[index] = shown
+                else:
+                    self._sent.append(await self.user_message.reply_text(shown))
+                    self._shown.append(shown)
+            except telegram.error.RetryAfter as e:
+                # Limite de Telegram atteinte : prochaine modification après le délai demandé
+                self._last_edit = time.time() + e.retry_after
+                if final:
+                    await asyncio.sleep(e.retry_after)
+                    return await self._render(text, final)
+                return
+            except telegram.error.BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+
+
 async def get_or_create_telegram_user(user_id: int, first_name: str = None, last_name: str = None):
     """Get or create a TelegramUser record with name information.
 
@@ -166,7 +274,7 @@ async def create_telegram_conversation(user_id: int, thread_id: str) -> Telegram
         logger.error(f"Error in create_telegram_conversation: {str(e)}", exc_info=True)
         raise
 
-async def add_telegram_message(conversation_id: int, role: str, content: str, image_url: str = None):
+async def add_telegram_message(conversation_id: int, role: str, content: str, image_url: str = None, update_id: int = None):
     """Add a new message to a conversation."""
     try:
         with db_retry_session() as session:
@@ -175,7 +283,8 @@ async def add_telegram_message(conversation_id: int, role: str, content: str, im
                 conversation_id=conversation_id,
                 role=role,
                 content=content,
-                image_url=image_url
+                image_url=image_url,
+                update_id=update_id
             )
             session.add(message)
             session.commit()
@@ -184,6 +293,55 @@ async def add_telegram_message(conversation_id: int, role: str, content: str, im
         logger.error(f"Error in add_telegram_message: {str(e)}", exc_info=True)
         raise
 
+async def get_update_messages(update_id):
+    """Messages déjà enregistrés pour un update (nouvelle tentative de la file durable) : {rôle: contenu}"""
+    if update_id is None:
+        return {}
+    with db_retry_session() as session:
+        rows = TelegramMessage.query.filter_by(update_id=update_id).order_by(TelegramMessage.id).all()
+        return {row.role: row.content for row in rows}
+
+
+def _check_message_limit(web_user_id, already_charged):
+    """Quota de l'élève ; une nouvelle tentative du même update n'est pas décomptée une seconde fois"""
+    if already_charged:
+        status, error_msg, warning_count, _ = SubscriptionManager.can_send_message(web_user_id)
+        return status, error_msg, warning_count
+    return MessageLimitChecker.check_and_increment(web_user_id)
+
+
+async def _resend_stored_reply(update, content):
+    """Réponse déjà générée et enregistrée lors d'une tentative précédente : renvoi sans nouvelle génération"""
+    logger.info(f"Update {update.update_id}: réponse déjà enregistrée, renvoi sans génération")
+    try:
+        for part in _split_telegram_text(content):
+            await update.message.reply_text(part)
+    except Exception as e:
+        logger.error(f"Échec du renvoi de la réponse de l'update {update.update_id}: {e}", exc_info=True)
+        _signal_update_failure(update, e)
+
+
+async def _keep_typing(bot, chat_id, interval=4):
+    """
+    Renvoie l'action "écrit..." (expire après ~5 s côté Telegram) jusqu'à l'annulation
+    de la tâche : signal de progression pendant la réflexion du modèle, avant le premier token.
+    """
+    while True:
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
+        except Exception as e:
+            logger.warning(f"Impossible d'envoyer l'action de chat pendant la génération: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+async def _thread_awaits_reply(thread_id):
+    """Le dernier message du thread Assistant est celui de l'élève : déjà posté par une tentative précédente"""
+    messages = await ai_gateway.assistant_request(
+        lambda client: client.beta.threads.messages.list(thread_id=thread_id, order='desc', limit=1)
+    )
+    return bool(messages.data) and messages.data[0].role == 'user'
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     user_id = update.effective_user.id
@@ -201,12 +359,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if not existing_conversation:
                 # Create a new thread for the user
-                thread = openai_client.beta.threads.create()
-                user_threads[user_id] = thread.id
-                logger.info(f"Created new thread {thread.id} for user {user_id}")
+                thread_id = take_pooled_thread_id() or (await ai_gateway.assistant_request(lambda client: client.beta.threads.create())).id
+                user_threads[user_id] = thread_id
+                logger.info(f"Created new thread {thread_id} for user {user_id}")
 
                 # Create a new conversation in our database
-                await create_telegram_conversation(user_id, thread.id)
+                await create_telegram_conversation(user_id, thread_id)
             else:
                 # Use existing conversation
                 user_threads[user_id] = existing_conversation.thread_id
@@ -264,9 +422,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
          logger.warning("Received empty text message after checking for photo. Ignoring.")
          return
 
+    # Nouvelle tentative de la file durable : rien n'est réenregistré ni décompté deux fois
+    previous = await get_update_messages(update.update_id)
+    if 'assistant' in previous:
+        await _resend_stored_reply(update, previous['assistant'])
+        return
+    already_saved = 'user' in previous
+
     # conversation = None # On n'a plus besoin de l'objet conversation en dehors du bloc session initial
     thread_id = None
     assistant_message = None
+    stream_reply = None # Réponse progressive (modèles Chat Completion, TELEGRAM_STREAMING)
+    ai_failed = False # Échec de génération : l'update est retenté par la file durable
     conversation_id_value = None # <<< NOUVEAU: Variable pour stocker l'ID de la conversation
     conversation_title_to_update = None # Variable temporaire pour savoir si le titre doit être MAJ
 
@@ -305,8 +472,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 # No existing conversation, create a new one
                 if CURRENT_MODEL == 'openai':
-                    thread = openai_client.beta.threads.create()
-                    thread_id = thread.id
+                    thread_id = take_pooled_thread_id() or (await ai_gateway.assistant_request(lambda client: client.beta.threads.create())).id
                 else:
                     thread_id = f"thread_{user_id}_{int(time.time())}"
 
@@ -325,7 +491,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
              raise Exception("Failed to obtain a valid conversation ID.")
 
         # Ajouter le message utilisateur en utilisant l'ID sauvegardé
-        await add_telegram_message(conversation_id_value, 'user', message_text) # <<< Utilise conversation_id_value
+        if not already_saved:
+            await add_telegram_message(conversation_id_value, 'user', message_text, update_id=update.update_id)
 
         # Mettre à jour le titre si c'était une nouvelle conversation
         # On doit re-requêter la conversation dans une nouvelle session pour la modifier
@@ -381,7 +548,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if web_user:
                 # 🔒 VÉRIFICATION DES LIMITES
                 logger.info(f"[TELEGRAM LIMIT CHECK] Vérification pour user web ID {web_user.id} (Telegram {user_id})")
-                status, error_msg, warning_count = MessageLimitChecker.check_and_increment(web_user.id)
+                status, error_msg, warning_count = _check_message_limit(web_user.id, already_saved)
                 logger.info(f"[TELEGRAM LIMIT CHECK] Résultat: status={status}, warning_count={warning_count}")
 
                 # CAS 1 : BLOQUÉ - Limite atteinte après 6 warnings
@@ -444,7 +611,8 @@ IMPORTANT :
                     )
 
         base_instructions = get_system_instructions()
-        final_system_prompt = system_warning_message + memory_context + base_instructions
+        system_context = system_warning_message + memory_context
+        final_system_prompt = system_context + base_instructions
         # === FIN : LECTURE MÉMOIRE + VÉRIFICATION LIMITES (TELEGRAM) ===
 
         from ai_config import CURRENT_MODEL
@@ -460,20 +628,22 @@ IMPORTANT :
                 # Add user message to the OpenAI thread
                 # On injecte le contexte directement dans le message utilisateur pour les Assistants
                 user_message_with_context = final_system_prompt + "\n\n---\n\n" + message_text
-                openai_client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="user",
-                    content=user_message_with_context
-                )
+                if not (already_saved and await _thread_awaits_reply(thread_id)):
+                    await ai_gateway.assistant_request(lambda client: client.beta.threads.messages.create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=user_message_with_context
+                    ))
                 # Create and run the assistant
-                run = openai_client.beta.threads.runs.create(
+                run = await ai_gateway.assistant_request(lambda client: client.beta.threads.runs.create(
                     thread_id=thread_id,
                     assistant_id=ASSISTANT_ID
-                )
-                # Wait for run completion
-                while True:
+                ))
+                # Wait for run completion (suivi partagé, voir run_poller)
+                run_done = asyncio.ensure_future(wait_for_run_async(thread_id, run.id))
+                while not run_done.done():
                     try:
-                        # Vérifier et réparer la boucle d'événements avant chaque itération
+                        # L'indicateur "écrit..." expire après ~5 s côté Telegram
                         await context.bot.send_chat_action(
                             chat_id=update.effective_chat.id,
                             action=constants.ChatAction.TYPING
@@ -482,22 +652,19 @@ IMPORTANT :
                         logger.warning(f"Impossible d'envoyer l'action de chat dans la boucle: {str(e)}")
                         # Continuer sans action de chat
                         pass
+                    await asyncio.wait({run_done}, timeout=4)
 
-                    run_status = openai_client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=run.id
-                    )
-                    if run_status.status == 'completed':
-                        logger.info("Assistant run completed")
-                        break
-                    elif run_status.status in ['failed', 'cancelled', 'expired']:
-                        error_msg = f"Assistant run failed with status: {run_status.status}"
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
-                    await asyncio.sleep(1)
+                try:
+                    run_done.result()
+                    logger.info("Assistant run completed")
+                except RunFailedError as e:
+                    logger.error(f"Assistant run failed with status: {e.run.status}")
+                    raise
 
                 # Retrieve the latest message from the assistant
-                messages = openai_client.beta.threads.messages.list(thread_id=thread_id, order='desc', limit=1)
+                messages = await ai_gateway.assistant_request(
+                    lambda client: client.beta.threads.messages.list(thread_id=thread_id, order='desc', limit=1)
+                )
                 if messages.data and messages.data[0].role == 'assistant' and messages.data[0].content[0].type == 'text':
                     assistant_message = messages.data[0].content[0].text.value
                 else:
@@ -507,9 +674,11 @@ IMPORTANT :
             except OpenAIError as e:
                  logger.error(f"OpenAI API error during Assistant processing: {str(e)}", exc_info=True)
                  assistant_message = "I'm having trouble connecting to my AI brain (Assistant API). Please try again."
+                 ai_failed = True
             except Exception as e:
                  logger.error(f"Unexpected error during OpenAI Assistant processing: {str(e)}", exc_info=True)
                  assistant_message = "An unexpected error occurred while communicating with the AI assistant."
+                 ai_failed = True
 
 
         elif CURRENT_MODEL in ['deepseek', 'deepseek-reasoner', 'qwen', 'gemini']:
@@ -538,24 +707,50 @@ IMPORTANT :
                     if user_store_content:
                         messages_history.append({"role": "user", "content": user_store_content})
 
-                # Appel à la fonction centralisée
-                from ai_utils import execute_chat_completion
+                # Appel à la fonction centralisée (async, via la passerelle IA)
+                from ai_utils import execute_chat_completion_async
+
+                # Les messages au-delà de CONTEXT_MESSAGE_LIMIT sont remplacés par le résumé glissant
+                with db_retry_session() as sess:
+                    summary_context = get_summary_context('telegram', conversation_id_value)
 
-                # On injecte le prompt système dans l'historique avant l'appel
-                if final_system_prompt:
-                    messages_history.insert(0, {"role": "system", "content": final_system_prompt})
+                # Résumé, avertissement et mémoire précèdent les instructions du modèle
+                # retenu par le routeur (qui peut différer de CURRENT_MODEL)
+                system_context = summary_context + system_context
 
-                assistant_message = execute_chat_completion(
-                    messages_history=messages_history,
-                    current_model=CURRENT_MODEL,
-                    stream=False,
-                    add_system_instructions=False # Important pour éviter le doublon
-                )
+                # "écrit..." maintenu pendant la réflexion (deepseek-reasoner : parfois plus d'une minute)
+                typing = asyncio.ensure_future(_keep_typing(context.bot, update.effective_chat.id))
+                try:
+                    if TELEGRAM_STREAMING:
+                        # Réponse affichée au fil de la génération (premier message puis modifications)
+                        from ai_utils import stream_chat_completion_async
+                        stream_reply = TelegramStreamReply(update.message)
+                        async for content in stream_chat_completion_async(
+                            messages_history=messages_history,
+                            current_model=CURRENT_MODEL,
+                            platform='telegram',
+                            system_context=system_context
+                        ):
+                            await stream_reply.add(content)
+                            if stream_reply.started:
+                                typing.cancel()  # La réponse s'affiche : l'indicateur n'est plus utile
+                        assistant_message = stream_reply.text
+                    else:
+                        assistant_message = await execute_chat_completion_async(
+                            messages_history=messages_history,
+                            current_model=CURRENT_MODEL,
+                            stream=False,
+                            platform='telegram',
+                            system_context=system_context
+                        )
+                finally:
+                    typing.cancel()
                 logger.info(f"Réponse complète reçue de {CURRENT_MODEL}")
 
             except Exception as e:
                 logger.error(f"Error during {CURRENT_MODEL} processing: {str(e)}", exc_info=True)
                 assistant_message = f"An unexpected error occurred while communicating with the {CURRENT_MODEL} AI."
+                ai_failed = True
 
 
         else:
@@ -568,8 +763,17 @@ IMPORTANT :
         logger.error(f"Error before AI processing (user/conversation handling): {str(e)}", exc_info=True)
         # Assign error message here as well
         assistant_message = "I apologize, but I encountered an error processing your request before contacting the AI. Please try again."
+        ai_failed = True
 
     # --- Final Sending and Storage ---
+    if ai_failed and not (stream_reply is not None and stream_reply.text):
+        # Rien n'a été affiché : nouvelle tentative de l'update (message d'excuse si abandon)
+        _signal_update_failure(update, assistant_message)
+        return
+    if ai_failed:
+        # Flux interrompu : la partie déjà affichée est conservée, suivie d'une mention de l'erreur
+        assistant_message = f"{stream_reply.text.rstrip()}\n\n{TELEGRAM_STREAM_INTERRUPTED_NOTE}"
+
     if assistant_message is None:
         logger.error("Assistant message is None after all processing attempts. Assigning generic error.")
         assistant_message = "Sorry, an unknown error occurred while generating the response."
@@ -577,7 +781,8 @@ IMPORTANT :
     # Store the final assistant's response (or error message)
     try:
         if conversation_id_value: # Vérifie qu'on a bien un ID
-            await add_telegram_message(conversation_id_value, 'assistant', assistant_message) # <<< Utilise conversation_id_value
+            await add_telegram_message(conversation_id_value, 'assistant', assistant_message, update_id=update.update_id)
+            schedule_summary_refresh('telegram', conversation_id_value)
         else:
              logger.error("Cannot save assistant message because conversation_id_value is None.")
     except Exception as db_error:
@@ -587,9 +792,14 @@ IMPORTANT :
     # Send the final response (or error message) to the user
     try:
         logger.info(f"Sending final response/error to user {user_id}: {assistant_message[:100]}...")
-        await update.message.reply_text(assistant_message)
+        if stream_reply is not None:
+            # Dernière modification du message affiché progressivement (ou envoi normal)
+            await stream_reply.finish(assistant_message)
+        else:
+            await update.message.reply_text(assistant_message)
     except Exception as send_error:
         logger.error(f"Failed to send final message to user {user_id}: {send_error}", exc_info=True)
+        _signal_update_failure(update, send_error)
 
 # Crée un Blueprint pour les routes admin spécifiques à Telegram
 telegram_admin_bp = Blueprint('telegram_admin', __name__, url_prefix='/admin/telegram')
@@ -661,7 +871,7 @@ async def send_admin_telegram_message(conversation_id):
         try:
             logger.info(f"Préparation de l'envoi async Telegram vers chat_id: {user_chat_id}")
             # Utiliser await directement car la fonction de route est maintenant async
-            await application.bot.send_message(chat_id=user_chat_id, text=message_content)
+            await run_on_telegram_loop(application.bot.send_message(chat_id=user_chat_id, text=message_content))
             logger.info(f"Message admin envoyé avec succès à chat_id {user_chat_id}")
             success = True # L'envoi a réussi si aucune exception n'est levée
 
@@ -756,7 +966,6 @@ async def trigger_ai_as_user_telegram(conversation_id):
             # Récupérer la configuration AI directement depuis les imports
             from ai_config import (
                 CURRENT_MODEL, 
-                get_ai_client, 
                 get_model_name, 
                 get_system_instructions
             )
@@ -785,8 +994,7 @@ async def trigger_ai_as_user_telegram(conversation_id):
                  if system_instructions:
                      history_for_api.insert(0, {"role": "system", "content": system_instructions})
 
-            # Appeler l'API IA appropriée
-            ai_client = get_ai_client()
+            # Appeler l'API IA appropriée (via la passerelle async)
             model_name = get_model_name() # Peut être None pour OpenAI Assistant
 
             if CURRENT_MODEL == 'openai':
@@ -796,20 +1004,18 @@ async def trigger_ai_as_user_telegram(conversation_id):
                  if not openai_thread_id:
                       raise ValueError("Missing OpenAI thread_id for this Telegram conversation.")
 
-                 openai_client.beta.threads.messages.create(
+                 await ai_gateway.assistant_request(lambda client: client.beta.threads.messages.create(
                     thread_id=openai_thread_id, role="user", content=admin_message_content
-                 )
-                 run = openai_client.beta.threads.runs.create(
+                 ))
+                 run = await ai_gateway.assistant_request(lambda client: client.beta.threads.runs.create(
                     thread_id=openai_thread_id, assistant_id=ASSISTANT_ID
+                 ))
+                 # Attente via le suivi partagé des runs
+                 await wait_for_run_async(openai_thread_id, run.id)
+
+                 messages_openai = await ai_gateway.assistant_request(
+                     lambda client: client.beta.threads.messages.list(thread_id=openai_thread_id, order='desc', limit=1)
                  )
-                 # Boucle d'attente (peut nécessiter adaptation pour async/eventlet)
-                 while True:
-                      run_status = openai_client.beta.threads.runs.retrieve(thread_id=openai_thread_id, run_id=run.id)
-                      if run_status.status == 'completed': break
-                      if run_status.status in ['failed', 'cancelled', 'expired']: raise Exception(f"OpenAI Run {run.id} failed: {run_status.status}")
-                      await asyncio.sleep(1) # Utiliser asyncio.sleep dans une route async
-
-                 messages_openai = openai_client.beta.threads.messages.list(thread_id=openai_thread_id, order='desc', limit=1)
                  if messages_openai.data and messages_openai.data[0].role == 'assistant':
                      ai_response_text = messages_openai.data[0].content[0].text.value
                  else:
@@ -817,10 +1023,7 @@ async def trigger_ai_as_user_telegram(conversation_id):
 
             else: # Modèles Chat Completion
                  if not model_name: raise ValueError("Model name is required for Chat Completions.")
-                 response = ai_client.chat.completions.create(
-                     model=model_name,
-                     messages=history_for_api
-                 )
+                 response = await ai_gateway.chat_completion(CURRENT_MODEL, model_name, history_for_api)
                  ai_response_text = response.choices[0].message.content
 
             logger.info(f"Réponse IA générée pour déclenchement admin (conv Telegram {conversation_id}): '{ai_response_text[:50]}...'")
@@ -833,7 +1036,7 @@ async def trigger_ai_as_user_telegram(conversation_id):
         try:
             logger.info(f"Envoi async de la réponse IA déclenchée par admin à chat_id {user_chat_id}")
             # Utilisation directe de await car la route est async
-            await application.bot.send_message(chat_id=user_chat_id, text=ai_response_text)
+            await run_on_telegram_loop(application.bot.send_message(chat_id=user_chat_id, text=ai_response_text))
             logger.info(f"Réponse IA envoyée avec succès à chat_id {user_chat_id}")
         except Exception as send_error:
             logger.error(f"Erreur lors de l'envoi Telegram de la réponse IA (déclenchée par admin) à {user_chat_id}: {send_error}", exc_info=True)
@@ -896,8 +1099,8 @@ def get_file_direct(bot, file_id):
     file_url = f"https://api.telegram.org/bot{bot.token}/getFile"
 
     try:
-        # Utiliser requests (qui sera patché par eventlet)
-        response = requests.post(file_url, data={"file_id": file_id}, timeout=30)
+        # Session HTTP partagée (keep-alive), patchée par eventlet
+        response = http_session().post(file_url, data={"file_id": file_id}, timeout=default_timeout())
         response.raise_for_status()
 
         # Extraire le chemin du fichier de la réponse
@@ -951,6 +1154,13 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     thread_id = None
 
     try:
+        # Nouvelle tentative de la file durable : rien n'est réenregistré ni décompté deux fois
+        previous = await get_update_messages(update.update_id)
+        if 'assistant' in previous:
+            await _resend_stored_reply(update, previous['assistant'])
+            return
+        already_saved = 'user' in previous
+
         # Get or create user first
         user, _ = await get_or_create_telegram_user(user_id, first_name, last_name)
         logger.info(f"User {user_id} retrieved/created successfully")
@@ -967,7 +1177,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if web_user:
                 logger.info(f"[TELEGRAM PHOTO LIMIT CHECK] User web ID {web_user.id} trouvé")
-                status, error_msg, warning_count = MessageLimitChecker.check_and_increment(web_user.id)
+                status, error_msg, warning_count = _check_message_limit(web_user.id, already_saved)
                 logger.info(f"[TELEGRAM PHOTO LIMIT CHECK] Résultat: status={status}, warning_count={warning_count}")
 
                 # CAS 1 : BLOQUÉ
@@ -1046,8 +1256,7 @@ IMPORTANT :
                 else:
                     # Aucune conversation existante trouvée, créer une nouvelle
                     if CURRENT_MODEL == 'openai':
-                        thread = openai_client.beta.threads.create()
-                        thread_id = thread.id
+                        thread_id = take_pooled_thread_id() or (await ai_gateway.assistant_request(lambda client: client.beta.threads.create())).id
                     else:
                         # Pour les autres modèles, créer un ID de thread unique
                         thread_id = f"thread_{user_id}_{int(time.time())}"
@@ -1077,7 +1286,6 @@ IMPORTANT :
             pass
 
         # Variables pour la nouvelle logique
-        file_path_local = None
         openai_file_id = None
         user_store_content = None
         assistant_message = None
@@ -1085,27 +1293,14 @@ IMPORTANT :
         complete_file_url = ""
 
         try:
-            # 1. Obtenir le fichier depuis Telegram et le télécharger en mémoire (bytes)
-            file_tg = get_file_direct(context.bot, update.message.photo[-1].file_id)
-            if not file_tg or not file_tg.file_path:
-                raise Exception("Impossible d'obtenir les informations du fichier depuis Telegram.")
-
-            full_download_url = f"https://api.telegram.org/file/bot{context.bot.token}/{file_tg.file_path}"
-            response = requests.get(full_download_url)
-            response.raise_for_status()  # S'assure que la requête a réussi
-            image_bytes = response.content
-
-            # 2. Sauvegarder l'image localement (nécessaire pour l'upload OpenAI)
-            upload_folder = Config.UPLOAD_FOLDER
-            os.makedirs(upload_folder, exist_ok=True)
-            filename = f"telegram_{uuid.uuid4()}.jpg"
-            file_path_local = os.path.join(upload_folder, filename)
-            with open(file_path_local, 'wb') as f:
-                f.write(image_bytes)
-
-            # 3. Convertir en base64 pour Mathpix
-            base64_image_str = base64.b64encode(image_bytes).decode('utf-8')
-            base64_data_for_mathpix = f"data:image/jpeg;base64,{base64_image_str}"
+            # 1. Obtenir le fichier depuis Telegram et le télécharger en mémoire (tampon borné, sans disque)
+            # Appels HTTP bloquants hors de la boucle Telegram (partagée par tous les chats)
+            file_tg, media = await asyncio.to_thread(
+                fetch_telegram_photo, context.bot, update.message.photo[-1].file_id
+            )
+
+            # 2. Data URL base64 pour Mathpix (l'upload OpenAI utilise directement les octets)
+            base64_data_for_mathpix = media.data_url
 
             # 4. Construire l'URL du fichier pour la sauvegarde en BDD
             complete_file_url = f"https://api.telegram.org/file/bot{context.bot.token}/{file_tg.file_path}"
@@ -1122,11 +1317,13 @@ IMPORTANT :
         if CURRENT_MODEL == 'openai':
             try:
                 # Utiliser la nouvelle fonction de double traitement
-                openai_file_id, message_for_assistant, process_info = process_image_for_openai(
-                    file_path_local,
+                openai_file_id, message_for_assistant, process_info = await asyncio.to_thread(
+                    process_image_for_openai,
+                    None,
                     base64_data_for_mathpix,
                     caption,
-                    platform="Telegram"
+                    platform="Telegram",
+                    image_bytes=media.content
                 )
                 user_store_content = message_for_assistant
                 logger.info("Traitement double approche (Vision+OCR) pour Telegram réussi.")
@@ -1136,7 +1333,7 @@ IMPORTANT :
                 return
         else:
             # Pour les autres modèles, utiliser Mathpix uniquement
-            mathpix_result = process_image_with_mathpix(base64_data_for_mathpix)
+            mathpix_result = await asyncio.to_thread(ocr_image_cached, base64_data_for_mathpix, media.content)
             formatted_summary = "L'extraction du contenu de l'image a échoué."
             if "error" not in mathpix_result:
                 formatted_summary = mathpix_result.get("formatted_summary", "")
@@ -1169,16 +1366,6 @@ IMPORTANT :
             logger.error(f"Error updating conversation title: {str(title_err)}")
             # Continue despite title update error
 
-        # Store the user's message in our database
-        try:
-            if conversation_id:
-                # Construire l'URL complète pour stocker en base de données
-                complete_file_url = f"https://api.telegram.org/file/bot{context.bot.token}/{file_tg.file_path}"
-                await add_telegram_message(conversation_id, 'user', user_store_content, complete_file_url)
-        except Exception as msg_err:
-            logger.error(f"Error storing user message: {str(msg_err)}", exc_info=True)
-            # Continue despite message storage error
-
         # Get the current model configuration dynamically
         from ai_config import CURRENT_MODEL
 
@@ -1187,10 +1374,10 @@ IMPORTANT :
         # Different handling based on selected model
         assistant_message = None
 
-        # Sauvegarder le message utilisateur (avec contenu extrait) en BDD
+        # Sauvegarder le message utilisateur (avec contenu extrait) en BDD, une seule fois par update
         try:
-            if conversation_id:
-                await add_telegram_message(conversation_id, 'user', user_store_content, complete_file_url)
+            if conversation_id and not already_saved:
+                await add_telegram_message(conversation_id, 'user', user_store_content, complete_file_url, update_id=update.update_id)
         except Exception as msg_err:
             logger.error(f"Erreur sauvegarde message utilisateur: {str(msg_err)}", exc_info=True)
 
@@ -1208,18 +1395,21 @@ IMPORTANT :
                     message_content = system_warning_message + "\n\n" + user_store_content
 
                 # Envoyer le message composite et lancer la 'run'
-                openai_client.beta.threads.messages.create(thread_id=thread_id, role="user", content=content_items)
-                run = openai_client.beta.threads.runs.create(thread_id=thread_id, assistant_id=ASSISTANT_ID)
+                if not (already_saved and await _thread_awaits_reply(thread_id)):
+                    await ai_gateway.assistant_request(
+                        lambda client: client.beta.threads.messages.create(thread_id=thread_id, role="user", content=content_items)
+                    )
+                run = await ai_gateway.assistant_request(
+                    lambda client: client.beta.threads.runs.create(thread_id=thread_id, assistant_id=ASSISTANT_ID)
+                )
 
                 # Attendre la complétion
-                while True:
-                    run_status = openai_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-                    if run_status.status == 'completed': break
-                    if run_status.status in ['failed', 'cancelled', 'expired']: raise Exception(f"Run {run.id} a échoué avec le statut: {run_status.status}")
-                    await asyncio.sleep(1)
+                await wait_for_run_async(thread_id, run.id)
 
                 # Récupérer la réponse
-                messages = openai_client.beta.threads.messages.list(thread_id=thread_id)
+                messages = await ai_gateway.assistant_request(
+                    lambda client: client.beta.threads.messages.list(thread_id=thread_id)
+                )
                 assistant_message = messages.data[0].content[0].text.value
             except Exception as openai_err:
                 logger.error(f"Error in OpenAI run/retrieve: {str(openai_err)}", exc_info=True)
@@ -1227,7 +1417,6 @@ IMPORTANT :
         else:
             # Logique pour les autres modèles (Gemini, etc.)
             try:
-                ai_client = get_ai_client()
                 model = get_model_name()
 
                 # Récupérer l'historique de la conversation
@@ -1244,7 +1433,11 @@ IMPORTANT :
                     system_instructions=final_system_instructions
                 )
 
-                response = ai_client.chat.completions.create(model=model, messages=api_messages, timeout=90.0)
+                typing = asyncio.ensure_future(_keep_typing(context.bot, update.effective_chat.id))
+                try:
+                    response = await ai_gateway.chat_completion(CURRENT_MODEL, model, api_messages, timeout=90.0)
+                finally:
+                    typing.cancel()
                 assistant_message = response.choices[0].message.content
             except Exception as e:
                 logger.error(f"Error during AI image processing (non-OpenAI): {str(e)}", exc_info=True)
@@ -1253,7 +1446,7 @@ IMPORTANT :
         # Store the assistant's response in our database
         try:
             if conversation_id and assistant_message:
-                await add_telegram_message(conversation_id, 'assistant', assistant_message)
+                await add_telegram_message(conversation_id, 'assistant', assistant_message, update_id=update.update_id)
         except Exception as db_err:
             logger.error(f"Error saving response: {str(db_err)}", exc_info=True)
             # Continue despite saving error
@@ -1287,6 +1480,7 @@ IMPORTANT :
                     )
                 except Exception as e3:
                     logger.error(f"All attempts to send message failed: {str(e3)}", exc_info=True)
+                    _signal_update_failure(update, e3)
         else:
             # Send default error message if no assistant message was generated
             try:
@@ -1304,6 +1498,7 @@ IMPORTANT :
             )
         except Exception as reply_err:
             logger.error(f"Failed to send error message: {str(reply_err)}", exc_info=True)
+            _signal_update_failure(update, e)
 
 async def send_reminder_telegram(telegram_id: int, message: str) -> bool:
     """
@@ -1334,66 +1529,332 @@ async def send_reminder_telegram(telegram_id: int, message: str) -> bool:
         logger.error(f"[RAPPEL TELEGRAM] Erreur envoi à {telegram_id}: {str(e)}")
         return False
 
+# ===================================
+# BOUCLE ASYNCIO TELEGRAM
+# ===================================
+
+TELEGRAM_UPDATE_TIMEOUT = int(os.environ.get('TELEGRAM_UPDATE_TIMEOUT', '600'))
+
+
+class _TelegramLoop:
+    """
+    Boucle asyncio persistante, dans un thread dédié, qui porte l'Application
+    Telegram initialisée une seule fois. Les updates et les appels au bot
+    depuis du code synchrone y sont soumis via run_coroutine_threadsafe.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._started.set()
+        self.loop.run_forever()
+
+    def start(self):
+        """Démarre la boucle et initialise l'Application (idempotent)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._started.clear()
+                self._initialized = False
+                self._thread = threading.Thread(target=self._run, daemon=True, name='telegram-loop')
+                self._thread.start()
+                self._started.wait()
+                atexit.register(self.shutdown)
+
+            if not self._initialized and application:
+                asyncio.run_coroutine_threadsafe(application.initialize(), self.loop).result(timeout=60)
+                self._initialized = True
+                logger.info("Boucle Telegram démarrée, application initialisée.")
+
+    def submit(self, coro):
+        """Planifie une coroutine sur la boucle Telegram, retourne un concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def shutdown(self):
+        """Arrête l'Application puis la boucle (appelé à l'arrêt du processus)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return
+            if self._initialized and application:
+                try:
+                    asyncio.run_coroutine_threadsafe(application.shutdown(), self.loop).result(timeout=10)
+                except Exception as e:
+                    logger.warning(f"Arrêt de l'application Telegram incomplet: {e}")
+                self._initialized = False
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=10)
+            self._thread = None
+            logger.info("Boucle Telegram arrêtée.")
+
+
+_telegram_loop = _TelegramLoop()
+
+
+def start_telegram_loop():
+    """Démarre la boucle Telegram persistante (au lancement de l'application)"""
+    _telegram_loop.start()
+
+
+def run_telegram_coroutine(coro, timeout=TELEGRAM_UPDATE_TIMEOUT):
+    """Exécute une coroutine sur la boucle Telegram depuis du code synchrone et retourne son résultat"""
+    return _telegram_loop.submit(coro).result(timeout=timeout)
+
+
+async def run_on_telegram_loop(coro):
+    """Exécute une coroutine sur la boucle Telegram depuis une autre boucle (routes Flask async)"""
+    try:
+        current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        current_loop = None
+
+    if current_loop is not None and current_loop is _telegram_loop.loop:
+        return await coro
+    return await asyncio.wrap_future(_telegram_loop.submit(coro))
+
+
+# Échecs signalés par les handlers pendant process_update (update_id -> erreur) :
+# python-telegram-bot confie leurs exceptions à error_handler, elles ne remontent pas au worker
+_update_failures = {}
+_update_failures_lock = threading.Lock()
+
+
+def _signal_update_failure(update, error):
+    """Signale que la réponse à cet update n'a pas été produite ou livrée (job à retenter)"""
+    if isinstance(update, Update) and update.update_id is not None:
+        with _update_failures_lock:
+            _update_failures[update.update_id] = error
+
+
 def process_telegram_update(json_data):
-    """Process Telegram update in a separate greenlet."""
+    """
+    Traite un update Telegram sur la boucle persistante (appelé par un worker du pool).
+
+    Raises:
+        JobFailedError: si un handler a signalé un échec (le job est retenté par la file durable)
+    """
     try:
         # Créer un objet Update à partir des données JSON
         update = Update.de_json(json_data, application.bot)
         logger.debug(f"Update deserialized: {update.update_id}")
 
-        # Créer une nouvelle boucle d'événements isolée pour ce traitement
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Le worker attend la fin du traitement : ordre par chat et suivi de la file durable conservés
+        run_telegram_coroutine(application.process_update(update))
+        logger.debug(f"Update {update.update_id} processed.")
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement de l'update Telegram: {e}", exc_info=True)
+        raise
 
-        try:
-            # Initialiser l'application Telegram si nécessaire
-            loop.run_until_complete(application.initialize())
-            logger.debug("telegram_app.initialize() terminé.")
+    with _update_failures_lock:
+        error = _update_failures.pop(update.update_id, None)
+    if error is not None:
+        raise JobFailedError(f"Update {update.update_id} en échec: {error}")
+
+# ===================================
+# FILE DURABLE DES UPDATES
+# ===================================
+
+TELEGRAM_WORKERS = int(os.environ.get('TELEGRAM_WORKERS', '8'))
+# Les jobs attendent en base : file courte pour que l'attente dans le pool (N x durée d'une
+# génération) reste bien inférieure à INBOUND_VISIBILITY_TIMEOUT
+TELEGRAM_QUEUE_SIZE = int(os.environ.get('TELEGRAM_QUEUE_SIZE', '4'))
+# Délestage : updates en attente max par chat et pour l'ensemble des chats
+TELEGRAM_MAX_LANE_DEPTH = int(os.environ.get('TELEGRAM_MAX_LANE_DEPTH', '10'))
+TELEGRAM_MAX_BACKLOG = int(os.environ.get('TELEGRAM_MAX_BACKLOG', '500'))
+TELEGRAM_BUSY_MESSAGE = "Je reçois beaucoup de messages en ce moment 😅 Renvoie ta question dans quelques minutes !"
+# Envoyé quand un update est abandonné après toutes ses tentatives (file durable)
+TELEGRAM_FAILURE_MESSAGE = "Désolé, une erreur s'est produite. Veuillez réessayer."
+# Messages texte arrivant à moins de N secondes d'intervalle : une seule réponse (0 = désactivé)
+TELEGRAM_COALESCE_WINDOW = float(os.environ.get('TELEGRAM_COALESCE_WINDOW', '3'))
+
+
+def _is_mergeable_update(json_data):
+    """Seuls les messages texte (hors commandes) sont fusionnés en rafale"""
+    text = (json_data.get('message') or {}).get('text')
+    return bool(text) and not text.startswith('/')
+
+
+def _merge_update_burst(json_data, followups):
+    """Fusionne le texte d'une rafale dans le dernier update (un seul tour pour handle_message)"""
+    merged = copy.deepcopy(followups[-1])
+    merged['message']['text'] = "\n".join(
+        u['message']['text'] for u in [json_data] + followups
+    )
+    return merged
+
+
+def _notify_telegram_failure(json_data):
+    """Prévient l'élève quand son update est abandonné après toutes ses tentatives"""
+    chat_id = ((json_data.get('message') or {}).get('chat') or {}).get('id')
+    if chat_id is not None:
+        _send_notice(chat_id, TELEGRAM_FAILURE_MESSAGE)
+
+
+# Les updates d'un même chat sont traitées dans l'ordre par le même worker
+_update_pool = ShardedWorkerPool(
+    'telegram',
+    make_job_handler(
+        'telegram',
+        process_telegram_update,
+        merge=_merge_update_burst,
+        can_merge=_is_mergeable_update,
+        coalesce_window=TELEGRAM_COALESCE_WINDOW,
+        on_give_up=_notify_telegram_failure
+    ),
+    num_workers=TELEGRAM_WORKERS,
+    max_queue_size=TELEGRAM_QUEUE_SIZE
+)
+_inbound_consumer = DurableQueueConsumer('telegram', _update_pool)
+# Débit entrant par utilisateur Telegram (seau à jetons)
+_rate_limiter = get_limiter('telegram')
+_backlog = 0
+_backlog_checked_at = 0.0
+_shed_total = 0
+
+
+def _get_update_chat_id(json_data):
+    """Retourne l'ID du chat concerné par un update brut (clé d'ordre de la file)"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        chat = (json_data.get(key) or {}).get('chat') or {}
+        if chat.get('id') is not None:
+            return chat['id']
+    callback_message = (json_data.get('callback_query') or {}).get('message') or {}
+    if (callback_message.get('chat') or {}).get('id') is not None:
+        return callback_message['chat']['id']
+    return f"update_{json_data.get('update_id')}"
+
+
+def _send_notice(chat_id, text):
+    """Envoie une réponse toute faite (API HTTP directe, hors boucle asyncio)"""
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        return
+    try:
+        response = requests.post(
+            f"https://api.telegram.org/bot{token}/sendMessage",
+            data={"chat_id": chat_id, "text": text},
+            timeout=10
+        )
+        response.raise_for_status()
+    except Exception as e:
+        logger.error(f"Erreur envoi réponse toute faite Telegram à {chat_id}: {e}")
 
-            # Traiter l'update
-            loop.run_until_complete(application.process_update(update))
-            logger.debug(f"Update {update.update_id} processed.")
-        except Exception as e:
-            logger.error(f"Erreur lors du traitement de l'update Telegram: {e}", exc_info=True)
-        # Ne fermez pas la boucle ici, cela cause le problème
+
+def _is_overloaded(chat_id):
+    """
+    True si le chat a déjà trop d'updates en attente (TELEGRAM_MAX_LANE_DEPTH)
+    ou si le backlog global dépasse TELEGRAM_MAX_BACKLOG (compté au plus toutes les secondes).
+    """
+    global _backlog_checked_at, _backlog
+    now = time.time()
+    if now - _backlog_checked_at >= 1:
+        _backlog = count_active_jobs('telegram')
+        _backlog_checked_at = now
+    if _backlog >= TELEGRAM_MAX_BACKLOG:
+        return True
+    return count_active_jobs('telegram', chat_id) >= TELEGRAM_MAX_LANE_DEPTH
+
+
+def enqueue_telegram_update(json_data):
+    """
+    Enregistre un update dans la file durable avant la réponse 200 du webhook.
+    Doit être appelé dans un app_context (requête Flask).
+    """
+    global _shed_total
+    update_id = json_data.get('update_id')
+    chat_id = _get_update_chat_id(json_data)
+
+    # Redélivrance d'un update déjà en file : ignorée avant de débiter le quota de l'élève
+    try:
+        if job_exists('telegram', update_id):
+            logger.info(f"Update {update_id} déjà en file, ignoré")
+            return
     except Exception as e:
-        logger.error(f"Erreur générale dans process_telegram_update: {e}", exc_info=True)
+        logger.warning(f"Vérification de doublon impossible pour l'update {update_id}: {e}")
+        db.session.rollback()
+
+    message = json_data.get('message') or {}
+    sender_id = (message.get('from') or {}).get('id')
+    if sender_id is not None and not _rate_limiter.allow(sender_id):
+        # Débit dépassé : pas de génération, réponse toute faite au plus une fois par intervalle
+        if _rate_limiter.should_notify(sender_id):
+            eventlet.spawn(_send_notice, message['chat']['id'], BOT_RATE_LIMIT_MESSAGE)
+        return
+
+    try:
+        if message and _is_overloaded(chat_id):
+            # Délestage : prévenir l'élève plutôt que d'empiler indéfiniment
+            logger.warning(f"Telegram surchargé, update {update_id} du chat {chat_id} refusé")
+            _shed_total += 1
+            eventlet.spawn(_send_notice, message['chat']['id'], TELEGRAM_BUSY_MESSAGE)
+            return
+
+        enqueue_job('telegram', update_id, chat_id, json_data)
+        _inbound_consumer.notify()
+    except Exception as e:
+        # Base indisponible : repli sur le pool en mémoire (non durable, mais borné et ordonné par chat)
+        logger.error(f"File durable indisponible pour l'update {update_id}, repli en mémoire: {e}")
+        db.session.rollback()
+        if not _update_pool.submit(chat_id, {'payload': json_data}) and message:
+            _shed_total += 1
+            eventlet.spawn(_send_notice, message['chat']['id'], TELEGRAM_BUSY_MESSAGE)
+
+
+def get_telegram_queue_stats():
+    """Métriques du pool Telegram, de la file durable et des chats les plus chargés"""
+    return {
+        'pool': _update_pool.stats(),
+        'backlog': count_active_jobs('telegram'),
+        'deepest_lanes': get_lane_depths('telegram'),
+        'shed': _shed_total
+    }
+
+
+@telegram_admin_bp.route('/queue-stats', methods=['GET'])
+def telegram_queue_stats():
+    """Profondeur des files Telegram (pool de workers, file durable par chat) et délestages"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return jsonify(get_telegram_queue_stats())
+
+
+def start_inbound_consumer():
+    """Démarre le consommateur de la file durable (reprise des updates en attente au démarrage)"""
+    _inbound_consumer.start()
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Log Errors caused by Updates."""
+    """Log Errors caused by Updates (the update is retried by the durable queue)."""
     logger.error(f'Update "{update}" caused error "{context.error}"', exc_info=True)
+    _signal_update_failure(update, context.error)
 
-def download_telegram_image_sync(bot, file_path):
+def fetch_telegram_photo(bot, file_id):
     """
-    Télécharge l'image depuis l'URL Telegram de manière synchrone et la convertit en base64.
+    Récupère une photo Telegram en mémoire (getFile puis téléchargement en streaming borné).
 
     Args:
         bot: L'objet Bot de python-telegram-bot (pour accéder au token)
-        file_path: Le chemin du fichier retourné par getFile
+        file_id: L'ID du fichier à récupérer
 
     Returns:
-        Une chaîne base64 de l'image ou None en cas d'erreur
-    """
-    import requests
-    import base64
+        tuple: (File Telegram, FetchedMedia)
 
-    try:
-        # Construire l'URL complète pour accéder au fichier
-        # Format: https://api.telegram.org/file/bot{TOKEN}/{file_path}
-        complete_file_url = f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
-        logger.info(f"Downloading file from URL: {complete_file_url}")
-
-        # Utiliser requests (qui sera patché par eventlet)
-        response = requests.get(complete_file_url, timeout=30)
-        response.raise_for_status()
-
-        # Conversion en base64
-        image_data = response.content
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-        return f"data:image/jpeg;base64,{base64_image}"
-    except Exception as e:
-        logger.error(f"Error downloading image: {str(e)}", exc_info=True)
-        return None
+    Raises:
+        Exception: si le fichier est introuvable, trop volumineux ou le téléchargement échoue
+    """
+    file_tg = get_file_direct(bot, file_id)
+    if not file_tg or not file_tg.file_path:
+        raise Exception("Impossible d'obtenir les informations du fichier depuis Telegram.")
+
+    download_url = f"https://api.telegram.org/file/bot{bot.token}/{file_tg.file_path}"
+    media = fetch_media(download_url, filename=f"telegram_{uuid.uuid4()}.jpg")
+    logger.info(f"Photo Telegram récupérée en mémoire ({media.size} octets)")
+    return file_tg, media
 
 def setup_telegram_bot():
     """Initialize and setup the Telegram bot."""
@@ -0,0 +1,172 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import shutil
+import tempfile
+
+import utils
+from config import Config
+from utils import cleanup_uploads
+
+
+class _UploadFolder:
+    """Dossier d'upload temporaire, Config modifiée le temps du test"""
+
+    def __init__(self, max_size=10 * 1024, budget=10):
+        self.overrides = {'UPLOAD_FOLDER': None, 'MAX_UPLOAD_FOLDER_SIZE': max_size,
+                          'IMAGE_MAX_AGE_HOURS': 24, 'UPLOAD_CLEANUP_TIME_BUDGET': budget}
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='uploads_')
+        self.overrides['UPLOAD_FOLDER'] = self.path
+        self.saved = {name: getattr(Config, name) for name in self.overrides}
+        for name, value in self.overrides.items():
+            setattr(Config, name, value)
+        utils._cleanup_resume.update(directories=None, resume_from=None, candidates=None, total_size=0)
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(Config, name, value)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def add(self, relative_path, size=100, age_hours=0):
+        path = os.path.join(self.path, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * size)
+        mtime = time.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+
+def test_age_based_removal():
+    """Les fichiers trop anciens sont supprimés, sous-dossiers compris, sauf lessons/"""
+    print("🧪 TEST SUPPRESSION PAR ÂGE")
+    print("=" * 60)
+
+    with _UploadFolder() as folder:
+        old = folder.add('old.jpg', age_hours=48)
+        old_nested = folder.add('audio/old.ogg', age_hours=48)
+        lesson = folder.add('lessons/cours.jpg', age_hours=48)
+        recent = folder.add('recent.jpg', age_hours=1)
+
+        stats = cleanup_uploads()
+        print(f"   • Statistiques: {stats}")
+        assert stats['complete'] and stats['removed_files'] == 2
+        assert not os.path.exists(old) and not os.path.exists(old_nested)
+        assert os.path.exists(lesson) and os.path.exists(recent)
+    print("   ✅ Anciens fichiers supprimés, images de cours conservées")
+    return True
+
+
+def test_size_based_eviction():
+    """Au-delà de MAX_UPLOAD_FOLDER_SIZE, les fichiers les plus anciens partent d'abord"""
+    print("🧪 TEST SUPPRESSION PAR TAILLE")
+    print("=" * 60)
+
+    with _UploadFolder(max_size=250) as folder:
+        paths = [folder.add(f"img_{i}.jpg", size=100, age_hours=5 - i) for i in range(5)]
+
+        stats = cleanup_uploads()
+        print(f"   • Statistiques: {stats}")
+        assert stats['total_bytes'] <= 250
+        assert [os.path.exists(p) for p in paths] == [False, False, False, True, True]
+    print("   ✅ Les trois plus anciens supprimés")
+    return True
+
+
+def test_interrupted_scan_resumes():
+    """Un parcours interrompu par le budget reprend au passage suivant"""
+    print("🧪 TEST REPRISE DU PARCOURS")
+    print("=" * 60)
+
+    with _UploadFolder(budget=0) as folder:
+        paths = [folder.add(f"old_{i}.jpg", age_hours=48) for i in range(5)]
+
+        stats = cleanup_uploads()
+        assert not stats['complete']
+        assert utils._cleanup_resume['directories'] is not None
+        print(f"   • Passage 1 interrompu: reprise à {utils._cleanup_resume['resume_from']}")
+
+        Config.UPLOAD_CLEANUP_TIME_BUDGET = 10
+        stats = cleanup_uploads()
+        assert stats['complete']
+        assert utils._cleanup_resume['directories'] is None
+        assert not any(os.path.exists(p) for p in paths)
+    print("   ✅ Passage 2 terminé depuis le point de reprise")
+    return True
+
+
+def test_size_total_carried_across_passes():
+    """La taille comptée avant l'interruption s'ajoute à celle du passage suivant"""
+    print("🧪 TEST TAILLE CUMULÉE ENTRE PASSAGES")
+    print("=" * 60)
+
+    class _StepClock:
+        """Horloge qui avance d'une seconde à chaque lecture : budget atteint après quelques fichiers"""
+
+        def __init__(self):
+            self.now = 0
+
+        def __call__(self):
+            self.now += 1
+            return self.now
+
+    with _UploadFolder(max_size=450, budget=4) as folder:
+        paths = [folder.add(f"img_{i}.jpg", size=100, age_hours=5 - i) for i in range(5)]
+
+        monotonic = time.monotonic
+        time.monotonic = _StepClock()
+        try:
+            stats = cleanup_uploads()
+        finally:
+            time.monotonic = monotonic
+        print(f"   • Passage 1: {stats['scanned_files']} fichier(s) parcouru(s), {stats['total_bytes']} octets")
+        assert not stats['complete'] and stats['removed_files'] == 0
+        assert 0 < stats['scanned_files'] < len(paths)
+
+        Config.UPLOAD_CLEANUP_TIME_BUDGET = 10
+        stats = cleanup_uploads()
+        print(f"   • Passage 2: {stats}")
+        assert stats['complete'] and stats['total_bytes'] == 400
+        assert [os.path.exists(p) for p in paths] == [False, True, True, True, True]
+        assert utils._cleanup_resume['candidates'] is None
+    print("   ✅ Limite appliquée sur la taille de tout le parcours")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du nettoyage des uploads"""
+    print("🚀 TESTS DU NETTOYAGE DES UPLOADS")
+    print("=" * 70)
+
+    tests = [
+        ("Suppression par âge", test_age_based_removal),
+        ("Suppression par taille", test_size_based_eviction),
+        ("Reprise du parcours", test_interrupted_scan_resumes),
+        ("Taille cumulée entre passages", test_size_total_carried_across_passes),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
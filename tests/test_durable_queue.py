@@ -0,0 +1,296 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uuid
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import InboundJob
+from durable_queue import (
+    enqueue_job, job_exists, claim_jobs, complete_job, release_job, make_job_handler,
+    JobFailedError, INBOUND_MAX_ATTEMPTS
+)
+
+# Plateforme dédiée : les tests ne touchent pas aux files WhatsApp/Telegram réelles
+TEST_PLATFORM = 'test_queue'
+
+
+def _cleanup():
+    InboundJob.query.filter_by(platform=TEST_PLATFORM).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _enqueue(conversation_key='conv_1', payload=None):
+    message_id = f"msg_{uuid.uuid4().hex[:12]}"
+    assert enqueue_job(TEST_PLATFORM, message_id, conversation_key, payload or {'text': 'bonjour'})
+    return message_id
+
+
+def _expire_lock(message_id):
+    """Simule un worker arrêté en plein traitement : son verrou a expiré"""
+    InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).update({
+        'locked_until': datetime.utcnow() - timedelta(seconds=1)
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def test_duplicates_rejected():
+    """Un message déjà en file (redélivrance) n'est pas ajouté une seconde fois"""
+    print("🧪 TEST DOUBLONS")
+    print("=" * 60)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            message_id = _enqueue()
+            assert job_exists(TEST_PLATFORM, message_id)
+            assert not job_exists(TEST_PLATFORM, 'msg_inconnu')
+            assert not enqueue_job(TEST_PLATFORM, message_id, 'conv_1', {'text': 'bonjour'})
+            assert InboundJob.query.filter_by(platform=TEST_PLATFORM).count() == 1
+            print("   ✅ Doublon refusé par la clé unique")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_claim_one_job_per_conversation():
+    """Un seul job réclamé par conversation ; le suivant attend la fin du premier"""
+    print("🧪 TEST RÉCLAMATION PAR CONVERSATION")
+    print("=" * 60)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            first = _enqueue('conv_1')
+            second = _enqueue('conv_1')
+            other = _enqueue('conv_2')
+
+            claimed = [job['message_id'] for job in claim_jobs(TEST_PLATFORM)]
+            print(f"   • Première réclamation: {len(claimed)} job(s)")
+            assert claimed == [first, other]
+            assert claim_jobs(TEST_PLATFORM) == []  # Jobs verrouillés, second derrière first
+
+            complete_job(TEST_PLATFORM, first)
+            claimed = [job['message_id'] for job in claim_jobs(TEST_PLATFORM)]
+            assert claimed == [second]
+            print("   ✅ Ordre conservé dans la conversation, conversations en parallèle")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_visibility_timeout():
+    """Un job dont le verrou expire redevient visible ; après INBOUND_MAX_ATTEMPTS il est abandonné"""
+    print("🧪 TEST DÉLAI DE VISIBILITÉ")
+    print("=" * 60)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            message_id = _enqueue('conv_1')
+            follower = _enqueue('conv_1')
+
+            for attempt in range(1, INBOUND_MAX_ATTEMPTS + 1):
+                jobs = claim_jobs(TEST_PLATFORM)
+                assert [job['message_id'] for job in jobs] == [message_id]
+                assert claim_jobs(TEST_PLATFORM) == []  # Invisible tant que le verrou est valide
+                _expire_lock(message_id)
+            print(f"   • Réclamé {INBOUND_MAX_ATTEMPTS} fois après expiration du verrou")
+
+            # Tentatives épuisées : abandonné au tour suivant, la conversation n'est plus bloquée
+            assert claim_jobs(TEST_PLATFORM) == []
+            db.session.expire_all()
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            assert job.status == 'failed'
+            assert [j['message_id'] for j in claim_jobs(TEST_PLATFORM)] == [follower]
+            print("   ✅ Job abandonné, message suivant réclamé")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_release_does_not_count_attempt():
+    """Un job rendu sans traitement (pool saturé) est réclamable sans tentative comptée"""
+    print("🧪 TEST RESTITUTION")
+    print("=" * 60)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            message_id = _enqueue()
+            assert claim_jobs(TEST_PLATFORM)
+            release_job(TEST_PLATFORM, message_id)
+            db.session.expire_all()
+
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            assert job.status == 'pending' and job.attempts == 0
+            assert [j['message_id'] for j in claim_jobs(TEST_PLATFORM)] == [message_id]
+            print("   ✅ Job de nouveau réclamable, tentative non comptée")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_failing_handler_keeps_job_pending():
+    """Un handler en échec laisse le job en attente avec une tentative comptée"""
+    print("🧪 TEST ÉCHEC DU HANDLER (FILE DURABLE)")
+    print("=" * 60)
+
+    def failing_handler(payload):
+        raise JobFailedError("envoi impossible")
+
+    given_up = []
+    run_job = make_job_handler(TEST_PLATFORM, failing_handler, on_give_up=given_up.append)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            message_id = _enqueue()
+            jobs = claim_jobs(TEST_PLATFORM)
+            assert len(jobs) == 1
+
+            run_job(jobs[0])
+            db.session.expire_all()
+
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            print(f"   • Statut: {job.status}, tentatives: {job.attempts}, erreur: {job.last_error}")
+            assert job.status == 'pending'
+            assert job.attempts == 1
+            assert 'envoi impossible' in job.last_error
+            assert job.locked_until > datetime.utcnow()  # Nouvelle tentative différée
+            assert not given_up
+            print("   ✅ Job remis en attente, nouvelle tentative différée")
+
+            # Dernière tentative : abandon et notification de l'utilisateur
+            job.attempts = INBOUND_MAX_ATTEMPTS
+            job.status = 'processing'
+            job.locked_by = jobs[0]['lock']
+            db.session.commit()
+            run_job(jobs[0])
+            db.session.expire_all()
+
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            assert job.status == 'failed'
+            assert given_up == [jobs[0]['payload']]
+            print("   ✅ Job abandonné après la dernière tentative, utilisateur prévenu")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_stale_copy_is_skipped():
+    """Un job réclamé à nouveau après expiration n'est traité et terminé que par la dernière réclamation"""
+    print("🧪 TEST COPIE PÉRIMÉE")
+    print("=" * 60)
+
+    handled = []
+    run_job = make_job_handler(TEST_PLATFORM, handled.append)
+
+    with app.app_context():
+        _cleanup()
+        try:
+            message_id = _enqueue()
+            stale = claim_jobs(TEST_PLATFORM)[0]
+            _expire_lock(message_id)  # Resté trop longtemps dans la file du pool
+            fresh = claim_jobs(TEST_PLATFORM)[0]
+            assert stale['lock'] != fresh['lock']
+
+            run_job(stale)
+            db.session.expire_all()
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            assert handled == [] and job.status == 'processing'
+            assert not complete_job(TEST_PLATFORM, message_id, stale['lock'])
+            print("   • Copie périmée ignorée, verrou conservé par la nouvelle réclamation")
+
+            run_job(fresh)
+            db.session.expire_all()
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=message_id).one()
+            assert handled == [fresh['payload']] and job.status == 'done'
+            print("   ✅ Job traité une seule fois")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_open_burst_is_deferred():
+    """Une rafale encore ouverte rend le job à la file sans attendre ; elle est fusionnée ensuite"""
+    print("🧪 TEST RAFALE DIFFÉRÉE")
+    print("=" * 60)
+
+    handled = []
+    run_job = make_job_handler(
+        TEST_PLATFORM, handled.append,
+        merge=lambda payload, followups: {'text': ' '.join(p['text'] for p in [payload] + followups)},
+        can_merge=lambda payload: True,
+        coalesce_window=5
+    )
+
+    with app.app_context():
+        _cleanup()
+        try:
+            first = _enqueue('conv_1', {'text': 'bonjour'})
+            second = _enqueue('conv_1', {'text': 'tout le monde'})
+
+            run_job(claim_jobs(TEST_PLATFORM)[0])
+            db.session.expire_all()
+            job = InboundJob.query.filter_by(platform=TEST_PLATFORM, message_id=first).one()
+            assert handled == []
+            assert job.status == 'pending' and job.attempts == 0
+            assert job.locked_until > datetime.utcnow()  # Réclamable à la fin de la fenêtre de calme
+            assert claim_jobs(TEST_PLATFORM) == []
+            print("   • Rafale ouverte : job rendu à la file, aucun worker bloqué")
+
+            # Fenêtre de calme écoulée
+            InboundJob.query.filter_by(platform=TEST_PLATFORM).update({
+                'created_at': datetime.utcnow() - timedelta(seconds=10),
+                'locked_until': None
+            }, synchronize_session=False)
+            db.session.commit()
+
+            run_job(claim_jobs(TEST_PLATFORM)[0])
+            db.session.expire_all()
+            assert handled == [{'text': 'bonjour tout le monde'}]
+            statuses = {j.message_id: j.status for j in InboundJob.query.filter_by(platform=TEST_PLATFORM)}
+            assert statuses == {first: 'done', second: 'done'}
+            print("   ✅ Messages fusionnés en une seule génération")
+            return True
+        finally:
+            _cleanup()
+
+
+def run_all_tests():
+    """Exécute tous les tests de la file durable"""
+    print("🚀 TESTS DE LA FILE DURABLE")
+    print("=" * 70)
+
+    tests = [
+        ("Doublons", test_duplicates_rejected),
+        ("Réclamation par conversation", test_claim_one_job_per_conversation),
+        ("Délai de visibilité", test_visibility_timeout),
+        ("Restitution", test_release_does_not_count_attempt),
+        ("Échec du handler", test_failing_handler_keeps_job_pending),
+        ("Copie périmée", test_stale_copy_is_skipped),
+        ("Rafale différée", test_open_burst_is_deferred),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,191 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import tempfile
+
+from app import app, db
+from models import LLMBatchJob
+import llm_batch
+from llm_batch import (
+    LocalBatchBackend, build_batch_request, parse_batch_output, submit_batch, refresh_batch,
+    apply_batch_results, cancel_batch, get_response_message
+)
+
+# Type de lot dédié : les tests ne touchent pas aux lots réels
+TEST_JOB_TYPE = 'test_batch'
+
+
+def _stub_handler(body):
+    """Imite chat.completions.create : écho du dernier message, échec sur demande"""
+    text = body['messages'][-1]['content']
+    if text == 'échec':
+        raise RuntimeError("erreur simulée")
+    return {'choices': [{'message': {'role': 'assistant', 'content': f"écho: {text}"}}]}
+
+
+def _requests(*texts):
+    return [
+        build_batch_request(f"req_{index}", {'model': 'test', 'messages': [{'role': 'user', 'content': text}]})
+        for index, text in enumerate(texts)
+    ]
+
+
+def _cleanup():
+    LLMBatchJob.query.filter_by(job_type=TEST_JOB_TYPE).delete(synchronize_session=False)
+    db.session.commit()
+
+
+class _BatchDir:
+    """LLM_BATCH_DIR temporaire le temps du test"""
+
+    def __enter__(self):
+        self.saved = llm_batch.LLM_BATCH_DIR
+        llm_batch.LLM_BATCH_DIR = tempfile.mkdtemp(prefix='batches_')
+        return llm_batch.LLM_BATCH_DIR
+
+    def __exit__(self, *exc):
+        shutil.rmtree(llm_batch.LLM_BATCH_DIR, ignore_errors=True)
+        llm_batch.LLM_BATCH_DIR = self.saved
+
+
+def test_local_backend_output_format():
+    """Le stand-in local écrit une sortie au format de la Batch API (succès et erreurs)"""
+    print("🧪 TEST BACKEND LOCAL")
+    print("=" * 60)
+
+    with _BatchDir():
+        backend = LocalBatchBackend(handler=_stub_handler)
+        file_path = llm_batch.write_batch_file(TEST_JOB_TYPE, _requests('bonjour', 'échec'))
+        batch_id = backend.submit(file_path, TEST_JOB_TYPE)
+
+        status, output_text, error = backend.retrieve(batch_id)
+        assert status == 'completed' and error is None
+        results = parse_batch_output(output_text)
+        print(f"   • Résultats: {sorted(results)}")
+        assert get_response_message(results['req_0']['body'])['content'] == 'écho: bonjour'
+        assert results['req_0']['error'] is None
+        assert results['req_1']['body'] is None and 'erreur simulée' in results['req_1']['error']
+
+        assert backend.retrieve('local_inconnu')[0] == 'failed'
+    print("   ✅ Réponse et erreur au format attendu, lot inconnu en échec")
+    return True
+
+
+def test_submit_refresh_apply_idempotent():
+    """Cycle complet d'un lot ; un second passage ne réapplique rien"""
+    print("🧪 TEST CYCLE DE VIE ET IDEMPOTENCE")
+    print("=" * 60)
+
+    applied = []
+
+    def applier(custom_id, response_body, context):
+        applied.append((custom_id, get_response_message(response_body)['content'], context.get('user')))
+
+    with app.app_context(), _BatchDir():
+        _cleanup()
+        try:
+            job = submit_batch(
+                TEST_JOB_TYPE, _requests('un', 'deux', 'échec'),
+                context={'req_0': {'user': 1}, 'req_1': {'user': 2}},
+                backend=LocalBatchBackend(handler=_stub_handler)
+            )
+            assert job.status == 'submitted' and job.request_count == 3
+
+            results = refresh_batch(job)
+            assert job.status == 'completed'
+            stats = apply_batch_results(job, results, applier)
+            print(f"   • Premier passage: {stats}")
+            assert stats == {'applied': 2, 'skipped': 0, 'failed': 1}
+            assert sorted(applied) == [('req_0', 'écho: un', 1), ('req_1', 'écho: deux', 2)]
+            assert job.status == 'applied'
+
+            # Redémarrage ou poller concurrent : mêmes résultats, rien de réappliqué
+            stats = apply_batch_results(job, refresh_batch(job), applier)
+            print(f"   • Second passage: {stats}")
+            assert stats['applied'] == 0 and stats['skipped'] == 3
+            assert len(applied) == 2
+            print("   ✅ Résultats appliqués une seule fois")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_cancel_batch():
+    """Un lot abandonné est annulé chez le fournisseur, même si l'annulation échoue"""
+    print("🧪 TEST ANNULATION")
+    print("=" * 60)
+
+    class RecordingBackend(LocalBatchBackend):
+        def __init__(self, fail=False):
+            super().__init__(handler=_stub_handler)
+            self.fail = fail
+            self.cancelled = []
+
+        def cancel(self, batch_id):
+            if self.fail:
+                raise RuntimeError("lot déjà terminé")
+            self.cancelled.append(batch_id)
+
+    with app.app_context(), _BatchDir():
+        _cleanup()
+        try:
+            backend = RecordingBackend()
+            job = submit_batch(TEST_JOB_TYPE, _requests('un'), backend=backend)
+            cancel_batch(job, backend)
+            assert backend.cancelled == [job.batch_id] and job.status == 'abandoned'
+            print("   • Lot annulé chez le fournisseur")
+
+            job = submit_batch(TEST_JOB_TYPE, _requests('deux'), backend=backend)
+            cancel_batch(job, RecordingBackend(fail=True))
+            assert job.status == 'abandoned'
+            print("   ✅ Lot abandonné même quand l'annulation échoue")
+            return True
+        finally:
+            _cleanup()
+
+
+def test_empty_batch_not_submitted():
+    """Aucune requête : aucun lot soumis"""
+    print("🧪 TEST LOT VIDE")
+    print("=" * 60)
+
+    with app.app_context():
+        assert submit_batch(TEST_JOB_TYPE, [], backend=LocalBatchBackend(handler=_stub_handler)) is None
+    print("   ✅ Rien de soumis")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du mode batch"""
+    print("🚀 TESTS DU MODE BATCH (STAND-IN LOCAL)")
+    print("=" * 70)
+
+    tests = [
+        ("Backend local", test_local_backend_output_format),
+        ("Cycle de vie et idempotence", test_submit_refresh_apply_idempotent),
+        ("Annulation", test_cancel_batch),
+        ("Lot vide", test_empty_batch_not_submitted),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,232 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ===================================
+# SERVEUR MATHPIX DE TEST (MATHPIX_BASE_URL)
+# ===================================
+
+class StubMathpixHandler(BaseHTTPRequestHandler):
+    """Imite POST /v3/text : statut et délai réglables via StubMathpixHandler.behaviour"""
+
+    behaviour = {'status': 200, 'delay': 0.0}
+    requests_seen = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubMathpixHandler.requests_seen.append({'path': self.path, 'app_id': self.headers.get('app_id'), 'body': body})
+        time.sleep(self.behaviour['delay'])
+
+        status = self.behaviour['status']
+        payload = {'text': 'Résoudre $x^2 = 4$', 'data': [{'type': 'latex', 'value': 'x^2 = 4'}]} \
+            if status == 200 else {'error': 'stub'}
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = ThreadingHTTPServer(('127.0.0.1', 0), StubMathpixHandler)
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+# Le client partagé lit ces variables à l'import
+os.environ['MATHPIX_BASE_URL'] = f"http://127.0.0.1:{_server.server_address[1]}/v3"
+os.environ.setdefault('MATHPIX_APP_ID', 'test_app')
+os.environ.setdefault('MATHPIX_APP_KEY', 'test_key')
+
+from mathpix_utils import (
+    CircuitBreaker, MathpixClient, MathpixUnavailableError, MATHPIX_BASE_URL, process_image_with_mathpix
+)
+import requests
+
+
+def _reset_stub(status=200, delay=0.0):
+    StubMathpixHandler.behaviour = {'status': status, 'delay': delay}
+    StubMathpixHandler.requests_seen = []
+
+
+def test_circuit_breaker_states():
+    """Fermé -> ouvert après trop d'échecs -> semi-ouvert après le délai -> fermé"""
+    print("🧪 TEST DISJONCTEUR")
+    print("=" * 60)
+
+    breaker = CircuitBreaker('test', window=10, min_calls=4, error_rate=0.5, cooldown=0.1, slow_call=1)
+    for success in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(success, 0.01)
+    print(f"   • Après 2 échecs sur 4: {breaker.state}")
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    time.sleep(0.12)
+    assert breaker.allow()          # Appel d'essai
+    assert not breaker.allow()      # Un seul essai à la fois
+    assert breaker.state == 'half_open'
+    breaker.record(False, 0.01)
+    assert breaker.state == 'open'  # Essai raté : réouvert
+
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == 'closed'
+    stats = breaker.stats()
+    assert stats['trips'] == 2 and stats['rejected'] == 2
+    print("   ✅ Transitions et appel d'essai unique conformes")
+    return True
+
+
+def test_circuit_breaker_slow_calls():
+    """Les appels plus lents que slow_call comptent comme des échecs"""
+    print("🧪 TEST APPELS LENTS")
+    print("=" * 60)
+
+    breaker = CircuitBreaker('test', window=10, min_calls=3, error_rate=0.6, cooldown=60, slow_call=0.5)
+    for _ in range(3):
+        breaker.allow()
+        breaker.record(True, 2.0)
+    assert breaker.state == 'open'
+    assert breaker.stats()['slow_calls'] == 3
+    print("   ✅ Disjoncteur ouvert par des appels réussis mais trop lents")
+    return True
+
+
+def test_client_uses_base_url():
+    """Le client appelle MATHPIX_BASE_URL/text avec les en-têtes fournis"""
+    print("🧪 TEST CLIENT (SERVEUR DE TEST)")
+    print("=" * 60)
+
+    _reset_stub()
+    client = MathpixClient(base_url=MATHPIX_BASE_URL)
+    result = client.post_text({'src': 'data:image/jpeg;base64,AAAA'}, {'app_id': 'abc'})
+    seen = StubMathpixHandler.requests_seen
+    print(f"   • Requêtes reçues: {[r['path'] for r in seen]}")
+    assert seen[0]['path'] == '/v3/text' and seen[0]['app_id'] == 'abc'
+    assert result['text'].startswith('Résoudre')
+    assert client.breaker.state == 'closed'
+    print("   ✅ Réponse JSON retournée")
+    return True
+
+
+def test_client_breaker_skips_calls():
+    """Des 5xx répétées ouvrent le disjoncteur : Mathpix n'est plus appelé ; un 4xx ne compte pas"""
+    print("🧪 TEST CLIENT DISJONCTÉ")
+    print("=" * 60)
+
+    client = MathpixClient(base_url=MATHPIX_BASE_URL)
+    client.breaker = CircuitBreaker('test', window=10, min_calls=3, error_rate=0.5, cooldown=60, slow_call=5)
+
+    _reset_stub(status=400)
+    for _ in range(3):
+        try:
+            client.post_text({}, {})
+        except requests.exceptions.HTTPError:
+            pass
+    assert client.breaker.state == 'closed'
+    print("   • 3 réponses 400: disjoncteur fermé")
+
+    _reset_stub(status=503)
+    for _ in range(3):
+        try:
+            client.post_text({}, {})
+        except requests.exceptions.HTTPError:
+            pass
+    assert client.breaker.state == 'open'
+
+    _reset_stub(status=200)
+    try:
+        client.post_text({}, {})
+        assert False, "MathpixUnavailableError attendue"
+    except MathpixUnavailableError:
+        pass
+    assert StubMathpixHandler.requests_seen == []
+    print("   ✅ Après 3 réponses 503, plus aucun appel au serveur")
+    return True
+
+
+def test_client_deadline():
+    """L'échéance de l'appelant borne l'appel (et l'empêche si elle est dépassée)"""
+    print("🧪 TEST ÉCHÉANCE")
+    print("=" * 60)
+
+    client = MathpixClient(base_url=MATHPIX_BASE_URL)
+    _reset_stub()
+    try:
+        client.post_text({}, {}, deadline=time.monotonic() - 1)
+        assert False, "MathpixUnavailableError attendue"
+    except MathpixUnavailableError:
+        pass
+    assert StubMathpixHandler.requests_seen == []
+
+    _reset_stub(delay=1.0)
+    started = time.monotonic()
+    try:
+        client.post_text({}, {}, deadline=time.monotonic() + 0.3)
+        assert False, "Timeout attendu"
+    except requests.exceptions.Timeout:
+        pass
+    elapsed = time.monotonic() - started
+    print(f"   • Appel interrompu après {elapsed:.2f}s")
+    assert elapsed < 0.9
+    print("   ✅ Timeout réduit au temps restant")
+    return True
+
+
+def test_process_image_with_mathpix():
+    """process_image_with_mathpix passe par le client partagé et structure la réponse"""
+    print("🧪 TEST OCR DE BOUT EN BOUT")
+    print("=" * 60)
+
+    _reset_stub()
+    result = process_image_with_mathpix("data:image/png;base64,iVBORw0KGgo=")
+    assert 'error' not in result
+    assert StubMathpixHandler.requests_seen[0]['body']['src'].startswith('data:image/png;base64,')
+    assert result['has_math']
+    print("   ✅ Type d'image conservé, résultat structuré")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du client Mathpix"""
+    print("🚀 TESTS DU CLIENT MATHPIX")
+    print("=" * 70)
+
+    tests = [
+        ("Disjoncteur", test_circuit_breaker_states),
+        ("Appels lents", test_circuit_breaker_slow_calls),
+        ("Client (serveur de test)", test_client_uses_base_url),
+        ("Client disjoncté", test_client_breaker_skips_calls),
+        ("Échéance", test_client_deadline),
+        ("OCR de bout en bout", test_process_image_with_mathpix),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,108 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+
+import rate_limiter
+from rate_limiter import TokenBucketLimiter
+
+
+def test_burst_then_limited():
+    """Un expéditeur passe BURST messages d'affilée puis est limité"""
+    print("🧪 TEST RAFALE PUIS LIMITATION")
+    print("=" * 60)
+
+    limiter = TokenBucketLimiter('test', burst=3, per_minute=0.0001)
+    allowed = [limiter.allow('eleve_1') for _ in range(5)]
+    print(f"   • Résultats: {allowed}")
+    assert allowed == [True, True, True, False, False]
+
+    # Les seaux sont indépendants par expéditeur
+    assert limiter.allow('eleve_2')
+    stats = limiter.stats()
+    assert stats['allowed'] == 4 and stats['limited'] == 2
+    assert stats['top_limited'][0] == {'sender': 'eleve_1', 'limited': 2}
+    print("   ✅ Rafale acceptée, excédent refusé, seaux séparés par expéditeur")
+    return True
+
+
+def test_refill():
+    """Les jetons se rechargent au débit configuré"""
+    print("🧪 TEST RECHARGE DES JETONS")
+    print("=" * 60)
+
+    limiter = TokenBucketLimiter('test', burst=1, per_minute=600)  # 10 jetons/s
+    assert limiter.allow('eleve_1')
+    assert not limiter.allow('eleve_1')
+    time.sleep(0.15)
+    assert limiter.allow('eleve_1')
+    print("   ✅ Un jeton disponible après 0,1 s")
+    return True
+
+
+def test_notice_once_per_interval():
+    """Un expéditeur limité n'est prévenu qu'une fois par intervalle"""
+    print("🧪 TEST AVERTISSEMENT UNIQUE")
+    print("=" * 60)
+
+    limiter = TokenBucketLimiter('test', burst=1, per_minute=0.0001)
+    assert not limiter.should_notify('inconnu')  # Jamais vu : rien à signaler
+
+    limiter.allow('eleve_1')
+    assert not limiter.allow('eleve_1')
+    assert limiter.should_notify('eleve_1')
+    assert not limiter.should_notify('eleve_1')
+    assert limiter.stats()['notices'] == 1
+    print(f"   ✅ Un seul avertissement par {rate_limiter.BOT_RATE_NOTICE_INTERVAL}s")
+    return True
+
+
+def test_lru_bound():
+    """Le nombre d'expéditeurs suivis est borné (le plus ancien est oublié)"""
+    print("🧪 TEST BORNE LRU")
+    print("=" * 60)
+
+    limiter = TokenBucketLimiter('test', burst=1, per_minute=0.0001, max_senders=2)
+    limiter.allow('a')
+    limiter.allow('b')
+    limiter.allow('c')
+    assert limiter.stats()['tracked_senders'] == 2
+    # 'a' oublié : il repart avec un seau plein
+    assert limiter.allow('a')
+    print("   ✅ Expéditeur le plus ancien évincé, seau neuf à son retour")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du limiteur de débit"""
+    print("🚀 TESTS DU LIMITEUR DE DÉBIT")
+    print("=" * 70)
+
+    tests = [
+        ("Rafale puis limitation", test_burst_then_limited),
+        ("Recharge des jetons", test_refill),
+        ("Avertissement unique", test_notice_once_per_interval),
+        ("Borne LRU", test_lru_bound),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,147 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+
+# Lus à l'import du module : une modification autorisée à chaque fragment
+os.environ['TELEGRAM_STREAM_EDIT_INTERVAL'] = '0'
+os.environ['TELEGRAM_STREAM_FIRST_CHARS'] = '10'
+
+import telegram_bot
+from telegram_bot import TelegramStreamReply
+
+
+class FakeSentMessage:
+    """Message Telegram envoyé par le bot (edit_text / delete)"""
+
+    def __init__(self, text):
+        self.text = text
+        self.edits = 0
+        self.deleted = False
+
+    async def edit_text(self, text):
+        self.text = text
+        self.edits += 1
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeUserMessage:
+    """Message de l'élève auquel le bot répond (reply_text)"""
+
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text):
+        message = FakeSentMessage(text)
+        self.replies.append(message)
+        return message
+
+
+def _visible(user_message):
+    return [m.text for m in user_message.replies if not m.deleted]
+
+
+def test_progressive_display():
+    """Premier message après FIRST_CHARS, modifications avec curseur, texte final sans curseur"""
+    print("🧪 TEST AFFICHAGE PROGRESSIF")
+    print("=" * 60)
+
+    async def scenario():
+        user_message = FakeUserMessage()
+        reply = TelegramStreamReply(user_message)
+        await reply.add("Bonj")
+        assert not reply.started  # Moins de FIRST_CHARS caractères : rien d'envoyé
+        await reply.add("our, voici ")
+        assert _visible(user_message) == ["Bonjour, voici  ▌"]
+        await reply.add("la méthode.")
+        assert _visible(user_message) == ["Bonjour, voici la méthode. ▌"]
+        await reply.finish(reply.text)
+        return user_message
+
+    user_message = asyncio.run(scenario())
+    print(f"   • Affiché: {_visible(user_message)}")
+    assert _visible(user_message) == ["Bonjour, voici la méthode."]
+    assert len(user_message.replies) == 1 and user_message.replies[0].edits == 2
+    print("   ✅ Un seul message, modifié au fil du flux")
+    return True
+
+
+def test_finish_without_stream():
+    """Sans flux affiché, finish envoie simplement le texte"""
+    print("🧪 TEST ENVOI SANS FLUX")
+    print("=" * 60)
+
+    async def scenario():
+        user_message = FakeUserMessage()
+        await TelegramStreamReply(user_message).finish("Réponse courte")
+        return user_message
+
+    user_message = asyncio.run(scenario())
+    assert _visible(user_message) == ["Réponse courte"]
+    print("   ✅ Un message envoyé")
+    return True
+
+
+def test_finish_removes_extra_parts():
+    """Un texte final plus court que le flux supprime les morceaux en trop (ni texte partiel ni curseur)"""
+    print("🧪 TEST NETTOYAGE DES MORCEAUX EN TROP")
+    print("=" * 60)
+
+    original_limit = telegram_bot.TELEGRAM_MESSAGE_LIMIT
+    telegram_bot.TELEGRAM_MESSAGE_LIMIT = 40
+    try:
+        async def scenario():
+            user_message = FakeUserMessage()
+            reply = TelegramStreamReply(user_message)
+            await reply.add("Première ligne de la réponse diffusée\n")
+            await reply.add("Deuxième ligne, bientôt retirée du texte")
+            assert len(_visible(user_message)) == 2
+            assert _visible(user_message)[1].endswith("▌")
+            await reply.finish("Réponse finale plus courte")
+            return user_message
+
+        user_message = asyncio.run(scenario())
+    finally:
+        telegram_bot.TELEGRAM_MESSAGE_LIMIT = original_limit
+
+    print(f"   • Affiché: {_visible(user_message)}")
+    assert _visible(user_message) == ["Réponse finale plus courte"]
+    assert user_message.replies[1].deleted
+    print("   ✅ Morceau en trop supprimé")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests de la réponse progressive Telegram"""
+    print("🚀 TESTS DE LA RÉPONSE PROGRESSIVE TELEGRAM")
+    print("=" * 70)
+
+    tests = [
+        ("Affichage progressif", test_progressive_display),
+        ("Envoi sans flux", test_finish_without_stream),
+        ("Nettoyage des morceaux en trop", test_finish_removes_extra_parts),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
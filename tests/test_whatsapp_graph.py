@@ -0,0 +1,198 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ===================================
+# SERVEUR GRAPH API DE TEST (WHATSAPP_GRAPH_BASE_URL)
+# ===================================
+
+class StubGraphHandler(BaseHTTPRequestHandler):
+    """Rejoue les réponses de StubGraphHandler.responses : (statut, en-têtes, corps) par requête"""
+
+    responses = []
+    requests_seen = []
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        StubGraphHandler.requests_seen.append({
+            'method': self.command,
+            'path': self.path,
+            'authorization': self.headers.get('Authorization'),
+            'body': json.loads(body) if body else None
+        })
+
+        status, headers, content = StubGraphHandler.responses.pop(0) if StubGraphHandler.responses \
+            else (200, {}, {'ok': True})
+        if isinstance(content, dict):
+            content = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if 'Content-Length' not in headers and not headers.get('X-Omit-Length'):
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = ThreadingHTTPServer(('127.0.0.1', 0), StubGraphHandler)
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+_base_url = f"http://127.0.0.1:{_server.server_address[1]}/v17.0"
+
+# Lus à l'import du module : retries rapides pour les tests
+os.environ['WHATSAPP_GRAPH_BASE_URL'] = _base_url
+os.environ['WHATSAPP_RETRY_BACKOFF'] = '0.01'
+os.environ.setdefault('WHATSAPP_API_TOKEN', 'test_token')
+
+from whatsapp_graph import GraphApiClient, MediaTooLargeError, WHATSAPP_HTTP_RETRIES
+import requests
+
+
+def _reset_stub(*responses):
+    StubGraphHandler.responses = list(responses)
+    StubGraphHandler.requests_seen = []
+
+
+def test_send_text():
+    """Envoi d'un texte : URL, jeton et corps conformes à l'API Graph"""
+    print("🧪 TEST ENVOI DE MESSAGE")
+    print("=" * 60)
+
+    _reset_stub((200, {}, {'messages': [{'id': 'wamid.test'}]}))
+    result = GraphApiClient().send_text('123456', '22500000000', 'Bonjour !')
+
+    seen = StubGraphHandler.requests_seen[0]
+    print(f"   • {seen['method']} {seen['path']}")
+    assert seen['path'] == '/v17.0/123456/messages'
+    assert seen['authorization'] == f"Bearer {os.environ['WHATSAPP_API_TOKEN']}"
+    assert seen['body']['to'] == '22500000000' and seen['body']['text']['body'] == 'Bonjour !'
+    assert result['messages'][0]['id'] == 'wamid.test'
+    print("   ✅ Message envoyé, réponse JSON retournée")
+    return True
+
+
+def test_retry_on_server_errors():
+    """429 et 5xx sont réessayés (Retry-After respecté), puis la réponse finale est retournée"""
+    print("🧪 TEST NOUVELLES TENTATIVES")
+    print("=" * 60)
+
+    _reset_stub(
+        (503, {}, {'error': 'indisponible'}),
+        (429, {'Retry-After': '0'}, {'error': 'trop de requêtes'}),
+        (200, {}, {'messages': [{'id': 'wamid.retry'}]})
+    )
+    result = GraphApiClient().send_text('123456', '22500000000', 'Bonjour !')
+    print(f"   • Requêtes envoyées: {len(StubGraphHandler.requests_seen)}")
+    assert len(StubGraphHandler.requests_seen) == 3
+    assert result['messages'][0]['id'] == 'wamid.retry'
+    print("   ✅ Succès à la troisième tentative")
+    return True
+
+
+def test_retries_exhausted_and_client_errors():
+    """Les tentatives sont bornées ; une erreur 4xx n'est pas réessayée"""
+    print("🧪 TEST ÉCHECS DÉFINITIFS")
+    print("=" * 60)
+
+    client = GraphApiClient()
+    _reset_stub(*[(500, {}, {'error': 'panne'})] * (WHATSAPP_HTTP_RETRIES + 1))
+    try:
+        client.send_text('123456', '22500000000', 'Bonjour !')
+        assert False, "HTTPError attendue"
+    except requests.exceptions.HTTPError as e:
+        assert e.response.status_code == 500
+    assert len(StubGraphHandler.requests_seen) == WHATSAPP_HTTP_RETRIES + 1
+    print(f"   • 500 persistante: {len(StubGraphHandler.requests_seen)} requêtes puis erreur")
+
+    _reset_stub((400, {}, {'error': 'numéro invalide'}))
+    try:
+        client.send_text('123456', 'invalide', 'Bonjour !')
+        assert False, "HTTPError attendue"
+    except requests.exceptions.HTTPError as e:
+        assert e.response.status_code == 400
+    assert len(StubGraphHandler.requests_seen) == 1
+    print("   ✅ 400: une seule requête")
+    return True
+
+
+def test_media_download():
+    """URL du média puis téléchargement en streaming (même session)"""
+    print("🧪 TEST TÉLÉCHARGEMENT DE MÉDIA")
+    print("=" * 60)
+
+    client = GraphApiClient()
+    image = b'\xff\xd8\xff' + b'\x00' * 1000
+    _reset_stub(
+        (200, {}, {'url': f"{_base_url}/media/file.jpg"}),
+        (200, {'Content-Type': 'image/jpeg'}, image)
+    )
+    media_url = client.get_media_url('media_123')
+    content = client.download_media(media_url)
+    assert [r['path'] for r in StubGraphHandler.requests_seen] == ['/v17.0/media_123', '/v17.0/media/file.jpg']
+    assert content == image
+    print(f"   ✅ {len(content)} octets téléchargés")
+    return True
+
+
+def test_media_size_limit():
+    """Un média trop volumineux est refusé (taille annoncée ou taille lue)"""
+    print("🧪 TEST LIMITE DE TAILLE DES MÉDIAS")
+    print("=" * 60)
+
+    client = GraphApiClient()
+    for headers in ({}, {'X-Omit-Length': '1'}):
+        _reset_stub((200, headers, b'\x00' * 5000))
+        try:
+            client.download_media(f"{_base_url}/media/big.jpg", max_bytes=1000)
+            assert False, "MediaTooLargeError attendue"
+        except MediaTooLargeError:
+            pass
+        print(f"   • Refusé {'sans' if headers else 'avec'} Content-Length")
+    print("   ✅ Limite appliquée dans les deux cas")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du client Graph API"""
+    print("🚀 TESTS DU CLIENT GRAPH API (WHATSAPP)")
+    print("=" * 70)
+
+    tests = [
+        ("Envoi de message", test_send_text),
+        ("Nouvelles tentatives", test_retry_on_server_errors),
+        ("Échecs définitifs", test_retries_exhausted_and_client_errors),
+        ("Téléchargement de média", test_media_download),
+        ("Limite de taille des médias", test_media_size_limit),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,108 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+
+from worker_pool import ShardedWorkerPool
+
+
+def test_order_per_key():
+    """Les travaux d'une même clé sont traités dans l'ordre de soumission"""
+    print("🧪 TEST ORDRE PAR CLÉ")
+    print("=" * 60)
+
+    processed = {}
+    lock = threading.Lock()
+
+    def handler(job):
+        key, index = job
+        with lock:
+            processed.setdefault(key, []).append(index)
+
+    pool = ShardedWorkerPool('test-order', handler, num_workers=4, max_queue_size=100)
+    for index in range(20):
+        for key in ('conv_a', 'conv_b', 'conv_c'):
+            assert pool.submit(key, (key, index))
+    pool.shutdown()
+
+    for key, indexes in processed.items():
+        print(f"   • {key}: {len(indexes)} travaux")
+        assert indexes == list(range(20))
+    assert pool.stats()['processed'] == 60
+    print("   ✅ Ordre conservé pour chaque conversation")
+    return True
+
+
+def test_backpressure():
+    """Une file pleine refuse le travail au lieu de grossir"""
+    print("🧪 TEST BACKPRESSURE")
+    print("=" * 60)
+
+    release = threading.Event()
+    pool = ShardedWorkerPool('test-full', lambda job: release.wait(5), num_workers=1, max_queue_size=1)
+
+    accepted = [pool.submit('conv', i) for i in range(4)]
+    print(f"   • Soumissions: {accepted}")
+    # Un travail en cours + un en file, le reste refusé
+    assert accepted.count(False) >= 2
+    assert pool.stats()['rejected'] == accepted.count(False)
+
+    release.set()
+    pool.shutdown()
+    print("   ✅ Travaux excédentaires refusés")
+    return True
+
+
+def test_failures_counted():
+    """Une exception du handler n'arrête pas le worker"""
+    print("🧪 TEST ÉCHEC DU HANDLER")
+    print("=" * 60)
+
+    def handler(job):
+        if job == 'boom':
+            raise ValueError("échec simulé")
+
+    pool = ShardedWorkerPool('test-fail', handler, num_workers=1)
+    for job in ('ok', 'boom', 'ok'):
+        pool.submit('conv', job)
+    pool.shutdown()
+
+    stats = pool.stats()
+    assert stats['processed'] == 2 and stats['failed'] == 1
+    assert not pool.submit('conv', 'ok')  # Pool arrêté
+    print("   ✅ Échec compté, worker toujours actif, pool arrêté refuse les travaux")
+    return True
+
+
+def run_all_tests():
+    """Exécute tous les tests du pool de workers"""
+    print("🚀 TESTS DU POOL DE WORKERS")
+    print("=" * 70)
+
+    tests = [
+        ("Ordre par clé", test_order_per_key),
+        ("Backpressure", test_backpressure),
+        ("Échec du handler", test_failures_counted),
+    ]
+
+    results = []
+    for test_name, test_func in tests:
+        try:
+            result = test_func()
+            results.append((test_name, result))
+        except Exception as e:
+            print(f"❌ Erreur dans {test_name}: {e}")
+            results.append((test_name, False))
+
+    print("\n" + "=" * 70)
+    passed = sum(1 for _, result in results if result)
+    for test_name, result in results:
+        print(f"{'✅ PASSÉ' if result else '❌ ÉCHEC'} - {test_name}")
+    print(f"\n🎯 RÉSULTAT: {passed}/{len(results)} tests réussis")
+    return passed == len(results)
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
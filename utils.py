@@ -1,4 +1,5 @@
 import time
+import heapq
 import logging
 from contextlib import contextmanager
 from sqlalchemy import exc
@@ -9,7 +10,6 @@ logger = logging.getLogger(__name__)
 import os
 import uuid
 import base64
-from datetime import datetime, timedelta
 from config import Config
 import asyncio
 
@@ -66,14 +66,17 @@ def save_base64_image(base64_string):
     Returns:
         str: Nom du fichier sauvegardé
     """
+    from image_preprocessing import prepare_image
+
     # Extract image type and data
     header, encoded = base64_string.split(",", 1)
 
-    # Generate a unique filename
-    filename = f"{uuid.uuid4()}.jpg"
+    # Decode the image and keep a normalized copy (EXIF orientation, reduced size)
+    prepared = prepare_image(base64.b64decode(encoded), purpose='vision')
+    img_data = prepared.content
 
-    # Decode the image
-    img_data = base64.b64decode(encoded)
+    # Generate a unique filename
+    filename = f"{uuid.uuid4()}{os.path.splitext(prepared.filename)[1]}"
 
     # Save the image
     filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
@@ -82,43 +85,118 @@ def save_base64_image(base64_string):
 
     return filename
 
+def _remove_upload(path, size, stats):
+    """Supprime un fichier d'upload et met à jour les compteurs ; False si la suppression échoue"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return True  # Déjà supprimé (autre processus)
+    except OSError as e:
+        logger.warning(f"Suppression impossible de {path}: {e}")
+        return False
+    stats['removed_files'] += 1
+    stats['reclaimed_bytes'] += size
+    return True
+
+
+# Point de reprise d'un parcours interrompu par le budget de temps :
+# dossiers restants (le dernier est repris à partir du nom 'resume_from'), fichiers
+# conservés et taille cumulée des passages précédents du même parcours
+_cleanup_resume = {'directories': None, 'resume_from': None, 'candidates': None, 'total_size': 0}
+
+
 def cleanup_uploads():
-    """Nettoie le dossier uploads des anciennes images et vérifie la taille totale"""
+    """
+    Nettoie le dossier uploads des anciennes images et vérifie la taille totale.
+
+    Un seul parcours (os.scandir, sous-dossiers compris sauf UPLOAD_CLEANUP_EXCLUDE) :
+    les fichiers plus vieux que IMAGE_MAX_AGE_HOURS sont supprimés au passage, les
+    autres sont comptés ; si le total dépasse MAX_UPLOAD_FOLDER_SIZE, les plus anciens
+    sont supprimés d'abord (tas). Un passage ne dure pas plus de UPLOAD_CLEANUP_TIME_BUDGET
+    secondes (les trois quarts pour le parcours, le reste pour la suppression) : un
+    parcours interrompu reprend au passage suivant là où il s'est arrêté, avec les
+    fichiers et la taille déjà comptés ; les fichiers déjà vus suffisent à déclencher
+    la suppression par taille.
+
+    Returns:
+        dict: Fichiers parcourus, fichiers et octets récupérés, taille restante (des fichiers parcourus)
+    """
+    started = time.monotonic()
+    deadline = started + Config.UPLOAD_CLEANUP_TIME_BUDGET
+    scan_deadline = started + Config.UPLOAD_CLEANUP_TIME_BUDGET * 0.75
+    upload_folder = Config.UPLOAD_FOLDER
+    max_age_cutoff = time.time() - Config.IMAGE_MAX_AGE_HOURS * 3600
+    excluded = {os.path.normpath(os.path.join(upload_folder, d)) for d in Config.UPLOAD_CLEANUP_EXCLUDE}
+
+    stats = {'scanned_files': 0, 'removed_files': 0, 'reclaimed_bytes': 0,
+             'total_bytes': 0, 'complete': True}
+    directories = _cleanup_resume['directories'] or [upload_folder]
+    resume_from = _cleanup_resume['resume_from']
+    if _cleanup_resume['directories']:
+        candidates = _cleanup_resume['candidates'] or []  # (mtime, chemin, taille) des fichiers conservés
+        total_size = _cleanup_resume['total_size']
+    else:
+        candidates, total_size = [], 0
+    _cleanup_resume.update(directories=None, resume_from=None, candidates=None, total_size=0)
+
     try:
-        upload_folder = Config.UPLOAD_FOLDER
-        max_size = Config.MAX_UPLOAD_FOLDER_SIZE
-        max_age_hours = Config.IMAGE_MAX_AGE_HOURS
-
-        # Delete files older than IMAGE_MAX_AGE_HOURS
-        current_time = datetime.now()
-        for filename in os.listdir(upload_folder):
-            filepath = os.path.join(upload_folder, filename)
-            file_modified = datetime.fromtimestamp(os.path.getmtime(filepath))
-            if current_time - file_modified > timedelta(hours=max_age_hours):
-                os.remove(filepath)
-
-        # Check the total size of the folder
-        total_size = sum(
-            os.path.getsize(os.path.join(upload_folder, f))
-            for f in os.listdir(upload_folder))
-
-        # If the size exceeds the limit, delete the oldest files
-        if total_size > max_size:
-            files = [(os.path.join(upload_folder, f),
-                      os.path.getmtime(os.path.join(upload_folder, f)))
-                     for f in os.listdir(upload_folder)]
-            files.sort(key=lambda x: x[1])
-
-            for filepath, _ in files:
-                os.remove(filepath)
-                total_size = sum(
-                    os.path.getsize(os.path.join(upload_folder, f))
-                    for f in os.listdir(upload_folder))
-                if total_size <= max_size:
+        while directories and stats['complete']:
+            directory = directories.pop()
+            # Ordre stable (par nom) pour pouvoir reprendre un dossier en cours
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            for entry in entries:
+                if resume_from is not None and entry.name < resume_from:
+                    continue
+                if time.monotonic() > scan_deadline:
+                    stats['complete'] = False
+                    _cleanup_resume.update(directories=directories + [directory], resume_from=entry.name)
                     break
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.normpath(entry.path) not in excluded:
+                        directories.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+
+                try:
+                    info = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue  # Supprimé depuis le listage
+                stats['scanned_files'] += 1
+                if info.st_mtime < max_age_cutoff and _remove_upload(entry.path, info.st_size, stats):
+                    continue
+                total_size += info.st_size
+                candidates.append((info.st_mtime, entry.path, info.st_size))
+            resume_from = None
+
+        # Sur un parcours partiel, les fichiers déjà vus dépassent à eux seuls la limite :
+        # les plus anciens d'entre eux sont supprimés sans attendre la fin du parcours
+        if total_size > Config.MAX_UPLOAD_FOLDER_SIZE:
+            heapq.heapify(candidates)
+            while candidates and total_size > Config.MAX_UPLOAD_FOLDER_SIZE:
+                if time.monotonic() > deadline:
+                    stats['complete'] = False
+                    break
+                _, path, size = heapq.heappop(candidates)
+                if _remove_upload(path, size, stats):
+                    total_size -= size
+
+        if not stats['complete'] and _cleanup_resume['directories']:
+            _cleanup_resume.update(candidates=candidates, total_size=total_size)
 
     except Exception as e:
-        print(f"Error during upload cleanup: {str(e)}")
+        logger.error(f"Error during upload cleanup: {str(e)}")
+
+    stats['total_bytes'] = total_size
+    stats['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+    if stats['removed_files'] or not stats['complete']:
+        logger.info(
+            f"🧹 Uploads: {stats['removed_files']} fichier(s) supprimé(s), "
+            f"{stats['reclaimed_bytes'] / (1024 * 1024):.1f} Mo récupérés en {stats['duration_ms']} ms"
+            f"{'' if stats['complete'] else ' (budget atteint, suite au prochain passage)'}"
+        )
+    return stats
 
 @contextmanager
 def db_retry_session(max_retries=3, retry_delay=0.5):
@@ -9,12 +9,10 @@ from flask import Blueprint, request, jsonify, session
 from datetime import datetime
 from database import db
 from openai import OpenAI, BadRequestError, APIError
-from mathpix_utils import process_image_with_mathpix
+from image_cache import ocr_image_cached
 from sqlalchemy import Index, desc, BigInteger, Text
+from sqlalchemy.exc import IntegrityError
 import sys
-from threading import Lock, Thread
-from queue import Queue
-from collections import defaultdict
 from models import User, UserMemory
 from models import WhatsAppMessage
 # Import de la configuration IA centralisée
@@ -24,16 +22,36 @@ from ai_config import (
     get_system_instructions,
     ASSISTANT_ID,
     CONTEXT_MESSAGE_LIMIT,
-    openai_client as client
+    get_provider_client
 )
 from utils import db_retry_session
 from ai_utils import prepare_messages_for_api, upload_image_to_openai, process_image_for_openai
 from config import Config
 from utils import clean_response
+from conversation_summary import get_summary_context, schedule_summary_refresh
+from run_poller import wait_for_run, RunFailedError
+from assistant_thread_pool import acquire_thread_id
+from worker_pool import ShardedWorkerPool
+from durable_queue import DurableQueueConsumer, JobFailedError, enqueue_job, make_job_handler
+from whatsapp_graph import get_graph_client
+from whatsapp_status import record_statuses, get_status_stats
+from rate_limiter import get_limiter, BOT_RATE_LIMIT_MESSAGE
+from whatsapp_cache import (
+    get_identity, remember_identity, forget_identity, is_recent_message, remember_message, get_cache_stats
+)
 
-_message_queues = defaultdict(Queue)      # Queue par thread_id
-_processing_threads = {}                   # Thread worker par thread_id
-_dict_lock = Lock()                        # Pour synchroniser l'accès aux dicts
+# Pool de workers : nombre fixe de threads, une file bornée par worker (partition par thread_id)
+WHATSAPP_WORKERS = int(os.environ.get('WHATSAPP_WORKERS', '8'))
+# Les jobs attendent en base : file courte pour que l'attente dans le pool (N x durée d'une
+# génération) reste bien inférieure à INBOUND_VISIBILITY_TIMEOUT
+WHATSAPP_QUEUE_SIZE = int(os.environ.get('WHATSAPP_QUEUE_SIZE', '4'))
+WHATSAPP_DRAIN_TIMEOUT = int(os.environ.get('WHATSAPP_DRAIN_TIMEOUT', '30'))
+SUPPORTED_MESSAGE_TYPES = ('text', 'image')
+# Messages texte arrivant à moins de N secondes d'intervalle : une seule réponse (0 = désactivé)
+WHATSAPP_COALESCE_WINDOW = float(os.environ.get('WHATSAPP_COALESCE_WINDOW', '3'))
+WHATSAPP_BUSY_MESSAGE = "Je reçois beaucoup de messages en ce moment 😅 Renvoie ta question dans quelques minutes !"
+# Envoyé quand un message est abandonné après toutes ses tentatives (file durable)
+WHATSAPP_FAILURE_MESSAGE = "Désolé, une erreur s'est produite. Veuillez réessayer."
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -52,11 +70,11 @@ def get_or_create_thread(phone_number, force_new=False):
 
         # Cas simple: si on force un nouveau thread, on le crée et on l'utilise
         if force_new:
+            forget_identity(phone_number)
             thread_id = None
             # Créer un vrai thread OpenAI seulement si le modèle actuel est OpenAI
             if current_model == 'openai':
-                thread = client.beta.threads.create()
-                thread_id = thread.id
+                thread_id = acquire_thread_id()
                 logger.info(f"Création forcée d'un nouveau thread OpenAI {thread_id} pour {phone_number}")
             else:
                 # Pour les autres modèles, utiliser un format local
@@ -93,6 +111,7 @@ def get_or_create_thread(phone_number, force_new=False):
 
             # On ne peut pas se fier uniquement au préfixe "thread_" car les vrais threads OpenAI 
             # commencent également par "thread_". Test: on essaie d'utiliser le thread directement
+            client = get_provider_client('openai') if current_model == 'openai' else None
             if current_model == 'openai':
                 try:
                     # Tester si le thread est utilisable avec OpenAI
@@ -103,8 +122,7 @@ def get_or_create_thread(phone_number, force_new=False):
                 except Exception as e:
                     # Le thread n'est pas utilisable avec OpenAI, créer un nouveau thread
                     logger.info(f"Thread {existing_thread_id} non utilisable avec OpenAI ({str(e)}), création d'un nouveau thread")
-                    thread = client.beta.threads.create()
-                    thread_id = thread.id
+                    thread_id = acquire_thread_id()
                     logger.info(f"Nouveau thread OpenAI créé: {thread_id}")
                     return thread_id
 
@@ -118,8 +136,7 @@ def get_or_create_thread(phone_number, force_new=False):
                 except Exception as e:
                     logger.warning(f"Thread OpenAI {existing_thread_id} invalide: {str(e)}")
                     # Créer un nouveau thread si celui-ci n'est plus valide
-                    thread = client.beta.threads.create()
-                    thread_id = thread.id
+                    thread_id = acquire_thread_id()
                     logger.info(f"Création d'un nouveau thread OpenAI {thread_id}")
                     return thread_id
 
@@ -130,8 +147,7 @@ def get_or_create_thread(phone_number, force_new=False):
         # Aucun thread existant, en créer un nouveau
         thread_id = None
         if current_model == 'openai':
-            thread = client.beta.threads.create()
-            thread_id = thread.id
+            thread_id = acquire_thread_id()
             logger.info(f"Création d'un nouveau thread OpenAI {thread_id}")
         else:
             thread_id = f"thread_{phone_number}_{int(time.time())}"
@@ -145,109 +161,392 @@ def get_or_create_thread(phone_number, force_new=False):
         fallback_thread_id = f"thread_{phone_number}_{int(time.time())}_fallback"
         return fallback_thread_id
 
-def process_message_queue(thread_id, sender, phone_number_id):
+def _resolve_identity(sender, current_model):
     """
-    Worker thread qui traite séquentiellement les messages d'une queue.
-    S'arrête automatiquement après 5 minutes d'inactivité.
+    Retourne le thread de l'utilisateur WhatsApp, en créant son User au premier message.
+    Un utilisateur déjà en cache (whatsapp_cache) ne coûte aucune requête.
+
+    Returns:
+        str: thread_id
     """
-    from app import app  # Import local pour éviter circularité
+    identity = get_identity(sender, current_model)
+    if identity:
+        return identity['thread_id']
+
+    # === DÉBUT : CRÉATION AUTOMATIQUE DU USER ===
+    user_phone_id = f"whatsapp_{sender}"
+    existing_user = User.query.filter_by(phone_number=user_phone_id).first()
+
+    user_id = existing_user.id if existing_user else None
+    if not existing_user:
+        logger.info(f"Premier message de {sender}. Création d'un User associé.")
+        new_user = User(
+            phone_number=user_phone_id,
+            first_name="Utilisateur",
+            last_name=f"WA {sender[-4:]}",
+            age=0,
+            study_level="Non défini",
+            grade_goals="average"
+        )
+        db.session.add(new_user)
+        db.session.commit()
+        logger.info(f"✅ User créé (ID: {new_user.id}) pour WhatsApp {sender}")
+        user_id = new_user.id
+    # === FIN : CRÉATION AUTOMATIQUE DU USER ===
+
+    # Récupérer ou créer un thread pour cet utilisateur - sans forcer un nouveau thread
+    thread_id = None
+    try:
+        # Utiliser le thread existant plutôt que d'en créer un nouveau
+        thread_id = get_or_create_thread(sender, force_new=False)
+        if not thread_id:
+            # Uniquement en cas d'échec, créer un thread de secours
+            logger.error(f"Impossible de récupérer un thread pour {sender}")
+            thread_id = f"thread_{sender}_{int(time.time())}_fallback"
+    except Exception as thread_error:
+        logger.error(f"Erreur lors de la récupération du thread: {str(thread_error)}")
+        thread_id = f"thread_{sender}_{int(time.time())}_fallback"
+
+    # Vérifier si c'est une nouvelle conversation mais sans influer sur la création de thread
+    try:
+        # Vérifier si c'est la première fois qu'on utilise ce thread
+        is_new_conversation = not WhatsAppMessage.query.filter_by(thread_id=thread_id).first()
+        if is_new_conversation:
+            # Émettre l'événement de nouvelle conversation
+            from app import socketio
+            conversation_data = {
+                'id': thread_id,
+                'title': f"Conversation WhatsApp",
+                'thread_id': thread_id,
+                'user_phone': sender,
+                'created_at': datetime.now().strftime('%d/%m/%Y %H:%M'),
+                'platform': 'whatsapp'
+            }
+            socketio.emit('new_whatsapp_conversation', conversation_data)
+            logger.info(f"Émission de l'événement new_whatsapp_conversation pour {thread_id}")
+    except Exception as event_error:
+        logger.error(f"Erreur lors de l'émission de l'événement: {str(event_error)}")
+        # Continuer malgré l'erreur d'émission
 
-    queue = _message_queues[thread_id]
-    logger.info(f"Worker démarré pour thread {thread_id}")
+    remember_identity(sender, user_id, thread_id, current_model)
+    return thread_id
 
-    while True:
-        try:
-            # Attendre un message (timeout 5 min = arrêt automatique si inactif)
-            message_data = queue.get(timeout=300)
 
-            if message_data is None:  # Signal d'arrêt explicite
-                logger.info(f"Worker arrêté (signal) pour thread {thread_id}")
-                break
+def prepare_inbound_message(message, phone_number_id):
+    """
+    Prépare un message brut reçu par le webhook (exécuté en arrière-plan par le pool) :
+    création du User, résolution du thread, téléchargement et analyse des images,
+    sauvegarde du message entrant. Doit être appelé dans un app_context.
 
-            # Extraire les données du message
-            message_body = message_data['body']
-            openai_file_id = message_data.get('openai_file_id')
-            message_id = message_data['message_id']
+    Returns:
+        dict: Job prêt pour la génération de réponse, ou None si le message est ignoré
+    """
+    from ai_config import CURRENT_MODEL
+    current_model = CURRENT_MODEL
 
-            logger.info(f"Traitement message {message_id} dans queue {thread_id}")
+    sender = message.get('from')
+    message_id = message.get('id')
+    message_type = message.get('type')
+
+    logger.info(f"Processing {message_type} message from {sender}")
 
-            # CONTEXTE FLASK OBLIGATOIRE pour DB et IA
-            with app.app_context():
+    thread_id = _resolve_identity(sender, current_model)
+    max_retries = 3
+
+    # Traiter différemment selon le type de message
+    message_body = None
+    openai_file_id = None
+
+    if message_type == 'text':
+        message_body = message.get('text', {}).get('body', '')
+        logger.info(f"Text message: {message_body[:100]}...")
+
+    elif message_type == 'image':
+        # Récupérer l'ID de l'image avec retentatives
+        image_id = message.get('image', {}).get('id')
+        if image_id:
+            # Télécharger l'image avec retentatives
+            image_url = None
+            base64_data = None
+            for attempt in range(max_retries):
                 try:
-                    # Générer réponse IA
-                    response_text = generate_ai_response_simple(
-                        message_body, 
-                        thread_id, 
-                        sender, 
-                        openai_file_id
-                    )
+                    image_url, base64_data = download_whatsapp_image(image_id)
+                    if image_url and base64_data:
+                        break
+                except Exception as img_error:
+                    if attempt == max_retries - 1:
+                        logger.error(f"Failed to download image after {max_retries} attempts")
+                    else:
+                        logger.warning(f"Image download error (attempt {attempt+1}): {str(img_error)}")
+                        time.sleep(1)
 
-                    # Nettoyer la réponse
-                    response_text = clean_response(response_text)
+            logger.info(f"Image processing status: URL={bool(image_url)}, base64={bool(base64_data)}")
 
-                    if not response_text:
-                        logger.error(f"Réponse IA vide pour message {message_id}")
-                        response_text = "Désolé, je n'ai pas pu générer de réponse."
+            # Récupérer la légende si présente
+            caption = message.get('image', {}).get('caption', '')
 
-                    # Envoyer via WhatsApp
-                    api_response = send_whatsapp_message(
-                        sender, 
-                        response_text, 
-                        phone_number_id
-                    )
+            # Variables communes
+            mathpix_result = None
+            formatted_summary = None
 
-                    # Vérifier succès envoi
-                    if not (api_response and 'messages' in api_response):
-                        logger.error(f"Échec envoi WhatsApp pour message {message_id}")
-                        queue.task_done()
-                        continue
+            # Traitement différencié selon le modèle
+            if current_model == 'openai':
+                # Pour OpenAI: utiliser la double approche (Vision + OCR)
+                logger.info("Modèle OpenAI détecté dans WhatsApp: utilisation de Vision API + Mathpix OCR")
 
-                    # Sauvegarder message outbound
-                    try:
-                        outbound_msg = WhatsAppMessage(
-                            message_id=api_response['messages'][0]['id'],
-                            to_number=sender,
-                            content=response_text,
-                            direction='outbound',
-                            status='sent',
-                            thread_id=thread_id
-                        )
-                        db.session.add(outbound_msg)
-                        db.session.commit()
-                        logger.info(f"Message outbound sauvegardé pour {thread_id}")
-
-                    except Exception as db_error:
-                        logger.error(f"Erreur sauvegarde outbound: {db_error}")
-                        db.session.rollback()
-                    finally:
-                        db.session.remove()
+                # Construire le chemin du fichier local
+                filename = f"{image_id}_{int(time.time())}.jpg"
+                file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
 
+                # Utiliser la fonction de traitement combiné
+                try:
+                    openai_file_id, message_for_assistant, process_info = process_image_for_openai(
+                        file_path, base64_data, caption, platform="WhatsApp"
+                    )
+                    logger.info(f"Traitement OpenAI WhatsApp complété - Mathpix: {process_info['mathpix_success']}, Upload: {process_info['openai_success']}")
                 except Exception as process_error:
-                    logger.error(f"Erreur traitement message {message_id}: {process_error}")
-                    db.session.rollback()
-                finally:
-                    db.session.remove()
-                    queue.task_done()
-
-        except Exception as e:
-            if "Empty" in str(type(e).__name__):  # Queue timeout (5 min inactivité)
-                logger.info(f"Worker timeout (inactif) pour thread {thread_id}")
-                break
+                    logger.error(f"Échec complet du traitement d'image OpenAI WhatsApp: {str(process_error)}")
+                    # Utiliser un message d'erreur par défaut
+                    message_for_assistant = "Erreur lors du traitement de l'image. Veuillez réessayer."
+                    openai_file_id = None
             else:
-                logger.error(f"Erreur critique worker {thread_id}: {e}")
-                break
-        finally:
+                # Pour les autres modèles: utiliser Mathpix comme avant
+                logger.info(f"Modèle {current_model} détecté dans WhatsApp: utilisation de Mathpix")
+                if base64_data:
+                    try:
+                        mathpix_result = ocr_image_cached(base64_data)
+                        if "error" not in mathpix_result:
+                            formatted_summary = mathpix_result.get("formatted_summary", "")
+                    except Exception as mathpix_error:
+                        logger.error(f"Mathpix processing error: {str(mathpix_error)}")
+                        # Continuer sans extraction plutôt que d'échouer complètement
+
+            # Pour OpenAI, message_for_assistant est déjà préparé
+            if current_model != 'openai':
+                # Construire le message pour les autres modèles
+                message_for_assistant = ""
+                if caption:
+                    message_for_assistant += f"{caption}\n\n"
+
+                if formatted_summary:
+                    message_for_assistant += formatted_summary
+                else:
+                    if not caption:
+                        message_for_assistant = "Please analyze the content I shared."
+
+            # Définir le message à envoyer à l'IA et à stocker
+            message_body = message_for_assistant
+
+    # Si on arrive ici, on a un message_body à traiter
+    if not message_body:
+        logger.warning(f"Empty message body for {message_type} message. Skipping.")
+        return None
+
+    # Store incoming message dans une transaction indépendante
+    try:
+        new_message = WhatsAppMessage(
+            message_id=message_id,
+            from_number=sender,
+            content=message_body,
+            direction='inbound',
+            thread_id=thread_id
+        )
+        db.session.add(new_message)
+        db.session.commit()
+        logger.info(f"Stored inbound message ID {message_id}")
+    except IntegrityError:
+        # Message déjà enregistré : reprise d'un job interrompu (crash, redéploiement).
+        # Les renvois du webhook par Meta sont eux écartés en amont (cache + file durable).
+        db.session.rollback()
+        logger.info(f"Message {message_id} déjà enregistré, reprise de la génération de réponse.")
+    except Exception as db_error:
+        logger.error(f"Database error storing inbound message: {str(db_error)}")
+        db.session.rollback()
+
+    return {
+        'thread_id': thread_id,
+        'sender': sender,
+        'phone_number_id': phone_number_id,
+        'body': message_body,
+        'openai_file_id': openai_file_id,
+        'message_id': message_id
+    }
+
+
+def process_whatsapp_job(job):
+    """
+    Traite un message en file (appelé par un worker du pool WhatsApp).
+    Les messages d'un même utilisateur sont toujours traités par le même worker, dans l'ordre.
+
+    Le job contient soit le message brut du webhook ('message'), préparé ici
+    par prepare_inbound_message, soit un message déjà prêt ('body', déclenchement admin).
+    """
+    from app import app  # Import local pour éviter circularité
+
+    message_id = job.get('message_id') or job.get('message', {}).get('id')
+
+    # CONTEXTE FLASK OBLIGATOIRE pour DB et IA
+    with app.app_context():
+        try:
+            if 'message' in job:
+                prepared = [
+                    prepare_inbound_message(message, job['phone_number_id'])
+                    for message in [job['message']] + job.get('burst', [])
+                ]
+                prepared = [p for p in prepared if p]
+                if not prepared:
+                    return
+                # Rafale : chaque message est enregistré, une seule génération pour l'ensemble
+                job = dict(prepared[-1], body="\n".join(p['body'] for p in prepared))
+
+            thread_id = job['thread_id']
+            sender = job['sender']
+            phone_number_id = job['phone_number_id']
+            message_body = job['body']
+            openai_file_id = job.get('openai_file_id')
+            message_id = job['message_id']
+
+            logger.info(f"Traitement message {message_id} dans queue {thread_id}")
+
+            # Générer réponse IA
+            response_text = generate_ai_response_simple(
+                message_body, 
+                thread_id, 
+                sender, 
+                openai_file_id
+            )
+
+            # Nettoyer la réponse
+            response_text = clean_response(response_text)
+
+            if not response_text:
+                logger.error(f"Réponse IA vide pour message {message_id}")
+                response_text = "Désolé, je n'ai pas pu générer de réponse."
+
+            # Envoyer via WhatsApp
+            api_response = send_whatsapp_message(
+                sender, 
+                response_text, 
+                phone_number_id
+            )
+
+            # Vérifier succès envoi (sinon le job est retenté)
+            if not (api_response and 'messages' in api_response):
+                raise JobFailedError(f"Échec envoi WhatsApp pour message {message_id}")
+
+            # Sauvegarder message outbound
             try:
-                db.session.remove()
-            except:
-                pass
+                outbound_msg = WhatsAppMessage(
+                    message_id=api_response['messages'][0]['id'],
+                    to_number=sender,
+                    content=response_text,
+                    direction='outbound',
+                    status='sent',
+                    thread_id=thread_id
+                )
+                db.session.add(outbound_msg)
+                db.session.commit()
+                logger.info(f"Message outbound sauvegardé pour {thread_id}")
+                schedule_summary_refresh('whatsapp', thread_id)
+
+            except Exception as db_error:
+                logger.error(f"Erreur sauvegarde outbound: {db_error}")
+                db.session.rollback()
+
+        except Exception as process_error:
+            logger.error(f"Erreur traitement message {message_id}: {process_error}")
+            db.session.rollback()
+            # Propager : make_job_handler appelle fail_job (nouvelle tentative ou abandon)
+            raise
+        finally:
+            db.session.remove()
+
+
+def _notify_whatsapp_failure(payload):
+    """Prévient l'utilisateur quand son message est abandonné après toutes ses tentatives"""
+    sender = payload.get('message', {}).get('from') or payload.get('sender')
+    if sender and payload.get('phone_number_id'):
+        send_whatsapp_message(sender, WHATSAPP_FAILURE_MESSAGE, payload['phone_number_id'])
+
+
+def _is_mergeable_whatsapp_job(payload):
+    """Seuls les messages texte bruts du webhook sont fusionnés en rafale"""
+    return payload.get('message', {}).get('type') == 'text'
+
 
-    # Nettoyage à la sortie
-    with _dict_lock:
-        if thread_id in _processing_threads:
-            del _processing_threads[thread_id]
+def _merge_whatsapp_burst(payload, followups):
+    """Regroupe les messages d'une rafale dans le job du premier message"""
+    return dict(payload, burst=[p['message'] for p in followups])
 
-    logger.info(f"Worker terminé pour thread {thread_id}")
+
+_worker_pool = ShardedWorkerPool(
+    'whatsapp',
+    make_job_handler(
+        'whatsapp',
+        process_whatsapp_job,
+        merge=_merge_whatsapp_burst,
+        can_merge=_is_mergeable_whatsapp_job,
+        coalesce_window=WHATSAPP_COALESCE_WINDOW,
+        on_give_up=_notify_whatsapp_failure
+    ),
+    num_workers=WHATSAPP_WORKERS,
+    max_queue_size=WHATSAPP_QUEUE_SIZE,
+    drain_timeout=WHATSAPP_DRAIN_TIMEOUT
+)
+# Les messages passent par la file durable (inbound_job) avant d'atteindre le pool
+_inbound_consumer = DurableQueueConsumer('whatsapp', _worker_pool)
+# Débit entrant par numéro (seau à jetons)
+_rate_limiter = get_limiter('whatsapp')
+
+
+def start_inbound_consumer():
+    """Démarre le consommateur de la file durable (reprise des messages en attente au démarrage)"""
+    _inbound_consumer.start()
+
+
+def _enqueue_payload(message_id, conversation_key, payload):
+    """
+    Enregistre un travail dans la file durable (repli en mémoire si la base est indisponible).
+    Doit être appelé dans un app_context.
+
+    Returns:
+        bool: False si le travail n'a pu être ni enregistré ni mis en file en mémoire
+    """
+    try:
+        if enqueue_job('whatsapp', message_id, conversation_key, payload):
+            logger.info(f"Message {message_id} ajouté à la queue {conversation_key}")
+        _inbound_consumer.notify()
+        return True
+    except Exception as e:
+        # Base indisponible : repli sur la file en mémoire (non durable)
+        logger.error(f"File durable indisponible pour {message_id}, repli en mémoire: {e}")
+        db.session.rollback()
+        return _worker_pool.submit(conversation_key, {'payload': payload})
+
+
+def enqueue_whatsapp_message(thread_id, sender, phone_number_id, message_body, message_id, openai_file_id=None):
+    """
+    Enregistre un message déjà préparé dans la file durable de son utilisateur.
+    Doit être appelé dans un app_context.
+
+    Returns:
+        bool: False si le message n'a pu être ni enregistré ni mis en file en mémoire
+    """
+    payload = {
+        'thread_id': thread_id,
+        'sender': sender,
+        'phone_number_id': phone_number_id,
+        'body': message_body,
+        'openai_file_id': openai_file_id,
+        'message_id': message_id
+    }
+    # Même clé que le webhook (numéro de l'utilisateur) pour conserver l'ordre
+    return _enqueue_payload(message_id, sender, payload)
+
+
+def get_whatsapp_queue_stats():
+    """Retourne les métriques du pool de workers WhatsApp"""
+    return _worker_pool.stats()
 
 # Fonction modifiée pour également retourner les données en base64 pour Mathpix
 def download_whatsapp_image(image_id):
@@ -259,28 +558,16 @@ def download_whatsapp_image(image_id):
         logger.error("Missing WhatsApp credentials")
         raise ValueError("Missing WhatsApp credentials")
 
-    url = f"https://graph.facebook.com/v17.0/{image_id}"
-
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-
     try:
-        # Première requête pour obtenir l'URL de l'image
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+        graph = get_graph_client()
 
-        if 'url' not in data:
-            logger.error(f"No URL in image data: {data}")
+        # Première requête pour obtenir l'URL de l'image
+        media_url = graph.get_media_url(image_id)
+        if not media_url:
             return None, None
 
-        # Deuxième requête pour télécharger l'image réelle
-        image_response = requests.get(data['url'], headers=headers)
-        image_response.raise_for_status()
-
-        # Obtenir le contenu binaire de l'image
-        image_content = image_response.content
+        # Deuxième requête pour télécharger l'image réelle (streaming, taille bornée)
+        image_content = graph.download_media(media_url)
 
         # Encoder l'image en base64 pour Mathpix
         import base64
@@ -297,7 +584,8 @@ def download_whatsapp_image(image_id):
             f.write(image_content)
 
         # Retourner l'URL locale de l'image ET les données base64
-        local_url = request.url_root.rstrip('/') + f"/{Config.UPLOAD_FOLDER}/{filename}"
+        # (chemin relatif : appelé depuis un worker, hors contexte de requête)
+        local_url = f"/{Config.UPLOAD_FOLDER}/{filename}"
         return local_url, base64_data
 
     except Exception as e:
@@ -309,6 +597,7 @@ def generate_ai_response_simple(message_body, thread_id, sender=None, openai_fil
     Generate response using the configured AI model.
     Version simplifiée SANS gestion de verrous (géré par la queue).
     DOIT être appelée dans un contexte Flask (app.app_context()).
+    Lève JobFailedError si la génération échoue (le job est retenté).
     """
 
     # === DÉBUT : LECTURE ET INJECTION MÉMOIRE (WHATSAPP) ===
@@ -344,6 +633,15 @@ def generate_ai_response_simple(message_body, thread_id, sender=None, openai_fil
     current_model_key = CURRENT_MODEL
     logger.info(f"Thread {thread_id}: Modèle configuré: {current_model_key}")
 
+    # Résumé glissant : l'Assistant ne reçoit que les derniers messages du thread + le résumé
+    run_options = {}
+    summary_context = get_summary_context('whatsapp', thread_id)
+    if summary_context:
+        run_options = {
+            "additional_instructions": summary_context,
+            "truncation_strategy": {"type": "last_messages", "last_messages": CONTEXT_MESSAGE_LIMIT}
+        }
+
     # --- Logique OpenAI Assistant avec RETRY ---
     if current_model_key == 'openai':
         max_retries = 2  # Total de 3 tentatives
@@ -356,6 +654,8 @@ def generate_ai_response_simple(message_body, thread_id, sender=None, openai_fil
                     eventlet.sleep(2)  # Attendre 2 secondes avant retry
 
                 logger.info(f"Thread {thread_id}: Tentative {attempt + 1}/{max_retries + 1} avec OpenAI Assistant.")
+                # Clé choisie à chaque tentative dans le pool OpenAI
+                client = get_provider_client('openai')
 
                 # ÉTAPE 1 : Vérifier et annuler tout run actif avant de créer un nouveau
                 runs_list = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
@@ -398,32 +698,18 @@ def generate_ai_response_simple(message_body, thread_id, sender=None, openai_fil
                 # ÉTAPE 6 : Créer et exécuter la run
                 run = client.beta.threads.runs.create(
                     thread_id=thread_id, 
-                    assistant_id=ASSISTANT_ID
+                    assistant_id=ASSISTANT_ID,
+                    **run_options
                 )
                 logger.debug(f"Thread {thread_id}: Run {run.id} créée (tentative {attempt + 1}).")
 
-                # ÉTAPE 7 : Attendre la fin de la run
-                timeout = 120
-                start_time = time.time()
-
-                while True:
-                    if time.time() - start_time > timeout:
-                        logger.error(f"Thread {thread_id}: Timeout run {run.id}")
-                        raise TimeoutError("OpenAI response timed out")
-
-                    run_status = client.beta.threads.runs.retrieve(
-                        thread_id=thread_id, 
-                        run_id=run.id
-                    )
-
-                    if run_status.status == 'completed':
-                        logger.info(f"Thread {thread_id}: Run {run.id} terminée.")
-                        break
-                    elif run_status.status in ['failed', 'cancelled', 'expired']:
-                        logger.error(f"Thread {thread_id}: Run échouée: {run_status.status}")
-                        raise Exception(f"Run failed with status: {run_status.status}")
-
-                    eventlet.sleep(1)
+                # ÉTAPE 7 : Attendre la fin de la run (suivi partagé, voir run_poller)
+                try:
+                    wait_for_run(thread_id, run.id, timeout=120)
+                    logger.info(f"Thread {thread_id}: Run {run.id} terminée.")
+                except RunFailedError as e:
+                    logger.error(f"Thread {thread_id}: Run échouée: {e.run.status}")
+                    raise
 
                 # ÉTAPE 8 : Récupérer la réponse
                 messages = client.beta.threads.messages.list(
@@ -449,10 +735,10 @@ def generate_ai_response_simple(message_body, thread_id, sender=None, openai_fil
                     logger.error(f"Thread {thread_id}: OpenAI échoué définitivement après {max_retries + 1} tentatives")
                 # Sinon, on continue la boucle (retry automatique)
 
-    # Si OpenAI a échoué après tous les retry
+    # Si OpenAI a échoué après tous les retry : le job sera retenté par la file durable
     if response is None:
         logger.error(f"Thread {thread_id}: OpenAI échoué définitivement")
-        return "Désolé, une erreur s'est produite. Veuillez réessayer."
+        raise JobFailedError(f"Génération IA en échec pour le thread {thread_id}")
 
     # Tout s'est bien passé, retourner la réponse
     return response
@@ -466,31 +752,11 @@ def send_whatsapp_message(to_number, message, from_phone_id): # Ajout de from_ph
         logger.error("Missing WhatsApp credentials or from_phone_id")
         raise ValueError("Missing WhatsApp credentials or from_phone_id")
 
-    url = f"https://graph.facebook.com/v17.0/{from_phone_id}/messages" # On utilise le from_phone_id dynamique
-
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-
     if not to_number.startswith('+'):
         to_number = '+' + to_number
 
-    data = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": to_number,
-        "type": "text",
-        "text": {
-            "preview_url": False,
-            "body": message
-        }
-    }
-
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json()
+        return get_graph_client().send_text(from_phone_id, to_number, message)
     except requests.exceptions.RequestException as e:
         logger.error(f"Error sending WhatsApp message: {e}")
         raise
@@ -679,28 +945,19 @@ def trigger_ai_as_user(thread_id):
             message_data = {
                 'body': admin_message_content,
                 'openai_file_id': None,  # Pas d'image depuis admin
-                'message_id': f"admin_{int(time.time())}"
+                'message_id': f"admin_{int(time.time() * 1000)}"
             }
 
-            # Ajouter à la queue
-            with _dict_lock:
-                queue = _message_queues[thread_id]
-                queue.put(message_data)
-                logger.info(f"Message admin ajouté à la queue {thread_id}")
-
-                # Démarrer worker si nécessaire
-                if thread_id not in _processing_threads or not _processing_threads[thread_id].is_alive():
-                    phone_id = os.getenv('WHATSAPP_PHONE_ID')
-
-                    processing_thread = Thread(
-                        target=process_message_queue,
-                        args=(thread_id, user_phone, phone_id),
-                        daemon=True,
-                        name=f"WhatsApp-Worker-Admin-{thread_id[:8]}"
-                    )
-                    processing_thread.start()
-                    _processing_threads[thread_id] = processing_thread
-                    logger.info(f"Worker démarré pour trigger admin sur {thread_id}")
+            # Ajouter à la queue de la conversation
+            queued = enqueue_whatsapp_message(
+                thread_id,
+                user_phone,
+                os.getenv('WHATSAPP_PHONE_ID'),
+                message_data['body'],
+                message_data['message_id']
+            )
+            if not queued:
+                return jsonify({'error': 'WhatsApp queue is full, try again later'}), 503
 
             # Retourner succès immédiat (message en queue)
             return jsonify({
@@ -745,6 +1002,13 @@ def verify_webhook_signature(request_data, signature_header):
         logger.error(f"Error verifying signature: {str(e)}")
         return False
 
+@whatsapp.route('/admin/whatsapp/queue-stats', methods=['GET'])
+def whatsapp_queue_stats():
+    """Métriques du pool de workers WhatsApp (profondeur des files, refus, attente max), des caches et des statuts"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return jsonify(dict(get_whatsapp_queue_stats(), caches=get_cache_stats(), statuses=get_status_stats()))
+
 @whatsapp.route('/webhook', methods=['GET'])
 def verify_webhook():
     """Handle the webhook verification request from WhatsApp"""
@@ -792,11 +1056,6 @@ def receive_webhook():
             logger.warning("Invalid webhook payload format")
             return jsonify({"error": "Invalid payload format"}), 400
 
-        # Récupérer la configuration actuelle au début pour éviter les incohérences
-        from ai_config import CURRENT_MODEL
-        current_model = CURRENT_MODEL
-        logger.info(f"Processing webhook with active model: {current_model}")
-
         for entry in data.get('entry', []):
             for change in entry.get('changes', []):
                 value = change.get('value', {})
@@ -809,242 +1068,41 @@ def receive_webhook():
                     logger.warning("phone_number_id not found in webhook metadata. Skipping change.")
                     continue
 
-                # Handle messages
+                # Handle messages : accusé de réception immédiat, tout le traitement
+                # (User, thread, image, IA) est fait en arrière-plan par le pool
                 for message in value.get('messages', []):
                     sender = message.get('from')
                     message_id = message.get('id')
                     message_type = message.get('type')
 
-                    logger.info(f"Processing {message_type} message from {sender}")
-
-                    # === DÉBUT : CRÉATION AUTOMATIQUE DU USER ===
-                    # Ce bloc est placé ici car 'sender' est maintenant défini.
-                    from app import app
-                    with app.app_context():
-                        user_phone_id = f"whatsapp_{sender}"
-                        existing_user = User.query.filter_by(phone_number=user_phone_id).first()
-
-                        if not existing_user:
-                            logger.info(f"Premier message de {sender}. Création d'un User associé.")
-                            new_user = User(
-                                phone_number=user_phone_id,
-                                first_name="Utilisateur",
-                                last_name=f"WA {sender[-4:]}",
-                                age=0,
-                                study_level="Non défini",
-                                grade_goals="average"
-                            )
-                            db.session.add(new_user)
-                            db.session.commit()
-                            logger.info(f"✅ User créé (ID: {new_user.id}) pour WhatsApp {sender}")
-                    # === FIN : CRÉATION AUTOMATIQUE DU USER ===
-
-                    # Vérifier si le message a déjà été traité pour éviter les doublons
-                    try:
-                        existing_message = WhatsAppMessage.query.filter_by(message_id=message_id).first()
-                        if existing_message:
-                            logger.info(f"Message {message_id} already processed. Skipping.")
-                            continue
-                    except Exception as db_check_error:
-                        logger.warning(f"Error checking message existence: {str(db_check_error)}")
-                        # Continuer même en cas d'erreur de vérification
+                    if message_type not in SUPPORTED_MESSAGE_TYPES:
+                        # Type de message non supporté - ne pas envoyer de message d'erreur à l'utilisateur
+                        logger.info(f"Unsupported message type: {message_type} - skipping")
+                        continue
 
-                    try:
-                        # Récupérer ou créer un thread pour cet utilisateur - sans forcer un nouveau thread
-                        max_retries = 3  # Définir cette variable car elle est utilisée ailleurs dans le code
-                        thread_id = None
-                        try:
-                            # Utiliser le thread existant plutôt que d'en créer un nouveau
-                            thread_id = get_or_create_thread(sender, force_new=False)
-                            if not thread_id:
-                                # Uniquement en cas d'échec, créer un thread de secours
-                                logger.error(f"Impossible de récupérer un thread pour {sender}")
-                                thread_id = f"thread_{sender}_{int(time.time())}_fallback"
-                        except Exception as thread_error:
-                            logger.error(f"Erreur lors de la récupération du thread: {str(thread_error)}")
-                            thread_id = f"thread_{sender}_{int(time.time())}_fallback"
-
-                        # Vérifier si c'est une nouvelle conversation mais sans influer sur la création de thread
-                        try:
-                            # Vérifier si c'est la première fois qu'on utilise ce thread
-                            is_new_conversation = not WhatsAppMessage.query.filter_by(thread_id=thread_id).first()
-                            if is_new_conversation:
-                                # Émettre l'événement de nouvelle conversation
-                                from app import socketio
-                                conversation_data = {
-                                    'id': thread_id,
-                                    'title': f"Conversation WhatsApp",
-                                    'thread_id': thread_id,
-                                    'user_phone': sender,
-                                    'created_at': datetime.now().strftime('%d/%m/%Y %H:%M'),
-                                    'platform': 'whatsapp'
-                                }
-                                socketio.emit('new_whatsapp_conversation', conversation_data)
-                                logger.info(f"Émission de l'événement new_whatsapp_conversation pour {thread_id}")
-                        except Exception as event_error:
-                            logger.error(f"Erreur lors de l'émission de l'événement: {str(event_error)}")
-                            # Continuer malgré l'erreur d'émission
-
-                        # Traiter différemment selon le type de message
-                        message_body = None
-
-                        if message_type == 'text':
-                            message_body = message.get('text', {}).get('body', '')
-                            logger.info(f"Text message: {message_body[:100]}...")
-
-                        elif message_type == 'image':
-                            # Récupérer l'ID de l'image avec retentatives
-                            image_id = message.get('image', {}).get('id')
-                            if image_id:
-                                # Télécharger l'image avec retentatives
-                                image_url = None
-                                base64_data = None
-                                for attempt in range(max_retries):
-                                    try:
-                                        image_url, base64_data = download_whatsapp_image(image_id)
-                                        if image_url and base64_data:
-                                            break
-                                    except Exception as img_error:
-                                        if attempt == max_retries - 1:
-                                            logger.error(f"Failed to download image after {max_retries} attempts")
-                                        else:
-                                            logger.warning(f"Image download error (attempt {attempt+1}): {str(img_error)}")
-                                            time.sleep(1)
-
-                                logger.info(f"Image processing status: URL={bool(image_url)}, base64={bool(base64_data)}")
-
-                                # Récupérer la légende si présente
-                                caption = message.get('image', {}).get('caption', '')
-
-                                # Variables communes
-                                mathpix_result = None
-                                formatted_summary = None
-                                openai_file_id = None
-
-                                # Traitement différencié selon le modèle
-                                if current_model == 'openai':
-                                    # Pour OpenAI: utiliser la double approche (Vision + OCR)
-                                    logger.info("Modèle OpenAI détecté dans WhatsApp: utilisation de Vision API + Mathpix OCR")
-
-                                    # Construire le chemin du fichier local
-                                    filename = f"{image_id}_{int(time.time())}.jpg"
-                                    file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
-
-                                    # Utiliser la fonction de traitement combiné
-                                    try:
-                                        openai_file_id, message_for_assistant, process_info = process_image_for_openai(
-                                            file_path, base64_data, caption, platform="WhatsApp"
-                                        )
-                                        logger.info(f"Traitement OpenAI WhatsApp complété - Mathpix: {process_info['mathpix_success']}, Upload: {process_info['openai_success']}")
-                                    except Exception as process_error:
-                                        logger.error(f"Échec complet du traitement d'image OpenAI WhatsApp: {str(process_error)}")
-                                        # Utiliser un message d'erreur par défaut
-                                        message_for_assistant = "Erreur lors du traitement de l'image. Veuillez réessayer."
-                                        openai_file_id = None
-                                else:
-                                    # Pour les autres modèles: utiliser Mathpix comme avant
-                                    logger.info(f"Modèle {current_model} détecté dans WhatsApp: utilisation de Mathpix")
-                                    if base64_data:
-                                        try:
-                                            mathpix_result = process_image_with_mathpix(base64_data)
-                                            if "error" not in mathpix_result:
-                                                formatted_summary = mathpix_result.get("formatted_summary", "")
-                                        except Exception as mathpix_error:
-                                            logger.error(f"Mathpix processing error: {str(mathpix_error)}")
-                                            # Continuer sans extraction plutôt que d'échouer complètement
-
-                                # Pour OpenAI, message_for_assistant est déjà préparé
-                                if current_model != 'openai':
-                                    # Construire le message pour les autres modèles
-                                    message_for_assistant = ""
-                                    if caption:
-                                        message_for_assistant += f"{caption}\n\n"
-
-                                    if formatted_summary:
-                                        message_for_assistant += formatted_summary
-                                    else:
-                                        if not caption:
-                                            message_for_assistant = "Please analyze the content I shared."
-
-                                # Définir le message à envoyer à l'IA et à stocker
-                                message_body = message_for_assistant
-
-                        else:
-                            # Type de message non supporté - ne pas envoyer de message d'erreur à l'utilisateur
-                            # mais juste logger l'information et continuer
-                            logger.info(f"Unsupported message type: {message_type} - skipping")
-                            continue
-
-                        # Si on arrive ici, on a un message_body à traiter
-                        if not message_body:
-                            logger.warning(f"Empty message body for {message_type} message. Skipping.")
-                            continue
-
-                        # Store incoming message dans une transaction indépendante
-                        try:
-                            new_message = WhatsAppMessage(
-                                message_id=message_id,
-                                from_number=sender,
-                                content=message_body,
-                                direction='inbound',
-                                thread_id=thread_id
-                            )
-                            db.session.add(new_message)
-                            db.session.commit()
-                            logger.info(f"Stored inbound message ID {message_id}")
-                        except Exception as db_error:
-                            logger.error(f"Database error storing inbound message: {str(db_error)}")
-                            db.session.rollback()
-                        finally:
-                            db.session.remove()
-
-                        # Préparer les données pour la queue
-                        message_data = {
-                            'body': message_body,
-                            'openai_file_id': locals().get('openai_file_id'),
-                            'message_id': message_id
-                        }
-
-                        # Ajouter à la queue et démarrer worker si nécessaire
-                        with _dict_lock:
-                            queue = _message_queues[thread_id]
-                            queue.put(message_data)
-                            logger.info(f"Message {message_id} ajouté à la queue {thread_id}")
-
-                            # Démarrer un thread de traitement s'il n'existe pas ou est mort
-                            if thread_id not in _processing_threads or not _processing_threads[thread_id].is_alive():
-                                processing_thread = Thread(
-                                    target=process_message_queue,
-                                    args=(thread_id, sender, phone_number_id),
-                                    daemon=True,
-                                    name=f"WhatsApp-Worker-{thread_id[:8]}"
-                                )
-                                processing_thread.start()
-                                _processing_threads[thread_id] = processing_thread
-                                logger.info(f"Worker thread démarré pour {thread_id}")
-
-                    except Exception as process_error:
-                        logger.error(f"Error processing message {message_id}: {str(process_error)}")
-                        # Ne pas envoyer de message d'erreur à l'utilisateur et passer au message suivant
+                    if is_recent_message(message_id):
+                        logger.info(f"Message {message_id} already received. Skipping.")
                         continue
 
-                # Handle message statuses - traité de manière indépendante des messages
-                for status in value.get('statuses', []):
-                    try:
-                        message_id = status.get('id')
-                        status_value = status.get('status')
-
-                        logger.debug(f"Processing status update for message {message_id}: {status_value}")
-
-                        message = WhatsAppMessage.query.filter_by(message_id=message_id).first()
-                        if message:
-                            message.status = status_value
-                            db.session.commit()
-                    except Exception as status_error:
-                        logger.error(f"Error processing status update: {str(status_error)}")
-                        db.session.rollback()
+                    if not _rate_limiter.allow(sender):
+                        # Débit dépassé : pas de génération, réponse toute faite au plus une fois par intervalle
+                        remember_message(message_id)
+                        if _rate_limiter.should_notify(sender):
+                            eventlet.spawn(send_whatsapp_message, sender, BOT_RATE_LIMIT_MESSAGE, phone_number_id)
                         continue
 
+                    payload = {'message': message, 'phone_number_id': phone_number_id}
+                    if _enqueue_payload(message_id, sender, payload):
+                        remember_message(message_id)
+                    else:
+                        # Backpressure : prévenir l'élève plutôt que d'empiler indéfiniment,
+                        # hors de la requête (l'envoi et ses retries ne doivent pas retarder l'ACK)
+                        eventlet.spawn(send_whatsapp_message, sender, WHATSAPP_BUSY_MESSAGE, phone_number_id)
+
+                # Handle message statuses - appliqués en lot en arrière-plan (whatsapp_status)
+                if value.get('statuses'):
+                    record_statuses(value['statuses'])
+
         return jsonify({"status": "success"}), 200
 
     except Exception as e:
@@ -0,0 +1,125 @@
+"""
+Caches en mémoire du chemin entrant WhatsApp.
+
+- Identités : numéro -> (user_id, thread_id) pour les utilisateurs connus.
+  Un message d'un utilisateur déjà vu ne refait ni la recherche du User,
+  ni get_or_create_thread (requête triée sur l'historique + vérification
+  du thread OpenAI), ni le test de nouvelle conversation.
+- Messages récents : IDs des derniers messages reçus par le webhook, pour
+  écarter les renvois de Meta sans aller jusqu'à la base. La contrainte
+  unique de inbound_job reste le filet de sécurité (autre processus, cache plein).
+
+Les deux caches sont bornés (LRU) et propres au processus ; une entrée
+d'identité expire après WHATSAPP_IDENTITY_TTL secondes ou quand le modèle
+actif change, la base redevient alors la référence.
+
+Déploiement : le cache suppose un seul processus (gunicorn --workers 1, cf.
+Dockerfile). Les invalidations de l'admin (forget_identity, forget_thread) ne
+touchent que le processus qui traite la requête admin : avec plusieurs
+workers ou instances, les autres gardent l'ancienne identité jusqu'à
+WHATSAPP_IDENTITY_TTL, qui borne donc la durée d'une identité périmée.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+WHATSAPP_IDENTITY_CACHE_SIZE = int(os.environ.get('WHATSAPP_IDENTITY_CACHE_SIZE', '5000'))
+# Durée max d'une identité périmée sur les autres processus (invalidation locale seulement)
+WHATSAPP_IDENTITY_TTL = int(os.environ.get('WHATSAPP_IDENTITY_TTL', '600'))
+WHATSAPP_RECENT_IDS_SIZE = int(os.environ.get('WHATSAPP_RECENT_IDS_SIZE', '10000'))
+
+_identities = OrderedDict()  # phone -> {'user_id', 'thread_id', 'model', 'cached_at'}
+_recent_ids = OrderedDict()  # message_id -> None
+_lock = threading.Lock()
+_stats = {'identity_hits': 0, 'identity_misses': 0, 'duplicates_skipped': 0}
+
+
+# ===================================
+# IDENTITÉS
+# ===================================
+
+def get_identity(phone, current_model):
+    """
+    Retourne l'identité en cache d'un numéro WhatsApp.
+
+    Returns:
+        dict: {'user_id', 'thread_id'} ou None (absente, expirée ou autre modèle)
+    """
+    with _lock:
+        entry = _identities.get(phone)
+        if entry and entry['model'] == current_model \
+                and time.time() - entry['cached_at'] < WHATSAPP_IDENTITY_TTL:
+            _identities.move_to_end(phone)
+            _stats['identity_hits'] += 1
+            return {'user_id': entry['user_id'], 'thread_id': entry['thread_id']}
+        if entry:
+            del _identities[phone]
+        _stats['identity_misses'] += 1
+        return None
+
+
+def remember_identity(phone, user_id, thread_id, current_model):
+    """Enregistre l'identité résolue d'un numéro (les threads de secours ne sont pas conservés)"""
+    if not thread_id or thread_id.endswith('_fallback'):
+        return
+    with _lock:
+        _identities[phone] = {
+            'user_id': user_id,
+            'thread_id': thread_id,
+            'model': current_model,
+            'cached_at': time.time()
+        }
+        _identities.move_to_end(phone)
+        while len(_identities) > WHATSAPP_IDENTITY_CACHE_SIZE:
+            _identities.popitem(last=False)
+
+
+def forget_identity(phone):
+    """Invalide l'identité d'un numéro (suppression du User, nouveau thread forcé), dans ce processus"""
+    with _lock:
+        _identities.pop(phone, None)
+
+
+def forget_thread(thread_id):
+    """Invalide les identités pointant vers un thread supprimé, dans ce processus"""
+    with _lock:
+        for phone in [p for p, e in _identities.items() if e['thread_id'] == thread_id]:
+            del _identities[phone]
+
+
+# ===================================
+# MESSAGES RÉCENTS
+# ===================================
+
+def is_recent_message(message_id):
+    """True si ce message a déjà été reçu récemment par ce processus"""
+    with _lock:
+        if message_id in _recent_ids:
+            _stats['duplicates_skipped'] += 1
+            return True
+        return False
+
+
+def remember_message(message_id):
+    """Enregistre un message reçu (mis en file)"""
+    with _lock:
+        _recent_ids[message_id] = None
+        while len(_recent_ids) > WHATSAPP_RECENT_IDS_SIZE:
+            _recent_ids.popitem(last=False)
+
+
+def get_cache_stats():
+    """Taille et efficacité des caches (monitoring)"""
+    with _lock:
+        stats = dict(_stats)
+        stats.update({
+            'identities': len(_identities),
+            'recent_message_ids': len(_recent_ids)
+        })
+    return stats
@@ -0,0 +1,193 @@
+"""
+Client HTTP partagé pour l'API Graph de WhatsApp (Meta).
+
+Une seule session requests par processus : les connexions TLS vers
+graph.facebook.com (et le CDN des médias) sont réutilisées au lieu d'être
+ouvertes à chaque envoi ou téléchargement.
+
+- Timeouts systématiques (connexion / lecture), y compris pour les médias
+- Nouvelles tentatives avec backoff exponentiel et jitter sur 429 et 5xx
+  (en respectant Retry-After), et sur les erreurs de connexion
+- Téléchargement des médias en streaming, borné par WHATSAPP_MEDIA_MAX_BYTES
+
+L'URL de base (WHATSAPP_GRAPH_BASE_URL) peut pointer vers un serveur local
+de test qui imite l'API Graph.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+WHATSAPP_GRAPH_BASE_URL = os.environ.get('WHATSAPP_GRAPH_BASE_URL', 'https://graph.facebook.com/v17.0').rstrip('/')
+WHATSAPP_HTTP_POOL_SIZE = int(os.environ.get('WHATSAPP_HTTP_POOL_SIZE', '20'))
+WHATSAPP_HTTP_CONNECT_TIMEOUT = float(os.environ.get('WHATSAPP_HTTP_CONNECT_TIMEOUT', '5'))
+WHATSAPP_HTTP_READ_TIMEOUT = float(os.environ.get('WHATSAPP_HTTP_READ_TIMEOUT', '30'))
+WHATSAPP_MEDIA_TIMEOUT = float(os.environ.get('WHATSAPP_MEDIA_TIMEOUT', '60'))
+WHATSAPP_HTTP_RETRIES = int(os.environ.get('WHATSAPP_HTTP_RETRIES', '3'))
+WHATSAPP_RETRY_BACKOFF = float(os.environ.get('WHATSAPP_RETRY_BACKOFF', '0.5'))
+WHATSAPP_MEDIA_MAX_BYTES = int(os.environ.get('WHATSAPP_MEDIA_MAX_BYTES', str(16 * 1024 * 1024)))
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLargeError(ValueError):
+    """Média plus volumineux que WHATSAPP_MEDIA_MAX_BYTES"""
+
+
+class GraphApiClient:
+    """Client de l'API Graph avec pool de connexions keep-alive et retries"""
+
+    def __init__(self, base_url=WHATSAPP_GRAPH_BASE_URL, pool_size=WHATSAPP_HTTP_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        # Retries gérés par _request (jitter, Retry-After), pas par urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _headers(self, extra=None):
+        token = os.environ.get('WHATSAPP_API_TOKEN')
+        if not token:
+            raise ValueError("Missing WhatsApp credentials")
+        headers = {"Authorization": f"Bearer {token}"}
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def _url(self, path_or_url):
+        if path_or_url.startswith(('http://', 'https://')):
+            return path_or_url
+        return f"{self.base_url}/{path_or_url.lstrip('/')}"
+
+    @staticmethod
+    def _backoff(attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), 30.0)
+            except ValueError:
+                pass
+        # Full jitter : évite que les workers réessaient tous en même temps
+        return random.uniform(0, WHATSAPP_RETRY_BACKOFF * (2 ** attempt))
+
+    def _request(self, method, path_or_url, timeout=None, stream=False, **kwargs):
+        """
+        Exécute une requête avec retries sur 429/5xx et erreurs de connexion.
+
+        Returns:
+            requests.Response: réponse finale (raise_for_status déjà appelé)
+        """
+        url = self._url(path_or_url)
+        timeout = timeout or (WHATSAPP_HTTP_CONNECT_TIMEOUT, WHATSAPP_HTTP_READ_TIMEOUT)
+
+        for attempt in range(WHATSAPP_HTTP_RETRIES + 1):
+            last_attempt = attempt == WHATSAPP_HTTP_RETRIES
+            try:
+                response = self.session.request(method, url, timeout=timeout, stream=stream, **kwargs)
+            except requests.exceptions.ReadTimeout:
+                # Requête peut-être traitée côté Meta : pas de nouvel envoi d'un POST
+                if method != 'GET' or last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+            except requests.exceptions.ConnectionError:
+                if last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in _RETRY_STATUSES or last_attempt:
+                    response.raise_for_status()
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+
+            logger.warning(f"Graph API {method} {url}: nouvelle tentative {attempt + 1}/{WHATSAPP_HTTP_RETRIES} dans {delay:.2f}s")
+            time.sleep(delay)
+
+    # ===================================
+    # MESSAGES
+    # ===================================
+
+    def send_text(self, phone_number_id, to_number, body):
+        """Envoie un message texte, retourne la réponse JSON de l'API"""
+        data = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": to_number,
+            "type": "text",
+            "text": {
+                "preview_url": False,
+                "body": body
+            }
+        }
+        response = self._request(
+            'POST', f"{phone_number_id}/messages",
+            headers=self._headers({"Content-Type": "application/json"}),
+            json=data
+        )
+        return response.json()
+
+    # ===================================
+    # MÉDIAS
+    # ===================================
+
+    def get_media_url(self, media_id):
+        """Retourne l'URL de téléchargement d'un média, ou None"""
+        data = self._request('GET', media_id, headers=self._headers()).json()
+        if 'url' not in data:
+            logger.error(f"No URL in media data: {data}")
+            return None
+        return data['url']
+
+    def download_media(self, media_url, max_bytes=WHATSAPP_MEDIA_MAX_BYTES):
+        """
+        Télécharge un média en streaming.
+
+        Returns:
+            bytes: Contenu du média
+
+        Raises:
+            MediaTooLargeError: si le média dépasse max_bytes
+        """
+        response = self._request(
+            'GET', media_url,
+            headers=self._headers(),
+            timeout=(WHATSAPP_HTTP_CONNECT_TIMEOUT, WHATSAPP_MEDIA_TIMEOUT),
+            stream=True
+        )
+        with response:
+            declared = int(response.headers.get('Content-Length') or 0)
+            if declared > max_bytes:
+                raise MediaTooLargeError(f"Media too large: {declared} bytes")
+
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=_MEDIA_CHUNK_SIZE):
+                content.extend(chunk)
+                if len(content) > max_bytes:
+                    raise MediaTooLargeError(f"Media too large: more than {max_bytes} bytes")
+        return bytes(content)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_graph_client():
+    """Retourne le client Graph API partagé du processus"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphApiClient()
+    return _client
@@ -0,0 +1,142 @@
+"""
+Application groupée des statuts de livraison WhatsApp (sent, delivered, read).
+
+Meta envoie plusieurs statuts par message sortant : le webhook ne fait plus
+une requête + un commit par statut. Les statuts sont accumulés en mémoire
+(seul le plus avancé est gardé par message) puis appliqués toutes les
+WHATSAPP_STATUS_FLUSH_INTERVAL secondes, avec un UPDATE ... WHERE message_id IN (...)
+par valeur de statut et un seul commit.
+
+Un statut ne fait jamais reculer un message (read -> delivered est ignoré),
+même si Meta livre les webhooks dans le désordre.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+
+from sqlalchemy import or_
+
+from database import db
+from models import WhatsAppMessage
+
+logger = logging.getLogger(__name__)
+
+# ===================================
+# CONFIGURATION
+# ===================================
+
+WHATSAPP_STATUS_FLUSH_INTERVAL = float(os.environ.get('WHATSAPP_STATUS_FLUSH_INTERVAL', '2'))
+
+# Ordre de progression ; 'failed' ne remplace qu'un message encore 'sent'
+STATUS_RANKS = {'sent': 1, 'failed': 2, 'delivered': 2, 'read': 3}
+
+_pending = {}  # message_id -> statut le plus avancé reçu
+_lock = threading.Lock()
+_flusher = None
+_stats = {'received': 0, 'applied': 0, 'flushes': 0}
+
+
+def record_statuses(statuses):
+    """
+    Ajoute les statuts d'un payload webhook au tampon (aucune requête SQL).
+
+    Args:
+        statuses: Liste 'statuses' d'un change du webhook
+    """
+    global _flusher
+    with _lock:
+        for status in statuses:
+            message_id = status.get('id')
+            status_value = status.get('status')
+            if not message_id or status_value not in STATUS_RANKS:
+                continue
+            _stats['received'] += 1
+            current = _pending.get(message_id)
+            if current is None or STATUS_RANKS[status_value] > STATUS_RANKS[current]:
+                _pending[message_id] = status_value
+
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run, daemon=True, name='whatsapp-status')
+            _flusher.start()
+
+
+def _lower_statuses(status_value):
+    rank = STATUS_RANKS[status_value]
+    return [s for s, r in STATUS_RANKS.items() if r < rank]
+
+
+def flush_statuses():
+    """Applique les statuts en attente. Doit être appelé dans un app_context."""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+
+    by_status = {}
+    for message_id, status_value in batch.items():
+        by_status.setdefault(status_value, []).append(message_id)
+
+    applied = 0
+    try:
+        for status_value, message_ids in by_status.items():
+            applied += WhatsAppMessage.query.filter(
+                WhatsAppMessage.message_id.in_(message_ids),
+                or_(
+                    WhatsAppMessage.status.is_(None),
+                    WhatsAppMessage.status.in_(_lower_statuses(status_value))
+                )
+            ).update({'status': status_value}, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Remettre le lot en attente sans écraser un statut plus récent
+        with _lock:
+            for message_id, status_value in batch.items():
+                current = _pending.get(message_id)
+                if current is None or STATUS_RANKS[status_value] > STATUS_RANKS[current]:
+                    _pending[message_id] = status_value
+        raise
+
+    with _lock:
+        _stats['applied'] += applied
+        _stats['flushes'] += 1
+    logger.debug(f"Statuts WhatsApp appliqués: {applied}/{len(batch)}")
+    return applied
+
+
+def _flush_in_app_context():
+    from app import app  # Import local pour éviter circularité
+
+    with app.app_context():
+        try:
+            flush_statuses()
+        except Exception as e:
+            logger.error(f"Erreur application des statuts WhatsApp: {e}")
+        finally:
+            db.session.remove()
+
+
+def _run():
+    while True:
+        time.sleep(WHATSAPP_STATUS_FLUSH_INTERVAL)
+        _flush_in_app_context()
+
+
+def _flush_at_exit():
+    if _pending:
+        _flush_in_app_context()
+
+
+atexit.register(_flush_at_exit)
+
+
+def get_status_stats():
+    """Compteurs du tampon de statuts (monitoring)"""
+    with _lock:
+        stats = dict(_stats)
+        stats['pending'] = len(_pending)
+    return stats
@@ -0,0 +1,146 @@
+"""
+Pool de workers de taille fixe avec files partitionnées par clé.
+
+Chaque clé (ex: thread_id d'une conversation) est toujours envoyée sur la même
+file, traitée par un seul worker : l'ordre des messages d'une conversation est
+donc conservé, tandis que des conversations différentes avancent en parallèle.
+
+Les files sont bornées : submit() refuse un travail quand la file de la clé
+est pleine (backpressure explicite), au lieu de créer un thread de plus.
+"""
+
+import time
+import zlib
+import atexit
+import logging
+import threading
+from queue import Queue, Full, Empty
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ShardedWorkerPool:
+    """Pool de workers avec une file bornée par worker (partition par clé)"""
+
+    def __init__(self, name, handler, num_workers=8, max_queue_size=100, drain_timeout=30):
+        """
+        Args:
+            name: Nom du pool (logs, noms de threads)
+            handler: Fonction appelée avec chaque travail soumis
+            num_workers: Nombre de workers (et de files)
+            max_queue_size: Taille maximale de chaque file
+            drain_timeout: Temps maximal accordé à l'arrêt pour vider les files
+        """
+        self.name = name
+        self.handler = handler
+        self.num_workers = num_workers
+        self.drain_timeout = drain_timeout
+        self._queues = [Queue(maxsize=max_queue_size) for _ in range(num_workers)]
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'rejected': 0, 'max_wait': 0.0}
+
+    def _shard(self, key):
+        # crc32 plutôt que hash() : stable d'un processus à l'autre
+        return zlib.crc32(str(key).encode('utf-8')) % self.num_workers
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._run, args=(index,), daemon=True, name=f"{self.name}-{index}"
+                )
+                worker.start()
+                self._workers.append(worker)
+            atexit.register(self.shutdown)
+            logger.info(f"Pool {self.name} démarré ({self.num_workers} workers)")
+
+    def submit(self, key, job, timeout=0):
+        """
+        Ajoute un travail dans la file de sa clé.
+
+        Args:
+            key: Clé de partition (les travaux d'une même clé sont traités dans l'ordre)
+            job: Travail transmis au handler
+            timeout: Attente maximale (secondes) si la file est pleine
+
+        Returns:
+            bool: False si la file est pleine ou si le pool s'arrête
+        """
+        if self._stopping:
+            return False
+        self._ensure_started()
+
+        try:
+            self._queues[self._shard(key)].put((time.time(), job), timeout=timeout or None, block=timeout > 0)
+        except Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning(f"Pool {self.name}: file pleine pour {key}, travail refusé")
+            return False
+
+        with self._lock:
+            self._stats['submitted'] += 1
+        return True
+
+    def _run(self, index):
+        queue = self._queues[index]
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                queue.task_done()
+                return
+
+            enqueued_at, job = item
+            wait = time.time() - enqueued_at
+            try:
+                self.handler(job)
+                outcome = 'processed'
+            except Exception as e:
+                logger.error(f"Pool {self.name}: erreur worker {index}: {e}", exc_info=True)
+                outcome = 'failed'
+            finally:
+                queue.task_done()
+
+            with self._lock:
+                self._stats[outcome] += 1
+                self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+
+    def stats(self):
+        """Profondeur des files et compteurs (monitoring)"""
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'workers': self.num_workers,
+            'queue_depths': depths,
+            'queued': sum(depths),
+            'max_wait': round(stats['max_wait'], 2)
+        })
+        return stats
+
+    def shutdown(self):
+        """Refuse les nouveaux travaux et laisse les workers vider leurs files (drain_timeout max)"""
+        if self._stopping or not self._workers:
+            return
+        self._stopping = True
+        pending = sum(q.qsize() for q in self._queues)
+        logger.info(f"Pool {self.name}: arrêt, {pending} travail(aux) en attente")
+
+        deadline = time.time() + self.drain_timeout
+        for queue in self._queues:
+            try:
+                queue.put(_STOP, timeout=max(deadline - time.time(), 0.01))
+            except Full:
+                pass
+        for worker in self._workers:
+            worker.join(timeout=max(deadline - time.time(), 0))
+
+        remaining = sum(q.qsize() for q in self._queues)
+        if remaining:
+            logger.warning(f"Pool {self.name}: {remaining} travail(aux) non traité(s) à l'arrêt")